@@ -25,6 +25,7 @@ faf_mod = Extension('%s._fastqandfurious' % PACKAGENAME,
                     sources=['src/_fastqandfurious.c', ],
                     #depends=['src/.h'],
                     #include_dirs=['src',],
+                    libraries=['z'],
                     language='c',
                     extra_compile_args=(extra_compile_args +
                                         ['-O3', '-std=c99']))
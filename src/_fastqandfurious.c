@@ -1,8 +1,11 @@
 #define PY_SSIZE_T_CLEAN
 #include <Python.h>
 
+#include <math.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <string.h>
+#include <zlib.h>
 
 #define INVALID -1
 #define POS_HEAD_BEG 0
@@ -14,6 +17,376 @@
 #define COMPLETE 6
 #define MISSING_QUALHEADER_END 7
 
+/* FNV-1a (64 bits) */
+#define FNV_OFFSET 0xcbf29ce484222325ULL
+#define FNV_PRIME 0x100000001b3ULL
+
+/* Newline scanning
+ *
+ * Batches of entries are scanned with an index of the newlines in the blob:
+ * a bitmap with one bit for each character, built block by block as the scan
+ * progresses with the widest vector instructions available (chosen when the
+ * module is imported). Finding the next newline, or the next newline followed
+ * by a given character, is then a matter of finding the next bit set.
+ * Without vector instructions, newlines are found with memchr.
+ */
+#if defined(__GNUC__) && (defined(__x86_64__) || defined(__i386__))
+#define NEWLINE_SCAN_X86 1
+#include <immintrin.h>
+#endif
+
+/* Number of 64-bit words of the bitmap built at once. */
+#define NEWLINE_BLOCK_WORDS 256
+
+typedef void (*newline_bits_func)(const char *, Py_ssize_t, uint64_t *);
+
+/* Set the bits for the newlines in the len characters from p, in
+ * (len + 63) / 64 words. */
+static void
+newline_bits_tail(const char * p, Py_ssize_t len, uint64_t * bits)
+{
+  const Py_ssize_t nwords = (len + 63) / 64;
+  for (Py_ssize_t w = 0; w < nwords; w++) {
+    uint64_t word = 0;
+    const Py_ssize_t n = (len - w * 64) < 64 ? (len - w * 64) : 64;
+    const char * q = p + w * 64;
+    for (Py_ssize_t i = 0; i < n; i++) {
+      word |= ((uint64_t) (q[i] == '\n')) << i;
+    }
+    bits[w] = word;
+  }
+}
+
+#ifdef NEWLINE_SCAN_X86
+static void
+newline_bits_sse2(const char * p, Py_ssize_t len, uint64_t * bits)
+{
+  const __m128i nl = _mm_set1_epi8('\n');
+  const Py_ssize_t nfull = len / 64;
+  for (Py_ssize_t w = 0; w < nfull; w++) {
+    const char * q = p + w * 64;
+    const uint64_t m0 = (uint32_t) _mm_movemask_epi8(_mm_cmpeq_epi8(_mm_loadu_si128((const __m128i *) q), nl));
+    const uint64_t m1 = (uint32_t) _mm_movemask_epi8(_mm_cmpeq_epi8(_mm_loadu_si128((const __m128i *) (q + 16)), nl));
+    const uint64_t m2 = (uint32_t) _mm_movemask_epi8(_mm_cmpeq_epi8(_mm_loadu_si128((const __m128i *) (q + 32)), nl));
+    const uint64_t m3 = (uint32_t) _mm_movemask_epi8(_mm_cmpeq_epi8(_mm_loadu_si128((const __m128i *) (q + 48)), nl));
+    bits[w] = m0 | (m1 << 16) | (m2 << 32) | (m3 << 48);
+  }
+  if (len > nfull * 64) {
+    newline_bits_tail(p + nfull * 64, len - nfull * 64, bits + nfull);
+  }
+}
+
+__attribute__((target("avx2")))
+static void
+newline_bits_avx2(const char * p, Py_ssize_t len, uint64_t * bits)
+{
+  const __m256i nl = _mm256_set1_epi8('\n');
+  const Py_ssize_t nfull = len / 64;
+  for (Py_ssize_t w = 0; w < nfull; w++) {
+    const char * q = p + w * 64;
+    const uint64_t lo = (uint32_t) _mm256_movemask_epi8(_mm256_cmpeq_epi8(_mm256_loadu_si256((const __m256i *) q), nl));
+    const uint64_t hi = (uint32_t) _mm256_movemask_epi8(_mm256_cmpeq_epi8(_mm256_loadu_si256((const __m256i *) (q + 32)), nl));
+    bits[w] = lo | (hi << 32);
+  }
+  if (len > nfull * 64) {
+    newline_bits_tail(p + nfull * 64, len - nfull * 64, bits + nfull);
+  }
+}
+#endif
+
+static const char * newline_scan_name = "scalar";
+static newline_bits_func newline_bits = NULL;
+
+/* Choose the implementation for the newline bitmap. Return -1 if the
+ * name is unknown or if the CPU does not support it. */
+static int
+newline_scan_select(const char * name)
+{
+  if (strcmp(name, "scalar") == 0) {
+    newline_scan_name = "scalar";
+    newline_bits = NULL;
+    return 0;
+  }
+#ifdef NEWLINE_SCAN_X86
+  __builtin_cpu_init();
+  if (strcmp(name, "sse2") == 0 && __builtin_cpu_supports("sse2")) {
+    newline_scan_name = "sse2";
+    newline_bits = newline_bits_sse2;
+    return 0;
+  }
+  if (strcmp(name, "avx2") == 0 && __builtin_cpu_supports("avx2")) {
+    newline_scan_name = "avx2";
+    newline_bits = newline_bits_avx2;
+    return 0;
+  }
+#endif
+  return -1;
+}
+
+static inline int
+ctz64(uint64_t x)
+{
+#if defined(__GNUC__)
+  return __builtin_ctzll(x);
+#else
+  int n = 0;
+  while (!(x & 1)) {
+    x >>= 1;
+    n++;
+  }
+  return n;
+#endif
+}
+
+/* Bitmap for the newlines in a window of NEWLINE_BLOCK_WORDS 64-bit words
+ * sliding along the blob as it is scanned (it stays in the L1 cache).
+ * Without bitmap, the search functions use memchr. */
+typedef struct {
+  const char * blob_char;
+  Py_ssize_t blob_len;
+  int bitmap;
+  /* first word (absolute) and number of words in the window */
+  Py_ssize_t first;
+  Py_ssize_t nwords;
+  uint64_t bits[NEWLINE_BLOCK_WORDS];
+} newline_index;
+
+static void
+newline_index_init(newline_index * index, const char * blob_char,
+		   const Py_ssize_t blob_len, const int bitmap)
+{
+  index->blob_char = blob_char;
+  index->blob_len = blob_len;
+  index->bitmap = bitmap && newline_bits != NULL;
+  index->first = 0;
+  index->nwords = 0;
+}
+
+/* Word w (absolute) of the bitmap. */
+static inline uint64_t
+newline_word(newline_index * index, const Py_ssize_t w)
+{
+  if (w < index->first || w >= index->first + index->nwords) {
+    const Py_ssize_t begin = w * 64;
+    Py_ssize_t len = index->blob_len - begin;
+    if (len > NEWLINE_BLOCK_WORDS * 64) {
+      len = NEWLINE_BLOCK_WORDS * 64;
+    }
+    newline_bits(index->blob_char + begin, len, index->bits);
+    index->first = w;
+    index->nwords = (len + 63) / 64;
+  }
+  return index->bits[w - index->first];
+}
+
+/* Position of the first newline in blob_char[from:to], or -1. */
+static inline Py_ssize_t
+next_newline(newline_index * index, const Py_ssize_t from, const Py_ssize_t to)
+{
+  if (from >= to) {
+    return -1;
+  }
+  if (!index->bitmap) {
+    const char * adr = (const char *) memchr(index->blob_char + from, '\n', to - from);
+    return adr == NULL ? -1 : adr - index->blob_char;
+  }
+  Py_ssize_t w = from / 64;
+  const Py_ssize_t lastword = (to - 1) / 64;
+  uint64_t word = newline_word(index, w) & (~((uint64_t) 0) << (from % 64));
+  while (word == 0) {
+    if (w == lastword) {
+      return -1;
+    }
+    w++;
+    word = newline_word(index, w);
+  }
+  const Py_ssize_t pos = w * 64 + ctz64(word);
+  return pos < to ? pos : -1;
+}
+
+/* Position of the first newline followed by the character c in
+ * blob_char[from:to] (both characters in it), or -1. */
+static inline Py_ssize_t
+next_newline_before(newline_index * index, const Py_ssize_t from,
+		    const Py_ssize_t to, const char c)
+{
+  Py_ssize_t pos = next_newline(index, from, to - 1);
+  while (pos != -1 && index->blob_char[pos + 1] != c) {
+    pos = next_newline(index, pos + 1, to - 1);
+  }
+  return pos;
+}
+
+/* Find the positions for the next FASTQ entry in blob, starting at offset.
+ * posarray is an array with 6 offsets:
+ * - 0: header, begin
+ * - 1: header, end
+ * - 2: sequence, begin
+ * - 3: sequence, end
+ * - 4: quality, begin
+ * - 5: quality, end
+ * The return value is a status code (COMPLETE when the entry is complete).
+ * The newlines are found with index (for blob).
+ */
+static int
+scan_entry(newline_index * index, const Py_ssize_t offset, Py_ssize_t * posarray)
+{
+  const char * blob_char = index->blob_char;
+  const Py_ssize_t blob_len = index->blob_len;
+  Py_ssize_t cur_offset = offset;
+
+  /* initialize the buffer */
+  for (Py_ssize_t i = 0; i < 6; i++) {
+    posarray[i] = -1;
+  }
+
+  /* header */
+  if (cur_offset >= blob_len) {
+    return POS_HEAD_BEG;
+  }
+  const Py_ssize_t headerbeg = next_newline_before(index, cur_offset, blob_len, '@');
+  if (headerbeg == -1) {
+    return POS_HEAD_BEG;
+  }
+  posarray[POS_HEAD_BEG] = headerbeg + 1;
+
+  cur_offset = posarray[POS_HEAD_BEG]+1;
+  if (blob_len - cur_offset - 1 <= 0) {
+    return POS_HEAD_END;
+  }
+  const Py_ssize_t headerend = next_newline(index, cur_offset, blob_len - 1);
+  if (headerend == -1) {
+    return POS_HEAD_END;
+  }
+  posarray[POS_HEAD_END] = headerend;
+
+  /* sequence */
+  if (posarray[POS_HEAD_END]+1 >= blob_len) {
+    return POS_SEQ_BEG;
+  }
+  posarray[POS_SEQ_BEG] = posarray[POS_HEAD_END] + 1;
+
+  cur_offset = posarray[POS_SEQ_BEG]+1;
+  if (cur_offset >= blob_len) {
+    return POS_SEQ_END;
+  }
+  const Py_ssize_t seqend = next_newline_before(index, cur_offset, blob_len, '+');
+  if (seqend == -1) {
+    return POS_SEQ_END;
+  }
+  posarray[POS_SEQ_END] = seqend;
+
+  /* Quality */
+  if (posarray[POS_SEQ_END]+2 >= blob_len) {
+    return MISSING_QUALHEADER_END;
+  }
+  cur_offset = posarray[POS_SEQ_END]+2;
+  if (blob_len - cur_offset - 1 <= 0) {
+    return MISSING_QUALHEADER_END;
+  }
+  const Py_ssize_t qualheadend = next_newline(index, cur_offset, blob_len - 1);
+  if (qualheadend == -1) {
+    return MISSING_QUALHEADER_END;
+  }
+  if (
+      ((qualheadend - posarray[POS_SEQ_END] - 1) > 1)
+      &&
+      ((qualheadend - posarray[POS_SEQ_END]) != (posarray[POS_HEAD_END] - posarray[POS_HEAD_BEG] + 1))
+      ) {
+    return INVALID;
+  }
+
+  Py_ssize_t qualbeg_i = qualheadend +1;
+
+  if (qualbeg_i >= blob_len) {
+    return POS_QUAL_BEG;
+  } else {
+    posarray[POS_QUAL_BEG] = qualbeg_i;
+  }
+
+  Py_ssize_t qualend_i = (posarray[POS_QUAL_BEG] + posarray[POS_SEQ_END] - posarray[POS_HEAD_END] - 1);
+  if ((qualend_i+2) >= blob_len) {
+    return POS_QUAL_END;
+  } else {
+    posarray[POS_QUAL_END] = qualend_i;
+  }
+
+  if (!(
+	((qualend_i-posarray[POS_QUAL_BEG]) != (posarray[POS_SEQ_END]+1 - posarray[POS_HEAD_END]))
+      ||
+      ((! (qualend_i+2 >= blob_len)) && blob_char[qualend_i] == '\n' && blob_char[qualend_i+1] == '@')
+      ||
+      (blob_len - qualend_i)
+	)
+      ) {
+    return INVALID;
+  }
+  return COMPLETE;
+}
+
+/* Fast path for the next FASTQ entry when the previous one had a sequence
+ * of length seqlen (on one line) and a quality header with only +.
+ * Only the header is searched: the other delimiters are checked where the
+ * same layout puts them. Return 1 with the positions in posarray (the
+ * entry is COMPLETE, as scan_entry would find it), or 0 when the entry
+ * does not have that layout (posarray is then undefined).
+ */
+static inline int
+scan_entry_fixed(newline_index * index, const Py_ssize_t offset,
+		 const Py_ssize_t seqlen, Py_ssize_t * posarray)
+{
+  const char * blob_char = index->blob_char;
+  const Py_ssize_t blob_len = index->blob_len;
+  const Py_ssize_t headerbeg = offset + 1;
+  if (offset < 0 || headerbeg + 2 >= blob_len ||
+      blob_char[headerbeg] != '\n' || blob_char[headerbeg + 1] != '@') {
+    return 0;
+  }
+  /* Headers are short: memchr is faster than building the bitmap. */
+  const char * headerend_adr = (const char *) memchr(blob_char + headerbeg + 2, '\n',
+						      blob_len - 1 - (headerbeg + 2));
+  if (headerend_adr == NULL) {
+    return 0;
+  }
+  const Py_ssize_t headerend = headerend_adr - blob_char;
+  const Py_ssize_t seqend = headerend + 1 + seqlen;
+  const Py_ssize_t qualend = seqend + 3 + seqlen;
+  /* The quality ends seqlen characters after the quality header, and
+   * the next entry begins right after it. */
+  if (qualend + 2 >= blob_len ||
+      blob_char[seqend] != '\n' || blob_char[seqend + 1] != '+' ||
+      blob_char[seqend + 2] != '\n' ||
+      blob_char[qualend] != '\n' || blob_char[qualend + 1] != '@') {
+    return 0;
+  }
+  /* A newline in the sequence or in the quality means that the delimiters
+   * found belong to other lines (for example with a shorter entry
+   * followed by another one). */
+  if (memchr(blob_char + headerend + 1, '\n', seqlen) != NULL ||
+      memchr(blob_char + seqend + 3, '\n', seqlen) != NULL) {
+    return 0;
+  }
+  posarray[POS_HEAD_BEG] = headerbeg + 1;
+  posarray[POS_HEAD_END] = headerend;
+  posarray[POS_SEQ_BEG] = headerend + 1;
+  posarray[POS_SEQ_END] = seqend;
+  posarray[POS_QUAL_BEG] = seqend + 3;
+  posarray[POS_QUAL_END] = qualend;
+  return 1;
+}
+
+/* Length of the sequence to use with scan_entry_fixed after a COMPLETE
+ * entry, or 0 when the entry does not have a quality header with only +. */
+static inline Py_ssize_t
+fixed_seqlen(const Py_ssize_t * posarray)
+{
+  if (posarray[POS_QUAL_BEG] != posarray[POS_SEQ_END] + 3 ||
+      posarray[POS_SEQ_END] - posarray[POS_SEQ_BEG] < 2) {
+    return 0;
+  }
+  return posarray[POS_SEQ_END] - posarray[POS_SEQ_BEG];
+}
+
 PyDoc_STRVAR(entrypos_doc,
              "entrypos(blob, backlog, posbuffer) -> int\n\n"
              "Compute the positions for the next FASTQ entry given "
@@ -33,8 +406,6 @@ entrypos(PyObject * self, PyObject * args)
     return NULL;
   }
 
-  char * blob_char = (char *)blob.buf;
-      
   if (posbuffer.itemsize != sizeof(signed long long)) {
     PyBuffer_Release(&blob);
     PyBuffer_Release(&posbuffer);
@@ -42,114 +413,285 @@ entrypos(PyObject * self, PyObject * args)
     return NULL;
   }
 
-  Py_ssize_t cur_offset = offset;
-  /* posarray is an array with 6 offsets:
-  * - 0: header, begin
-  * - 1: header, end
-  * - 2: sequence, begin
-  * - 3: sequence, end
-  * - 4: quality, begin
-  * - 5: quality, end
-  */
+  newline_index index;
+  newline_index_init(&index, (char *)blob.buf, blob.len, 0);
+  int status = scan_entry(&index, offset, (Py_ssize_t *) posbuffer.buf);
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&posbuffer);
+  return PyLong_FromLong(status);
+}
+
+PyDoc_STRVAR(entrypos_batch_doc,
+             "entrypos_batch(blob, offset, posbuffer) -> (int, int, int)\n\n"
+             "Compute the positions for all complete FASTQ entries in a buffer.\n"
+	     "- blob: a bytes-like object\n"
+	     "- offset: offset in blob to start from\n"
+	     "- posbuffer: a buffer of type q able to store 6 positions for each entry\n"
+	     "Returns a tuple (number of entries found, offset to resume from, "
+	     "status for the last entry). The status is COMPLETE when the scan "
+	     "stopped because posbuffer is full.");
+
+static PyObject *
+entrypos_batch(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_ssize_t offset;
+  Py_buffer posbuffer;
+
+  if (!PyArg_ParseTuple(args, "s*nw*", &blob, &offset, &posbuffer)) {
+    return NULL;
+  }
+
+  if (posbuffer.itemsize != sizeof(signed long long)) {
+    PyBuffer_Release(&blob);
+    PyBuffer_Release(&posbuffer);
+    PyErr_SetString(PyExc_ValueError, "The buffer must be of format type q.");
+    return NULL;
+  }
+
+  const char * blob_char = (char *)blob.buf;
   Py_ssize_t * posarray = (Py_ssize_t *) posbuffer.buf;
+  const Py_ssize_t nrows = posbuffer.len / (6 * posbuffer.itemsize);
+  Py_ssize_t count = 0;
+  int status = COMPLETE;
 
-  /* initialize the buffer */
+  Py_BEGIN_ALLOW_THREADS
+  newline_index index;
+  newline_index_init(&index, blob_char, blob.len, 1);
+  /* Entries after one with a sequence of length seqlen are first scanned
+   * with the fast path for that length. */
+  Py_ssize_t seqlen = 0;
+  while (count < nrows) {
+    Py_ssize_t * entrypos = posarray + 6 * count;
+    if (seqlen == 0 || !scan_entry_fixed(&index, offset, seqlen, entrypos)) {
+      status = scan_entry(&index, offset, entrypos);
+      if (status != COMPLETE) {
+	break;
+      }
+      seqlen = fixed_seqlen(entrypos);
+    }
+    status = COMPLETE;
+    offset = entrypos[POS_QUAL_END] - 1;
+    count++;
+  }
+  Py_END_ALLOW_THREADS
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&posbuffer);
+  return Py_BuildValue("nni", count, offset, status);
+}
+
+/* Find the positions for the next FASTA entry in blob, starting at offset.
+ * Only the first 4 positions in posarray (header and sequence) are used.
+ * The sequence can be on multiple lines. When the end of the sequence is
+ * not found, the end of the blob (without a trailing newline) is used as
+ * the end position for the sequence and the status is POS_SEQ_END.
+ */
+static int
+scan_entry_fasta(const char * blob_char, const Py_ssize_t blob_len,
+		 const Py_ssize_t offset, Py_ssize_t * posarray)
+{
   for (Py_ssize_t i = 0; i < 6; i++) {
     posarray[i] = -1;
   }
-  
-  /* header */  
-  char * headerbeg_adr = (char *)memmem((void *)(blob_char + cur_offset), blob.len - cur_offset, (void *)("\n@"), 2);
+
+  /* header */
+  if (offset >= blob_len) {
+    return POS_HEAD_BEG;
+  }
+  char * headerbeg_adr = (char *)memmem((void *)(blob_char + offset), blob_len - offset, (void *)("\n>"), 2);
   if (headerbeg_adr == NULL) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(POS_HEAD_BEG);
+    return POS_HEAD_BEG;
   }
   posarray[POS_HEAD_BEG] = (Py_ssize_t) (headerbeg_adr - blob_char + 1);
 
-  cur_offset = posarray[POS_HEAD_BEG]+1;
-  char * headerend_adr = (char *)memchr(blob_char + cur_offset, '\n', blob.len - cur_offset - 1);
+  Py_ssize_t cur_offset = posarray[POS_HEAD_BEG] + 1;
+  if (cur_offset >= blob_len) {
+    return POS_HEAD_END;
+  }
+  char * headerend_adr = (char *)memchr(blob_char + cur_offset, '\n', blob_len - cur_offset);
   if (headerend_adr == NULL) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(POS_HEAD_END);
+    return POS_HEAD_END;
   }
   posarray[POS_HEAD_END] = (Py_ssize_t) (headerend_adr - blob_char);
 
   /* sequence */
-  if (posarray[POS_HEAD_END]+1 >= blob.len) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(POS_SEQ_BEG);
+  if (posarray[POS_HEAD_END] + 1 >= blob_len) {
+    return POS_SEQ_BEG;
   }
   posarray[POS_SEQ_BEG] = posarray[POS_HEAD_END] + 1;
 
-  cur_offset = posarray[POS_SEQ_BEG]+1;
-  char * seqend_adr = (char *)memmem((void *)(blob_char + cur_offset), blob.len - cur_offset, (void *)("\n+"), 2);
+  cur_offset = posarray[POS_SEQ_BEG];
+  char * seqend_adr = (char *)memmem((void *)(blob_char + cur_offset), blob_len - cur_offset, (void *)("\n>"), 2);
   if (seqend_adr == NULL) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(POS_SEQ_END);
+    /* We return the end of the buffer but we can't be sure that
+       that the sequence is complete. */
+    if (blob_char[blob_len - 1] == '\n') {
+      posarray[POS_SEQ_END] = blob_len - 1;
+    } else {
+      posarray[POS_SEQ_END] = blob_len;
+    }
+    return POS_SEQ_END;
   }
   posarray[POS_SEQ_END] = (Py_ssize_t) (seqend_adr - blob_char);
+  return COMPLETE;
+}
 
-  /* Quality */
-  if (posarray[POS_SEQ_END]+2 >= blob.len) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(MISSING_QUALHEADER_END);
+PyDoc_STRVAR(entrypos_fasta_doc,
+             "entrypos_fasta(blob, offset, posbuffer) -> int\n\n"
+             "Compute the positions for the next FASTA entry given "
+	     "- blob: a bytes-like object\n"
+	     "- offset: offset in blob to start from\n"
+	     "- posbuffer: a buffer able to store 6 positions");
+
+static PyObject *
+entrypos_fasta(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_ssize_t offset;
+  Py_buffer posbuffer;
+
+  if (!PyArg_ParseTuple(args, "s*nw*", &blob, &offset, &posbuffer)) {
+    return NULL;
   }
-  cur_offset = posarray[POS_SEQ_END]+2;
-  char * qualheadend_adr = (char *)memchr(blob_char + cur_offset, '\n', blob.len - cur_offset - 1);
-  if (qualheadend_adr == NULL) {
+
+  if (posbuffer.itemsize != sizeof(signed long long)) {
     PyBuffer_Release(&blob);
     PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(MISSING_QUALHEADER_END);
+    PyErr_SetString(PyExc_ValueError, "The buffer must be of format type q.");
+    return NULL;
   }
-  if (
-      ((qualheadend_adr - blob_char - posarray[POS_SEQ_END] - 1) > 1)
-      &&
-      ((qualheadend_adr - blob_char - posarray[POS_SEQ_END]) != (posarray[POS_HEAD_END] - posarray[POS_HEAD_BEG] + 1))
-      ) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(INVALID);
+
+  int status = scan_entry_fasta((char *)blob.buf, blob.len, offset,
+				(Py_ssize_t *) posbuffer.buf);
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&posbuffer);
+  return PyLong_FromLong(status);
+}
+
+/* Read the positions for an entry from a buffer of type q, checking that
+ * the first npos of them are within a blob of length blob_len. The header
+ * begins at the position following the one stored (character '@' or '>').
+ * Returns -1 with an exception set when not valid.
+ */
+static int
+read_entrypos(Py_buffer * posbuffer, const Py_ssize_t blob_len,
+	      const int npos, Py_ssize_t * posarray)
+{
+  if (posbuffer->itemsize != sizeof(signed long long)) {
+    PyErr_SetString(PyExc_ValueError, "The buffer must be of format type q.");
+    return -1;
   }
-  
-  Py_ssize_t qualbeg_i = qualheadend_adr - blob_char +1;
-  
-  if (qualbeg_i >= blob.len) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(POS_QUAL_BEG);
-  } else {
-    posarray[POS_QUAL_BEG] = qualbeg_i;
+  if (posbuffer->len < (Py_ssize_t)(npos * sizeof(signed long long))) {
+    PyErr_Format(PyExc_ValueError, "The buffer must contain at least %i positions.", npos);
+    return -1;
+  }
+  memcpy(posarray, posbuffer->buf, npos * sizeof(signed long long));
+  posarray[POS_HEAD_BEG] += 1;
+  for (int i = 0; i < npos; i += 2) {
+    if ((posarray[i] < 0) || (posarray[i] > posarray[i+1]) || (posarray[i+1] > blob_len)) {
+      PyErr_SetString(PyExc_ValueError, "Invalid positions for the entry.");
+      return -1;
+    }
   }
+  return 0;
+}
 
-  Py_ssize_t qualend_i = (posarray[POS_QUAL_BEG] + posarray[POS_SEQ_END] - posarray[POS_HEAD_END] - 1);
-  if ((qualend_i+2) >= blob.len) {
-    PyBuffer_Release(&blob);
-    PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(POS_QUAL_END);
-  } else {
-    posarray[POS_QUAL_END] = qualend_i;
+/* Build a bytes object from a span of characters, removing newlines. */
+static PyObject *
+bytes_unwrap(const char * src, const Py_ssize_t len)
+{
+  PyObject * res = PyBytes_FromStringAndSize(NULL, len);
+  if (res == NULL) {
+    return NULL;
+  }
+  char * dest = PyBytes_AS_STRING(res);
+  Py_ssize_t n = 0;
+  const char * cur = src;
+  const char * end = src + len;
+  while (cur < end) {
+    const char * nl = (const char *)memchr(cur, '\n', end - cur);
+    if (nl == NULL) {
+      nl = end;
+    }
+    memcpy(dest + n, cur, nl - cur);
+    n += nl - cur;
+    cur = nl + 1;
+  }
+  if ((n < len) && (_PyBytes_Resize(&res, n) != 0)) {
+    return NULL;
   }
+  return res;
+}
 
-  if (!(
-	((qualend_i-posarray[POS_QUAL_BEG]) != (posarray[POS_SEQ_END]+1 - posarray[POS_HEAD_END]))
-      ||
-      ((! (qualend_i+2 >= blob.len)) && blob_char[qualend_i] == '\n' && blob_char[qualend_i+1] == '@')
-      ||
-      (blob.len - qualend_i)
-	)
-      ) {
+/* Build a tuple with bytes objects for the first nfields elements of an
+ * entry, newlines removed from all but the header. */
+static PyObject *
+entry_unwrap(PyObject * args, const int nfields)
+{
+  Py_buffer blob;
+  Py_buffer posbuffer;
+  long long globaloffset;
+  Py_ssize_t posarray[6];
+
+  if (!PyArg_ParseTuple(args, "s*y*L", &blob, &posbuffer, &globaloffset)) {
+    return NULL;
+  }
+  if (read_entrypos(&posbuffer, blob.len, 2 * nfields, posarray) != 0) {
     PyBuffer_Release(&blob);
     PyBuffer_Release(&posbuffer);
-    return PyLong_FromLong(INVALID);
+    return NULL;
+  }
+  const char * blob_char = (char *)blob.buf;
+  PyObject * res = PyTuple_New(nfields);
+  if (res != NULL) {
+    for (int i = 0; i < nfields; i++) {
+      const Py_ssize_t beg = posarray[2 * i];
+      const Py_ssize_t end = posarray[2 * i + 1];
+      PyObject * field;
+      if (i == 0) {
+	field = PyBytes_FromStringAndSize(blob_char + beg, end - beg);
+      } else {
+	field = bytes_unwrap(blob_char + beg, end - beg);
+      }
+      if (field == NULL) {
+	Py_CLEAR(res);
+	break;
+      }
+      PyTuple_SET_ITEM(res, i, field);
+    }
   }
   PyBuffer_Release(&blob);
   PyBuffer_Release(&posbuffer);
-  return PyLong_FromLong(COMPLETE);
+  return res;
+}
+
+PyDoc_STRVAR(entryfunc_fasta_unwrap_doc,
+             "entryfunc_fasta_unwrap(buf, pos, globaloffset) -> (bytes, bytes)\n\n"
+             "Build a FASTA entry as a tuple (header, sequence), with the "
+	     "newlines in a multi-line sequence removed.\n"
+	     "- buf: a bytes-like object\n"
+	     "- pos: a buffer of type q with the positions of the entry in buf\n"
+	     "- globaloffset: offset of buf in the stream (unused)\n");
+
+static PyObject *
+entryfunc_fasta_unwrap(PyObject * self, PyObject * args)
+{
+  return entry_unwrap(args, 2);
+}
+
+PyDoc_STRVAR(entryfunc_unwrap_doc,
+             "entryfunc_unwrap(buf, pos, globaloffset) -> (bytes, bytes, bytes)\n\n"
+             "Build a FASTQ entry as a tuple (header, sequence, quality), with the "
+	     "newlines in a multi-line sequence or quality removed.\n"
+	     "- buf: a bytes-like object\n"
+	     "- pos: a buffer of type q with the positions of the entry in buf\n"
+	     "- globaloffset: offset of buf in the stream (unused)\n");
+
+static PyObject *
+entryfunc_unwrap(PyObject * self, PyObject * args)
+{
+  return entry_unwrap(args, 3);
 }
 
 PyDoc_STRVAR(arrayadd_b_doc,
@@ -162,9 +704,9 @@ static PyObject *
 arrayadd_b(PyObject * self, PyObject * args)
 {
   Py_buffer buf;
-  signed char value;
+  short value;
 
-  if (!PyArg_ParseTuple(args, "y*h", &buf, &value)) {
+  if (!PyArg_ParseTuple(args, "w*h", &buf, &value)) {
     return NULL;
   }
 
@@ -181,6 +723,7 @@ arrayadd_b(PyObject * self, PyObject * args)
     bufarray[i] += value;
   }
 
+  PyBuffer_Release(&buf);
   Py_RETURN_NONE;
 }
 
@@ -196,7 +739,7 @@ arrayadd_q(PyObject * self, PyObject * args)
   Py_buffer buf;
   long long value;
 
-  if (!PyArg_ParseTuple(args, "y*L", &buf, &value)) {
+  if (!PyArg_ParseTuple(args, "w*L", &buf, &value)) {
     return NULL;
   }
 
@@ -213,26 +756,2934 @@ arrayadd_q(PyObject * self, PyObject * args)
     bufarray[i] += value;
   }
 
+  PyBuffer_Release(&buf);
   Py_RETURN_NONE;
 }
 
+PyDoc_STRVAR(fill_batch_doc,
+             "fill_batch(blob, positions, count, sequences, qualities, lengths, "
+             "headers, headeroffsets, phredoffset)\n\n"
+             "Copy the entries in a buffer into preallocated buffers **in-place**.\n"
+             "- blob: a bytes-like object\n"
+             "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+             "- count: number of entries\n"
+             "- sequences: a writable buffer of count rows of bytes (sequences are "
+             "truncated to the width of the rows)\n"
+             "- qualities: a writable buffer with the same size as sequences\n"
+             "- lengths: a writable buffer of type q for the count lengths\n"
+             "- headers: a writable buffer for the headers, one after the other\n"
+             "- headeroffsets: a writable buffer of type q for the count+1 "
+             "offsets of the headers in headers\n"
+             "- phredoffset: a value subtracted from the quality scores\n");
+
+static PyObject *
+fill_batch(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  Py_buffer sequences;
+  Py_buffer qualities;
+  Py_buffer lengths;
+  Py_buffer headers;
+  Py_buffer headeroffsets;
+  int phredoffset;
+
+  if (!PyArg_ParseTuple(args, "s*s*nw*w*w*w*w*i", &blob, &positions, &count,
+			&sequences, &qualities, &lengths,
+			&headers, &headeroffsets, &phredoffset)) {
+    return NULL;
+  }
+
+  const char * error = NULL;
+  if (positions.itemsize != sizeof(signed long long) ||
+      lengths.itemsize != sizeof(signed long long) ||
+      headeroffsets.itemsize != sizeof(signed long long)) {
+    error = "The buffers of positions, lengths, and header offsets must be of format type q.";
+  } else if (count < 0 ||
+	     positions.len < 6 * count * positions.itemsize ||
+	     lengths.len < count * lengths.itemsize ||
+	     headeroffsets.len < (count + 1) * headeroffsets.itemsize) {
+    error = "The buffers are too small for the number of entries.";
+  } else if (sequences.len != qualities.len ||
+	     (count > 0 && sequences.len % count != 0)) {
+    error = "The buffers for sequences and qualities must have count rows of the same size.";
+  }
+
+  if (error == NULL) {
+    const char * blob_char = (const char *) blob.buf;
+    const long long * posarray = (const long long *) positions.buf;
+    unsigned char * seqarray = (unsigned char *) sequences.buf;
+    unsigned char * qualarray = (unsigned char *) qualities.buf;
+    long long * lenarray = (long long *) lengths.buf;
+    char * headerarray = (char *) headers.buf;
+    long long * headeroffsetarray = (long long *) headeroffsets.buf;
+    const Py_ssize_t width = count > 0 ? sequences.len / count : 0;
+    Py_ssize_t headeroffset = 0;
+
+    Py_BEGIN_ALLOW_THREADS
+    headeroffsetarray[0] = 0;
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const long long * pos = posarray + 6 * i;
+      if (pos[POS_HEAD_BEG] < 0 || pos[POS_HEAD_END] <= pos[POS_HEAD_BEG] ||
+	  pos[POS_SEQ_END] < pos[POS_SEQ_BEG] || pos[POS_SEQ_BEG] < 0 ||
+	  pos[POS_QUAL_BEG] < 0 ||
+	  pos[POS_QUAL_END] - pos[POS_QUAL_BEG] != pos[POS_SEQ_END] - pos[POS_SEQ_BEG] ||
+	  pos[POS_HEAD_END] > blob.len || pos[POS_SEQ_END] > blob.len ||
+	  pos[POS_QUAL_END] > blob.len) {
+	error = "Invalid positions.";
+	break;
+      }
+      const Py_ssize_t headerlen = pos[POS_HEAD_END] - pos[POS_HEAD_BEG] - 1;
+      if (headeroffset + headerlen > headers.len) {
+	error = "The buffer for headers is too small.";
+	break;
+      }
+      memcpy(headerarray + headeroffset, blob_char + pos[POS_HEAD_BEG] + 1, headerlen);
+      headeroffset += headerlen;
+      headeroffsetarray[i + 1] = headeroffset;
+
+      Py_ssize_t seqlen = pos[POS_SEQ_END] - pos[POS_SEQ_BEG];
+      if (seqlen > width) {
+	seqlen = width;
+      }
+      lenarray[i] = seqlen;
+      unsigned char * seqrow = seqarray + i * width;
+      unsigned char * qualrow = qualarray + i * width;
+      const unsigned char * qual = (const unsigned char *) (blob_char + pos[POS_QUAL_BEG]);
+      memcpy(seqrow, blob_char + pos[POS_SEQ_BEG], seqlen);
+      for (Py_ssize_t j = 0; j < seqlen; j++) {
+	qualrow[j] = (unsigned char) (qual[j] - phredoffset);
+      }
+      memset(seqrow + seqlen, 0, width - seqlen);
+      memset(qualrow + seqlen, 0, width - seqlen);
+    }
+    Py_END_ALLOW_THREADS
+  }
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  PyBuffer_Release(&sequences);
+  PyBuffer_Release(&qualities);
+  PyBuffer_Release(&lengths);
+  PyBuffer_Release(&headers);
+  PyBuffer_Release(&headeroffsets);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
+/* 2-bit codes for bases (A: 0, C: 1, G: 2, T: 3). Other characters are
+ * exceptions (code 4). */
+static unsigned char
+base2bit(const unsigned char c)
+{
+  switch (c) {
+  case 'A': return 0;
+  case 'C': return 1;
+  case 'G': return 2;
+  case 'T': return 3;
+  default: return 4;
+  }
+}
+
+static const char BASES[] = "ACGT";
+
+/* Pack seq[:seqlen] with 2 bits per base into packedarray from the base
+ * start. Characters that are not A, C, G, or T are packed as A and
+ * appended to *exceptions (None or a list) as (index, character), the
+ * index being relative to exceptionoffset. *exceptions is cleared on
+ * error. */
+static void
+pack2bit_seq(const unsigned char * seq, const Py_ssize_t seqlen,
+	     unsigned char * packedarray, const Py_ssize_t start,
+	     const Py_ssize_t exceptionoffset, PyObject ** exceptions)
+{
+  for (Py_ssize_t j = 0; j < seqlen; j++) {
+    unsigned char code = base2bit(seq[j]);
+    if (code > 3) {
+      if (*exceptions == Py_None) {
+	Py_DECREF(Py_None);
+	*exceptions = PyList_New(0);
+	if (*exceptions == NULL) {
+	  return;
+	}
+      }
+      PyObject * exception = Py_BuildValue("(ni)", exceptionoffset + j, (int) seq[j]);
+      if (exception == NULL || PyList_Append(*exceptions, exception) != 0) {
+	Py_XDECREF(exception);
+	Py_CLEAR(*exceptions);
+	return;
+      }
+      Py_DECREF(exception);
+      code = 0;
+    }
+    const Py_ssize_t i = start + j;
+    packedarray[i >> 2] |= code << ((i & 3) << 1);
+  }
+}
+
+PyDoc_STRVAR(pack2bit_doc,
+             "pack2bit(blob, begin, end, packed, start) -> list or None\n\n"
+             "Pack the bases in blob[begin:end] with 2 bits each **in-place**.\n"
+             "- blob: a bytes-like object\n"
+             "- begin: position of the first base in blob\n"
+             "- end: position after the last base in blob\n"
+             "- packed: a writable buffer with zeros from the base start\n"
+             "- start: index of the base to start at in packed\n"
+             "Returns None, or a list of (index, character) for the characters "
+             "that are not A, C, G, or T (packed as A).");
+
+static PyObject *
+pack2bit(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_ssize_t begin;
+  Py_ssize_t end;
+  Py_buffer packed;
+  Py_ssize_t start;
+
+  if (!PyArg_ParseTuple(args, "s*nnw*n", &blob, &begin, &end, &packed, &start)) {
+    return NULL;
+  }
+
+  if (begin < 0 || end > blob.len || end < begin || start < 0 ||
+      (start + (end - begin) + 3) / 4 > packed.len) {
+    PyBuffer_Release(&blob);
+    PyBuffer_Release(&packed);
+    PyErr_SetString(PyExc_ValueError, "Positions out of bounds.");
+    return NULL;
+  }
+
+  PyObject * exceptions = Py_None;
+  Py_INCREF(Py_None);
+  pack2bit_seq((const unsigned char *) blob.buf + begin, end - begin,
+	       (unsigned char *) packed.buf, start, 0, &exceptions);
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&packed);
+  return exceptions;
+}
+
+PyDoc_STRVAR(pack2bit_chunk_doc,
+             "pack2bit_chunk(blob, positions, count, packed, offsets) -> list or None\n\n"
+             "Pack the sequences of FASTQ entries with 2 bits per base **in-place**.\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+	     "- count: number of entries\n"
+	     "- packed: a bytearray with zeros from the base offsets[0] (it is\n"
+	     "  extended with zeros as needed)\n"
+	     "- offsets: a writable buffer of type q with count + 1 values, the first\n"
+	     "  one being the index of the base to start at in packed. The indices\n"
+	     "  after each sequence are written in the other values.\n"
+	     "Returns None, or a list of (index, character) for the characters "
+	     "that are not A, C, G, or T (packed as A), with indices in packed.");
+
+static PyObject *
+pack2bit_chunk(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  PyObject * packed;
+  Py_buffer offsets;
+
+  if (!PyArg_ParseTuple(args, "y*y*nO!w*", &blob, &positions, &count,
+			&PyByteArray_Type, &packed, &offsets)) {
+    return NULL;
+  }
+
+  PyObject * exceptions = NULL;
+  const char * error = NULL;
+  const long long * posarray = (const long long *) positions.buf;
+  long long * offsetarray = (long long *) offsets.buf;
+  if (positions.itemsize != sizeof(long long) || offsets.itemsize != sizeof(long long)) {
+    error = "The buffers of positions and offsets must be of format type q.";
+    goto cleanup;
+  }
+  if (count < 0 || positions.len < 6 * count * positions.itemsize ||
+      offsets.len < (count + 1) * offsets.itemsize) {
+    error = "The buffers are too small for the number of entries.";
+    goto cleanup;
+  }
+  Py_ssize_t total = offsetarray[0];
+  if (total < 0) {
+    error = "Positions out of bounds.";
+    goto cleanup;
+  }
+  for (Py_ssize_t i = 0; i < count; i++) {
+    const long long * pos = posarray + 6 * i;
+    if (pos[POS_SEQ_BEG] < 0 || pos[POS_SEQ_END] < pos[POS_SEQ_BEG] ||
+	pos[POS_SEQ_END] > blob.len) {
+      error = "Positions out of bounds.";
+      goto cleanup;
+    }
+    total += pos[POS_SEQ_END] - pos[POS_SEQ_BEG];
+  }
+  const Py_ssize_t size = PyByteArray_GET_SIZE(packed);
+  const Py_ssize_t nbytes = (total + 3) / 4;
+  if (nbytes > size) {
+    const Py_ssize_t newsize = nbytes > size + size / 2 ? nbytes : size + size / 2;
+    if (PyByteArray_Resize(packed, newsize) != 0) {
+      goto cleanup;
+    }
+    memset(PyByteArray_AS_STRING(packed) + size, 0, newsize - size);
+  }
+  unsigned char * packedarray = (unsigned char *) PyByteArray_AS_STRING(packed);
+  exceptions = Py_None;
+  Py_INCREF(Py_None);
+  for (Py_ssize_t i = 0; i < count && exceptions != NULL; i++) {
+    const long long * pos = posarray + 6 * i;
+    const Py_ssize_t seqlen = pos[POS_SEQ_END] - pos[POS_SEQ_BEG];
+    pack2bit_seq((const unsigned char *) blob.buf + pos[POS_SEQ_BEG], seqlen,
+		 packedarray, offsetarray[i], offsetarray[i], &exceptions);
+    offsetarray[i + 1] = offsetarray[i] + seqlen;
+  }
+
+ cleanup:
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  PyBuffer_Release(&offsets);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return exceptions;
+}
+
+PyDoc_STRVAR(unpack2bit_doc,
+             "unpack2bit(packed, start, length, out, reverse)\n\n"
+             "Unpack bases packed with 2 bits each into a buffer **in-place**.\n"
+             "- packed: a bytes-like object\n"
+             "- start: index of the first base in packed\n"
+             "- length: number of bases\n"
+             "- out: a writable buffer of at least length bytes\n"
+             "- reverse: write the reverse complement\n");
+
+static PyObject *
+unpack2bit(PyObject * self, PyObject * args)
+{
+  Py_buffer packed;
+  Py_ssize_t start;
+  Py_ssize_t length;
+  Py_buffer out;
+  int reverse;
+
+  if (!PyArg_ParseTuple(args, "s*nnw*p", &packed, &start, &length, &out, &reverse)) {
+    return NULL;
+  }
+
+  if (start < 0 || length < 0 || (start + length + 3) / 4 > packed.len ||
+      length > out.len) {
+    PyBuffer_Release(&packed);
+    PyBuffer_Release(&out);
+    PyErr_SetString(PyExc_ValueError, "Positions out of bounds.");
+    return NULL;
+  }
+
+  const unsigned char * packedarray = (const unsigned char *) packed.buf;
+  char * outarray = (char *) out.buf;
+  for (Py_ssize_t j = 0; j < length; j++) {
+    const Py_ssize_t i = start + j;
+    const unsigned char code = (packedarray[i >> 2] >> ((i & 3) << 1)) & 3;
+    if (reverse) {
+      outarray[length - 1 - j] = BASES[3 - code];
+    } else {
+      outarray[j] = BASES[code];
+    }
+  }
+
+  PyBuffer_Release(&packed);
+  PyBuffer_Release(&out);
+  Py_RETURN_NONE;
+}
+
+PyDoc_STRVAR(unpack2bit_chunk_doc,
+             "unpack2bit_chunk(packed, offsets, indices, exception_pos, exception_chars) -> list\n\n"
+             "Unpack sequences packed with 2 bits per base (see pack2bit_chunk).\n"
+             "- packed: a bytes-like object\n"
+             "- offsets: a buffer of type q with the index of the first base of each\n"
+             "  sequence in packed, and of the end of the last one\n"
+             "- indices: a buffer of type q with the indices of the sequences (negative\n"
+             "  indices count from the end), or None for all sequences\n"
+             "- exception_pos: a buffer of type q with the indices in packed of the\n"
+             "  characters that are not A, C, G, or T, in increasing order\n"
+             "- exception_chars: a bytes-like object with these characters\n"
+             "Returns a list of bytes.");
+
+static PyObject *
+unpack2bit_chunk(PyObject * self, PyObject * args)
+{
+  Py_buffer packed;
+  Py_buffer offsets;
+  PyObject * indices_obj;
+  Py_buffer exception_pos;
+  Py_buffer exception_chars;
+
+  if (!PyArg_ParseTuple(args, "y*y*Oy*y*", &packed, &offsets, &indices_obj,
+			&exception_pos, &exception_chars)) {
+    return NULL;
+  }
+
+  Py_buffer indices;
+  indices.buf = NULL;
+  PyObject * res = NULL;
+  const char * error = NULL;
+  if (indices_obj != Py_None &&
+      PyObject_GetBuffer(indices_obj, &indices, PyBUF_FORMAT) != 0) {
+    goto cleanup;
+  }
+  if (offsets.itemsize != sizeof(long long) || exception_pos.itemsize != sizeof(long long) ||
+      (indices.buf != NULL && indices.itemsize != sizeof(long long))) {
+    error = "The buffers of offsets, indices, and exception positions must be of format type q.";
+    goto cleanup;
+  }
+  const Py_ssize_t n = offsets.len / offsets.itemsize - 1;
+  const Py_ssize_t nexceptions = exception_pos.len / exception_pos.itemsize;
+  if (n < 0 || exception_chars.len < nexceptions) {
+    error = "The buffers are too small.";
+    goto cleanup;
+  }
+  const long long * offsetarray = (const long long *) offsets.buf;
+  const long long * indexarray = (const long long *) indices.buf;
+  const long long * eposarray = (const long long *) exception_pos.buf;
+  const char * echararray = (const char *) exception_chars.buf;
+  const unsigned char * packedarray = (const unsigned char *) packed.buf;
+  const Py_ssize_t m = indexarray == NULL ? n : indices.len / indices.itemsize;
+  res = PyList_New(m);
+  for (Py_ssize_t k = 0; res != NULL && k < m; k++) {
+    Py_ssize_t i = indexarray == NULL ? k : indexarray[k];
+    if (i < 0) {
+      i += n;
+    }
+    if (i < 0 || i >= n) {
+      PyErr_SetString(PyExc_IndexError, "Index out of range.");
+      Py_CLEAR(res);
+      break;
+    }
+    const Py_ssize_t start = offsetarray[i];
+    const Py_ssize_t length = offsetarray[i + 1] - start;
+    if (start < 0 || length < 0 || (start + length + 3) / 4 > packed.len) {
+      error = "Positions out of bounds.";
+      Py_CLEAR(res);
+      break;
+    }
+    PyObject * sequence = PyBytes_FromStringAndSize(NULL, length);
+    if (sequence == NULL) {
+      Py_CLEAR(res);
+      break;
+    }
+    char * outarray = PyBytes_AS_STRING(sequence);
+    for (Py_ssize_t j = 0; j < length; j++) {
+      const Py_ssize_t b = start + j;
+      outarray[j] = BASES[(packedarray[b >> 2] >> ((b & 3) << 1)) & 3];
+    }
+    /* First exception in the sequence (binary search). */
+    Py_ssize_t lo = 0;
+    Py_ssize_t hi = nexceptions;
+    while (lo < hi) {
+      const Py_ssize_t mid = lo + (hi - lo) / 2;
+      if (eposarray[mid] < start) {
+	lo = mid + 1;
+      } else {
+	hi = mid;
+      }
+    }
+    for (; lo < nexceptions && eposarray[lo] < start + length; lo++) {
+      outarray[eposarray[lo] - start] = echararray[lo];
+    }
+    PyList_SET_ITEM(res, k, sequence);
+  }
+
+ cleanup:
+  PyBuffer_Release(&packed);
+  PyBuffer_Release(&offsets);
+  PyBuffer_Release(&exception_pos);
+  PyBuffer_Release(&exception_chars);
+  if (indices.buf != NULL) {
+    PyBuffer_Release(&indices);
+  }
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return res;
+}
+
+PyDoc_STRVAR(kmers2bit_doc,
+             "kmers2bit(packed, start, length, k, out)\n\n"
+             "Compute the k-mers in bases packed with 2 bits each **in-place**.\n"
+             "- packed: a bytes-like object\n"
+             "- start: index of the first base in packed\n"
+             "- length: number of bases\n"
+             "- k: size of the k-mers (at most 32)\n"
+             "- out: a writable buffer of type Q for the length-k+1 k-mers, "
+             "each one with its first base in the highest bits\n");
+
+static PyObject *
+kmers2bit(PyObject * self, PyObject * args)
+{
+  Py_buffer packed;
+  Py_ssize_t start;
+  Py_ssize_t length;
+  int k;
+  Py_buffer out;
+
+  if (!PyArg_ParseTuple(args, "s*nniw*", &packed, &start, &length, &k, &out)) {
+    return NULL;
+  }
+
+  const char * error = NULL;
+  if (k < 1 || k > 32) {
+    error = "k must be between 1 and 32.";
+  } else if (out.itemsize != sizeof(uint64_t)) {
+    error = "The buffer must be of format type Q.";
+  } else if (start < 0 || length < 0 || (start + length + 3) / 4 > packed.len ||
+	     (length >= k && (length - k + 1) * (Py_ssize_t) sizeof(uint64_t) > out.len)) {
+    error = "Positions out of bounds.";
+  }
+
+  if (error == NULL && length >= k) {
+    const unsigned char * packedarray = (const unsigned char *) packed.buf;
+    uint64_t * outarray = (uint64_t *) out.buf;
+    const uint64_t mask = (k == 32) ? ~((uint64_t) 0) : ((((uint64_t) 1) << (2 * k)) - 1);
+    uint64_t kmer = 0;
+    for (Py_ssize_t j = 0; j < length; j++) {
+      const Py_ssize_t i = start + j;
+      kmer = ((kmer << 2) | ((packedarray[i >> 2] >> ((i & 3) << 1)) & 3)) & mask;
+      if (j >= k - 1) {
+	outarray[j - k + 1] = kmer;
+      }
+    }
+  }
+
+  PyBuffer_Release(&packed);
+  PyBuffer_Release(&out);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
+/* Filters on entries. The specification is an array of doubles with
+ * the values for each rule (NaN when the rule is not used), then the size
+ * of the window and the offset for quality scores. */
+#define FILTER_MINLEN 0
+#define FILTER_MAXLEN 1
+#define FILTER_MINMEANQUAL 2
+#define FILTER_MINWINDOWQUAL 3
+#define FILTER_MAXNFRAC 4
+#define FILTER_NRULES 5
+#define FILTER_WINDOW 5
+#define FILTER_PHREDOFFSET 6
+#define FILTER_SPECLEN 7
+
+/* Return the first filter rule rejecting the entry, or -1. Comparisons
+ * with NaN are false, so rules set to NaN never reject entries. */
+static int
+filter_entry(const char * blob_char, const Py_ssize_t * posarray,
+	     const double * spec)
+{
+  const Py_ssize_t seqlen = posarray[POS_SEQ_END] - posarray[POS_SEQ_BEG];
+  if (seqlen < spec[FILTER_MINLEN]) {
+    return FILTER_MINLEN;
+  }
+  if (seqlen > spec[FILTER_MAXLEN]) {
+    return FILTER_MAXLEN;
+  }
+  if (!isnan(spec[FILTER_MINMEANQUAL]) || !isnan(spec[FILTER_MINWINDOWQUAL])) {
+    const unsigned char * qual = (const unsigned char *) (blob_char + posarray[POS_QUAL_BEG]);
+    const double phredoffset = spec[FILTER_PHREDOFFSET];
+    long long total = 0;
+    for (Py_ssize_t i = 0; i < seqlen; i++) {
+      total += qual[i];
+    }
+    const double mean = seqlen > 0 ? (double) total / seqlen - phredoffset : 0;
+    if (mean < spec[FILTER_MINMEANQUAL]) {
+      return FILTER_MINMEANQUAL;
+    }
+    if (!isnan(spec[FILTER_MINWINDOWQUAL])) {
+      const Py_ssize_t window = (Py_ssize_t) spec[FILTER_WINDOW];
+      double minmean = mean;
+      if (window > 0 && seqlen > window) {
+	long long windowtotal = 0;
+	for (Py_ssize_t i = 0; i < window; i++) {
+	  windowtotal += qual[i];
+	}
+	long long mintotal = windowtotal;
+	for (Py_ssize_t i = window; i < seqlen; i++) {
+	  windowtotal += qual[i] - qual[i - window];
+	  if (windowtotal < mintotal) {
+	    mintotal = windowtotal;
+	  }
+	}
+	minmean = (double) mintotal / window - phredoffset;
+      }
+      if (minmean < spec[FILTER_MINWINDOWQUAL]) {
+	return FILTER_MINWINDOWQUAL;
+      }
+    }
+  }
+  if (!isnan(spec[FILTER_MAXNFRAC])) {
+    const char * seq = blob_char + posarray[POS_SEQ_BEG];
+    Py_ssize_t n = 0;
+    for (Py_ssize_t i = 0; i < seqlen; i++) {
+      n += (seq[i] == 'N') | (seq[i] == 'n');
+    }
+    const double nfrac = seqlen > 0 ? (double) n / seqlen : 0;
+    if (nfrac > spec[FILTER_MAXNFRAC]) {
+      return FILTER_MAXNFRAC;
+    }
+  }
+  return -1;
+}
+
+/* Check the buffers for a filter specification and its counters. */
+static int
+check_filter_buffers(Py_buffer * spec, Py_buffer * counts)
+{
+  if (spec->itemsize != sizeof(double) ||
+      spec->len < (Py_ssize_t)(FILTER_SPECLEN * sizeof(double))) {
+    PyErr_Format(PyExc_ValueError, "The filter specification must be a buffer of type d with %i values.", FILTER_SPECLEN);
+    return -1;
+  }
+  if (counts != NULL &&
+      (counts->itemsize != sizeof(signed long long) ||
+       counts->len < (Py_ssize_t)(FILTER_NRULES * sizeof(signed long long)))) {
+    PyErr_Format(PyExc_ValueError, "The filter counts must be a buffer of type q with %i values.", FILTER_NRULES);
+    return -1;
+  }
+  return 0;
+}
+
+PyDoc_STRVAR(filterentry_doc,
+             "filterentry(blob, posbuffer, spec) -> int\n\n"
+             "Return the first filter rule rejecting a FASTQ entry, or -1.\n"
+	     "- blob: a bytes-like object\n"
+	     "- posbuffer: a buffer with the 6 positions for the entry\n"
+	     "- spec: a buffer of type d with the filter specification\n");
+
+static PyObject *
+filterentry(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer posbuffer;
+  Py_buffer spec;
+  Py_ssize_t posarray[6];
+
+  if (!PyArg_ParseTuple(args, "y*y*y*", &blob, &posbuffer, &spec)) {
+    return NULL;
+  }
+  PyObject * res = NULL;
+  if (check_filter_buffers(&spec, NULL) == 0 &&
+      read_entrypos(&posbuffer, blob.len, 6, posarray) == 0) {
+    res = PyLong_FromLong(filter_entry((const char *) blob.buf, posarray,
+				       (const double *) spec.buf));
+  }
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&posbuffer);
+  PyBuffer_Release(&spec);
+  return res;
+}
+
+/* Trimming of the 3' end of entries. The specification is an array of
+ * doubles with the parameter for each step (NaN when the step is not
+ * used), then the size of the window for quality trimming (0 for the
+ * algorithm used by BWA), the minimum overlap with the adapter, and the
+ * offset for quality scores. Steps are applied in this order. */
+#define TRIM_POLYG 0
+#define TRIM_QUALITY 1
+#define TRIM_ADAPTER 2
+#define TRIM_NSTEPS 3
+#define TRIM_WINDOW 3
+#define TRIM_MINOVERLAP 4
+#define TRIM_PHREDOFFSET 5
+#define TRIM_SPECLEN 6
+
+/* Length of seq[:seqlen] without a trailing run of at least minrun G. */
+static Py_ssize_t
+trim_polyg(const char * seq, const Py_ssize_t seqlen, const double minrun)
+{
+  Py_ssize_t i = seqlen;
+  while (i > 0 && seq[i - 1] == 'G') {
+    i--;
+  }
+  return seqlen - i >= minrun ? i : seqlen;
+}
+
+/* Length of qual[:seqlen] after quality trimming. Without a window, the
+ * length maximizes the sum of (cutoff - score) over the trimmed end (as
+ * BWA or cutadapt do). With a window, the entry is trimmed at the first
+ * window with a mean score below the cutoff, keeping the bases above the
+ * cutoff at the beginning of that window (as Trimmomatic does). */
+static Py_ssize_t
+trim_quality(const unsigned char * qual, const Py_ssize_t seqlen,
+	     const double cutoff, const Py_ssize_t window,
+	     const double phredoffset)
+{
+  if (window <= 0) {
+    double s = 0;
+    double maxs = 0;
+    Py_ssize_t stop = seqlen;
+    for (Py_ssize_t i = seqlen - 1; i >= 0; i--) {
+      s += cutoff - (qual[i] - phredoffset);
+      if (s < 0) {
+	break;
+      }
+      if (s > maxs) {
+	maxs = s;
+	stop = i;
+      }
+    }
+    return stop;
+  }
+  const Py_ssize_t w = window < seqlen ? window : seqlen;
+  if (w == 0) {
+    return seqlen;
+  }
+  long long total = 0;
+  for (Py_ssize_t i = 0; i < w; i++) {
+    total += qual[i];
+  }
+  for (Py_ssize_t i = 0; i + w <= seqlen; i++) {
+    if (i > 0) {
+      total += qual[i + w - 1] - qual[i - 1];
+    }
+    if ((double) total / w - phredoffset < cutoff) {
+      Py_ssize_t stop = i;
+      while (stop < i + w && qual[stop] - phredoffset >= cutoff) {
+	stop++;
+      }
+      return stop;
+    }
+  }
+  return seqlen;
+}
+
+/* Length of seq[:seqlen] without the adapter: the first position where
+ * the sequence matches the beginning of the adapter (or the whole
+ * adapter) over at least minoverlap bases, with at most
+ * maxerrorrate * overlap mismatches. */
+static Py_ssize_t
+trim_adapter(const char * seq, const Py_ssize_t seqlen,
+	     const char * adapter, const Py_ssize_t adapterlen,
+	     const double maxerrorrate, const Py_ssize_t minoverlap)
+{
+  for (Py_ssize_t i = 0; i + minoverlap <= seqlen; i++) {
+    const Py_ssize_t overlap = seqlen - i < adapterlen ? seqlen - i : adapterlen;
+    const Py_ssize_t maxerrors = (Py_ssize_t) (maxerrorrate * overlap);
+    Py_ssize_t errors = 0;
+    for (Py_ssize_t j = 0; j < overlap && errors <= maxerrors; j++) {
+      errors += seq[i + j] != adapter[j];
+    }
+    if (errors <= maxerrors) {
+      return i;
+    }
+  }
+  return seqlen;
+}
+
+/* Trim the entry with the given positions **in-place**. Return the
+ * step trimming the entry last, or -1. */
+static int
+trim_entry(const char * blob_char, long long * pos, const double * spec,
+	   const char * adapter, const Py_ssize_t adapterlen)
+{
+  const char * seq = blob_char + pos[POS_SEQ_BEG];
+  const unsigned char * qual = (const unsigned char *) (blob_char + pos[POS_QUAL_BEG]);
+  const Py_ssize_t seqlen = pos[POS_SEQ_END] - pos[POS_SEQ_BEG];
+  Py_ssize_t len = seqlen;
+  int step = -1;
+  if (!isnan(spec[TRIM_POLYG])) {
+    const Py_ssize_t newlen = trim_polyg(seq, len, spec[TRIM_POLYG]);
+    if (newlen < len) {
+      len = newlen;
+      step = TRIM_POLYG;
+    }
+  }
+  if (!isnan(spec[TRIM_QUALITY])) {
+    const Py_ssize_t newlen = trim_quality(qual, len, spec[TRIM_QUALITY],
+					   (Py_ssize_t) spec[TRIM_WINDOW],
+					   spec[TRIM_PHREDOFFSET]);
+    if (newlen < len) {
+      len = newlen;
+      step = TRIM_QUALITY;
+    }
+  }
+  if (!isnan(spec[TRIM_ADAPTER]) && adapterlen > 0) {
+    Py_ssize_t minoverlap = (Py_ssize_t) spec[TRIM_MINOVERLAP];
+    if (minoverlap < 1) {
+      minoverlap = 1;
+    }
+    const Py_ssize_t newlen = trim_adapter(seq, len, adapter, adapterlen,
+					   spec[TRIM_ADAPTER], minoverlap);
+    if (newlen < len) {
+      len = newlen;
+      step = TRIM_ADAPTER;
+    }
+  }
+  pos[POS_SEQ_END] = pos[POS_SEQ_BEG] + len;
+  pos[POS_QUAL_END] = pos[POS_QUAL_BEG] + len;
+  return step;
+}
+
+PyDoc_STRVAR(trimentries_doc,
+             "trimentries(blob, positions, count, spec, adapter, counts) -> int\n\n"
+             "Trim the 3' end of FASTQ entries **in-place**: the ends of the sequence\n"
+	     "and of the quality in the positions are moved, and nothing is copied.\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a writable buffer of type q with 6 positions for each\n"
+	     "  entry in blob\n"
+	     "- count: number of entries\n"
+	     "- spec: a buffer of type d with the trimming specification\n"
+	     "- adapter: a bytes-like object with the adapter sequence\n"
+	     "- counts: a writable buffer of type q with the number of entries trimmed\n"
+	     "  for each step (the last step trimming an entry)\n"
+	     "Returns the number of entries trimmed.");
+
+static PyObject *
+trimentries(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  Py_buffer spec;
+  Py_buffer adapter;
+  Py_buffer counts;
+
+  if (!PyArg_ParseTuple(args, "y*w*ny*y*w*", &blob, &positions, &count,
+			&spec, &adapter, &counts)) {
+    return NULL;
+  }
+
+  const char * error = NULL;
+  Py_ssize_t ntrimmed = 0;
+  if (spec.itemsize != sizeof(double) ||
+      spec.len < (Py_ssize_t)(TRIM_SPECLEN * sizeof(double))) {
+    PyErr_Format(PyExc_ValueError, "The trimming specification must be a buffer of type d with %i values.", TRIM_SPECLEN);
+    goto cleanup;
+  }
+  if (counts.itemsize != sizeof(long long) ||
+      counts.len < (Py_ssize_t)(TRIM_NSTEPS * sizeof(long long))) {
+    PyErr_Format(PyExc_ValueError, "The trimming counts must be a buffer of type q with %i values.", TRIM_NSTEPS);
+    goto cleanup;
+  }
+  if (positions.itemsize != sizeof(long long)) {
+    error = "The buffer of positions must be of format type q.";
+    goto cleanup;
+  }
+  if (count < 0 || positions.len < 6 * count * positions.itemsize) {
+    error = "The buffers are too small for the number of entries.";
+    goto cleanup;
+  }
+  long long * posarray = (long long *) positions.buf;
+  for (Py_ssize_t i = 0; i < count; i++) {
+    const long long * pos = posarray + 6 * i;
+    if (pos[POS_SEQ_BEG] < 0 || pos[POS_SEQ_END] < pos[POS_SEQ_BEG] ||
+	pos[POS_QUAL_BEG] < pos[POS_SEQ_END] || pos[POS_QUAL_END] > blob.len ||
+	pos[POS_QUAL_END] - pos[POS_QUAL_BEG] != pos[POS_SEQ_END] - pos[POS_SEQ_BEG]) {
+      error = "Invalid positions.";
+      goto cleanup;
+    }
+  }
+  const char * blob_char = (const char *) blob.buf;
+  const double * specarray = (const double *) spec.buf;
+  long long * countarray = (long long *) counts.buf;
+  Py_BEGIN_ALLOW_THREADS
+  for (Py_ssize_t i = 0; i < count; i++) {
+    const int step = trim_entry(blob_char, posarray + 6 * i, specarray,
+				(const char *) adapter.buf, adapter.len);
+    if (step >= 0) {
+      countarray[step]++;
+      ntrimmed++;
+    }
+  }
+  Py_END_ALLOW_THREADS
+
+ cleanup:
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  PyBuffer_Release(&spec);
+  PyBuffer_Release(&adapter);
+  PyBuffer_Release(&counts);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  if (PyErr_Occurred()) {
+    return NULL;
+  }
+  return PyLong_FromSsize_t(ntrimmed);
+}
+
+/* Kinds of entries built by the builders and by entrybuild_batch. */
+#define BUILD_TUPLE 0
+#define BUILD_ENTRY 1
+#define BUILD_ABSPOS 2
+#define BUILD_SEQUENCE 3
+#define BUILD_VIEW 4
+
+static PyTypeObject * EntryType = NULL;
+static PyObject * ArrayType = NULL;
+
+static PyStructSequence_Field entry_fields[] = {
+  {"header", "header (without the leading '@')"},
+  {"sequence", "sequence"},
+  {"quality", "quality string"},
+  {NULL}
+};
+
+static PyStructSequence_Desc entry_desc = {
+  "fastqandfurious._fastqandfurious.Entry",
+  "FASTQ entry (header, sequence, quality).",
+  entry_fields,
+  3
+};
+
+/* Slice blob[beg:end], with a fast path for bytes. */
+static PyObject *
+blob_slice(PyObject * blob, const Py_ssize_t beg, const Py_ssize_t end)
+{
+  if (PyBytes_CheckExact(blob)) {
+    return PyBytes_FromStringAndSize(PyBytes_AS_STRING(blob) + beg, end - beg);
+  }
+  return PySequence_GetSlice(blob, beg, end);
+}
+
+/* View on a FASTQ entry in a buffer. The header begin in pos is the
+ * position after the '@'. */
+typedef struct {
+  PyObject_HEAD
+  PyObject * blob;
+  Py_ssize_t pos[6];
+} EntryViewObject;
+
+static void
+EntryView_dealloc(EntryViewObject * self)
+{
+  Py_XDECREF(self->blob);
+  Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static Py_ssize_t
+EntryView_length(EntryViewObject * self)
+{
+  return self->pos[POS_SEQ_END] - self->pos[POS_SEQ_BEG];
+}
+
+static PyObject *
+EntryView_field(EntryViewObject * self, void * closure)
+{
+  const int i = (int)(Py_ssize_t) closure;
+  return blob_slice(self->blob, self->pos[2 * i], self->pos[2 * i + 1]);
+}
+
+static PyObject *
+EntryView_fieldview(EntryViewObject * self, void * closure)
+{
+  const int i = (int)(Py_ssize_t) closure;
+  PyObject * view = PyMemoryView_FromObject(self->blob);
+  if (view == NULL) {
+    return NULL;
+  }
+  PyObject * res = PySequence_GetSlice(view, self->pos[2 * i], self->pos[2 * i + 1]);
+  Py_DECREF(view);
+  return res;
+}
+
+static PyObject *
+EntryView_seq_len(EntryViewObject * self, void * closure)
+{
+  return PyLong_FromSsize_t(EntryView_length(self));
+}
+
+static PyObject *
+EntryView_positions(EntryViewObject * self, void * closure)
+{
+  return Py_BuildValue("(nnnnnn)", self->pos[0] - 1, self->pos[1],
+		       self->pos[2], self->pos[3], self->pos[4], self->pos[5]);
+}
+
+static PyObject *
+EntryView_repr(EntryViewObject * self)
+{
+  PyObject * header = EntryView_field(self, (void *) 0);
+  if (header == NULL) {
+    return NULL;
+  }
+  PyObject * res = PyUnicode_FromFormat("EntryView(header=%R, seq_len=%zd)",
+					header, EntryView_length(self));
+  Py_DECREF(header);
+  return res;
+}
+
+static PyGetSetDef EntryView_getset[] = {
+  {"header", (getter) EntryView_field, NULL, "header (without the leading '@')", (void *) 0},
+  {"sequence", (getter) EntryView_field, NULL, "sequence", (void *) 1},
+  {"quality", (getter) EntryView_field, NULL, "quality string", (void *) 2},
+  {"header_view", (getter) EntryView_fieldview, NULL, "header as a memoryview", (void *) 0},
+  {"sequence_view", (getter) EntryView_fieldview, NULL, "sequence as a memoryview", (void *) 1},
+  {"quality_view", (getter) EntryView_fieldview, NULL, "quality string as a memoryview", (void *) 2},
+  {"seq_len", (getter) EntryView_seq_len, NULL, "length of the sequence", NULL},
+  {"positions", (getter) EntryView_positions, NULL, "positions of the entry in the buffer", NULL},
+  {NULL}
+};
+
+static PySequenceMethods EntryView_as_sequence = {
+  .sq_length = (lenfunc) EntryView_length,
+};
+
+static PyTypeObject EntryViewType = {
+  PyVarObject_HEAD_INIT(NULL, 0)
+  .tp_name = "fastqandfurious._fastqandfurious.EntryView",
+  .tp_doc = PyDoc_STR("View on a FASTQ entry in a buffer. The header, sequence, "
+		      "and quality are only built when accessed, and the length "
+		      "is the length of the sequence."),
+  .tp_basicsize = sizeof(EntryViewObject),
+  .tp_itemsize = 0,
+  .tp_flags = Py_TPFLAGS_DEFAULT,
+  .tp_dealloc = (destructor) EntryView_dealloc,
+  .tp_repr = (reprfunc) EntryView_repr,
+  .tp_as_sequence = &EntryView_as_sequence,
+  .tp_getset = EntryView_getset,
+};
+
+/* Build an entry of the given kind. The header begin in posarray is
+ * the position after the '@'. */
+static PyObject *
+build_entry(PyObject * blob, const char * blob_char, const Py_ssize_t * posarray,
+	    const int kind, const long long globaloffset)
+{
+  PyObject * res = NULL;
+  switch (kind) {
+  case BUILD_TUPLE:
+  case BUILD_ENTRY:
+    if (kind == BUILD_TUPLE) {
+      res = PyTuple_New(3);
+    } else {
+      res = PyStructSequence_New(EntryType);
+    }
+    if (res == NULL) {
+      return NULL;
+    }
+    for (int i = 0; i < 3; i++) {
+      PyObject * field = PyBytes_FromStringAndSize(blob_char + posarray[2 * i],
+						   posarray[2 * i + 1] - posarray[2 * i]);
+      if (field == NULL) {
+	Py_DECREF(res);
+	return NULL;
+      }
+      if (kind == BUILD_TUPLE) {
+	PyTuple_SET_ITEM(res, i, field);
+      } else {
+	PyStructSequence_SET_ITEM(res, i, field);
+      }
+    }
+    return res;
+  case BUILD_ABSPOS:
+    {
+      long long abspos[6];
+      for (int i = 0; i < 6; i++) {
+	abspos[i] = posarray[i] + globaloffset;
+      }
+      abspos[POS_HEAD_BEG] -= 1;
+      return PyObject_CallFunction(ArrayType, "sy#", "q", (const char *) abspos,
+				   (Py_ssize_t) sizeof(abspos));
+    }
+  case BUILD_SEQUENCE:
+    return PyBytes_FromStringAndSize(blob_char + posarray[POS_SEQ_BEG],
+				     posarray[POS_SEQ_END] - posarray[POS_SEQ_BEG]);
+  case BUILD_VIEW:
+    {
+      EntryViewObject * view = PyObject_New(EntryViewObject, &EntryViewType);
+      if (view == NULL) {
+	return NULL;
+      }
+      Py_INCREF(blob);
+      view->blob = blob;
+      memcpy(view->pos, posarray, sizeof(view->pos));
+      return (PyObject *) view;
+    }
+  default:
+    PyErr_SetString(PyExc_ValueError, "Unknown kind of entry.");
+    return NULL;
+  }
+}
+
+static PyObject *
+entry_build(PyObject * args, const int kind)
+{
+  PyObject * blob_obj;
+  Py_buffer blob;
+  Py_buffer posbuffer;
+  long long globaloffset;
+  Py_ssize_t posarray[6];
+
+  if (!PyArg_ParseTuple(args, "Oy*L", &blob_obj, &posbuffer, &globaloffset)) {
+    return NULL;
+  }
+  if (PyObject_GetBuffer(blob_obj, &blob, PyBUF_SIMPLE) != 0) {
+    PyBuffer_Release(&posbuffer);
+    return NULL;
+  }
+  PyObject * res = NULL;
+  if (read_entrypos(&posbuffer, blob.len, 6, posarray) == 0) {
+    res = build_entry(blob_obj, (const char *) blob.buf, posarray, kind, globaloffset);
+  }
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&posbuffer);
+  return res;
+}
+
+PyDoc_STRVAR(entryfunc_doc,
+             "entryfunc(blob, posbuffer, globaloffset) -> (bytes, bytes, bytes)\n\n"
+             "Build a FASTQ entry as a tuple (header, sequence, quality).\n"
+	     "- blob: a bytes-like object\n"
+	     "- posbuffer: a buffer with the 6 positions for the entry\n"
+	     "- globaloffset: offset of blob in the stream (ignored)\n");
+
+static PyObject *
+entryfunc(PyObject * self, PyObject * args)
+{
+  return entry_build(args, BUILD_TUPLE);
+}
+
+PyDoc_STRVAR(entryfunc_namedtuple_doc,
+             "entryfunc_namedtuple(blob, posbuffer, globaloffset) -> Entry\n\n"
+             "Build a FASTQ entry as an Entry (a struct sequence with attributes\n"
+             "header, sequence, and quality).\n"
+	     "- blob: a bytes-like object\n"
+	     "- posbuffer: a buffer with the 6 positions for the entry\n"
+	     "- globaloffset: offset of blob in the stream (ignored)\n");
+
+static PyObject *
+entryfunc_namedtuple(PyObject * self, PyObject * args)
+{
+  return entry_build(args, BUILD_ENTRY);
+}
+
+PyDoc_STRVAR(entryfunc_abspos_doc,
+             "entryfunc_abspos(blob, posbuffer, globaloffset) -> array\n\n"
+             "Return the absolute positions of the entry in the stream (array of type q).\n"
+	     "- blob: a bytes-like object\n"
+	     "- posbuffer: a buffer with the 6 positions for the entry\n"
+	     "- globaloffset: offset of blob in the stream\n");
+
+static PyObject *
+entryfunc_abspos(PyObject * self, PyObject * args)
+{
+  return entry_build(args, BUILD_ABSPOS);
+}
+
+PyDoc_STRVAR(entryfunc_sequence_doc,
+             "entryfunc_sequence(blob, posbuffer, globaloffset) -> bytes\n\n"
+             "Build the sequence of a FASTQ entry.\n"
+	     "- blob: a bytes-like object\n"
+	     "- posbuffer: a buffer with the 6 positions for the entry\n"
+	     "- globaloffset: offset of blob in the stream (ignored)\n");
+
+static PyObject *
+entryfunc_sequence(PyObject * self, PyObject * args)
+{
+  return entry_build(args, BUILD_SEQUENCE);
+}
+
+PyDoc_STRVAR(entryfunc_view_doc,
+             "entryfunc_view(blob, posbuffer, globaloffset) -> EntryView\n\n"
+             "Build a view on a FASTQ entry, with the header, sequence, and\n"
+             "quality only built when accessed.\n"
+	     "- blob: a bytes-like object\n"
+	     "- posbuffer: a buffer with the 6 positions for the entry\n"
+	     "- globaloffset: offset of blob in the stream (ignored)\n");
+
+static PyObject *
+entryfunc_view(PyObject * self, PyObject * args)
+{
+  return entry_build(args, BUILD_VIEW);
+}
+
+PyDoc_STRVAR(entrybuild_batch_doc,
+             "entrybuild_batch(blob, offset, posbuffer, kind, globaloffset, spec=None, counts=None) -> (list, int, int)\n\n"
+             "Find and build all complete FASTQ entries in a buffer.\n"
+	     "- blob: a bytes-like object\n"
+	     "- offset: offset in blob to start from\n"
+	     "- posbuffer: a buffer of type q able to store 6 positions\n"
+	     "- kind: kind of entries to build (BUILD_TUPLE, BUILD_ENTRY, "
+	     "BUILD_ABSPOS, BUILD_SEQUENCE, or BUILD_VIEW)\n"
+	     "- globaloffset: offset of blob in the stream\n"
+	     "- spec: a buffer of type d with a filter specification (optional)\n"
+	     "- counts: a writable buffer of type q where the entries rejected by\n"
+	     "  each filter rule are counted (required with spec)\n"
+	     "Returns a tuple (list of entries, offset to resume from, "
+	     "status for the entry after the last one built). posbuffer has "
+	     "the positions found for that entry.");
+
+static PyObject *
+entrybuild_batch(PyObject * self, PyObject * args)
+{
+  PyObject * blob_obj;
+  Py_buffer blob = {0};
+  Py_ssize_t offset;
+  Py_buffer posbuffer;
+  int kind;
+  long long globaloffset;
+  Py_buffer spec = {0};
+  Py_buffer counts = {0};
+  PyObject * entries = NULL;
+  int status = INVALID;
+
+  if (!PyArg_ParseTuple(args, "Onw*iL|y*w*", &blob_obj, &offset, &posbuffer,
+			&kind, &globaloffset, &spec, &counts)) {
+    return NULL;
+  }
+
+  if (posbuffer.itemsize != sizeof(signed long long) ||
+      posbuffer.len < (Py_ssize_t)(6 * sizeof(signed long long))) {
+    PyErr_SetString(PyExc_ValueError, "The buffer must be of format type q and able to store 6 positions.");
+    goto cleanup;
+  }
+  if (kind < BUILD_TUPLE || kind > BUILD_VIEW) {
+    PyErr_SetString(PyExc_ValueError, "Unknown kind of entry.");
+    goto cleanup;
+  }
+  if (spec.obj != NULL && counts.obj == NULL) {
+    PyErr_SetString(PyExc_ValueError, "counts is required with spec.");
+    goto cleanup;
+  }
+  if (spec.obj != NULL && check_filter_buffers(&spec, &counts) != 0) {
+    goto cleanup;
+  }
+  if (PyObject_GetBuffer(blob_obj, &blob, PyBUF_SIMPLE) != 0) {
+    goto cleanup;
+  }
+
+  const char * blob_char = (char *)blob.buf;
+  Py_ssize_t * posarray = (Py_ssize_t *) posbuffer.buf;
+  const double * specarray = (const double *) spec.buf;
+  long long * countarray = (long long *) counts.buf;
+  Py_ssize_t entrypos[6];
+  newline_index index;
+  newline_index_init(&index, blob_char, blob.len, 1);
+  Py_ssize_t seqlen = 0;
+  entries = PyList_New(0);
+  while (entries != NULL) {
+    if (seqlen == 0 || !scan_entry_fixed(&index, offset, seqlen, posarray)) {
+      status = scan_entry(&index, offset, posarray);
+      if (status != COMPLETE) {
+	break;
+      }
+      seqlen = fixed_seqlen(posarray);
+    }
+    status = COMPLETE;
+    offset = posarray[POS_QUAL_END] - 1;
+    if (specarray != NULL) {
+      const int rule = filter_entry(blob_char, posarray, specarray);
+      if (rule >= 0) {
+	countarray[rule]++;
+	continue;
+      }
+    }
+    memcpy(entrypos, posarray, sizeof(entrypos));
+    entrypos[POS_HEAD_BEG] += 1;
+    PyObject * entry = build_entry(blob_obj, blob_char, entrypos, kind, globaloffset);
+    if (entry == NULL || PyList_Append(entries, entry) != 0) {
+      Py_XDECREF(entry);
+      Py_CLEAR(entries);
+      break;
+    }
+    Py_DECREF(entry);
+  }
+
+ cleanup:
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&posbuffer);
+  PyBuffer_Release(&spec);
+  PyBuffer_Release(&counts);
+  if (entries == NULL) {
+    return NULL;
+  }
+  return Py_BuildValue("Nni", entries, offset, status);
+}
+
+/* Find the read name for the entry with positions posarray in blob: the
+ * header up to the first space, without a trailing /1 or /2. Return -1 if
+ * the positions are invalid. */
+static int
+pair_name(const char * blob_char, const Py_ssize_t blob_len,
+	  const long long * posarray, const char ** name, Py_ssize_t * namelen)
+{
+  const Py_ssize_t beg = posarray[POS_HEAD_BEG] + 1;
+  const Py_ssize_t end = posarray[POS_HEAD_END];
+  if (beg < 1 || end < beg || end > blob_len) {
+    return -1;
+  }
+  const char * space = memchr(blob_char + beg, ' ', end - beg);
+  Py_ssize_t len = (space == NULL) ? end - beg : space - (blob_char + beg);
+  if (len >= 2 && blob_char[beg + len - 2] == '/' &&
+      (blob_char[beg + len - 1] == '1' || blob_char[beg + len - 1] == '2')) {
+    len -= 2;
+  }
+  *name = blob_char + beg;
+  *namelen = len;
+  return 0;
+}
+
+PyDoc_STRVAR(checkpairs_doc,
+             "checkpairs(blob1, positions1, start1, blob2, positions2, start2, count) -> int\n\n"
+             "Check that the read names of paired FASTQ entries agree. The read\n"
+             "name is the header up to the first space, without a trailing /1 or /2.\n"
+	     "- blob1, blob2: bytes-like objects\n"
+	     "- positions1, positions2: buffers of type q with 6 positions for each entry\n"
+	     "- start1, start2: index of the first entry to check in positions1 and positions2\n"
+	     "- count: number of pairs to check\n"
+	     "Returns the index (from start1 and start2) of the first pair with\n"
+	     "different names, or -1.");
+
+static PyObject *
+checkpairs(PyObject * self, PyObject * args)
+{
+  Py_buffer blob1;
+  Py_buffer positions1;
+  Py_ssize_t start1;
+  Py_buffer blob2;
+  Py_buffer positions2;
+  Py_ssize_t start2;
+  Py_ssize_t count;
+
+  if (!PyArg_ParseTuple(args, "y*y*ny*y*nn", &blob1, &positions1, &start1,
+			&blob2, &positions2, &start2, &count)) {
+    return NULL;
+  }
+
+  const char * error = NULL;
+  Py_ssize_t res = -1;
+  if (positions1.itemsize != sizeof(signed long long) ||
+      positions2.itemsize != sizeof(signed long long)) {
+    error = "The buffers of positions must be of format type q.";
+  } else if (start1 < 0 || start2 < 0 || count < 0 ||
+	     (start1 + count) * 6 * positions1.itemsize > positions1.len ||
+	     (start2 + count) * 6 * positions2.itemsize > positions2.len) {
+    error = "Positions out of bounds.";
+  } else {
+    const long long * posarray1 = (const long long *) positions1.buf + 6 * start1;
+    const long long * posarray2 = (const long long *) positions2.buf + 6 * start2;
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const char * name1;
+      const char * name2;
+      Py_ssize_t len1;
+      Py_ssize_t len2;
+      if (pair_name((const char *) blob1.buf, blob1.len, posarray1 + 6 * i, &name1, &len1) != 0 ||
+	  pair_name((const char *) blob2.buf, blob2.len, posarray2 + 6 * i, &name2, &len2) != 0) {
+	error = "Invalid positions for the entry.";
+	break;
+      }
+      if (len1 != len2 || memcmp(name1, name2, len1) != 0) {
+	res = i;
+	break;
+      }
+    }
+  }
+
+  PyBuffer_Release(&blob1);
+  PyBuffer_Release(&positions1);
+  PyBuffer_Release(&blob2);
+  PyBuffer_Release(&positions2);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return PyLong_FromSsize_t(res);
+}
+
+PyDoc_STRVAR(stats_chunk_doc,
+             "stats_chunk(blob, positions, count, lengths, qualsums, basecounts, gchist, phredoffset)\n\n"
+             "Accumulate statistics for FASTQ entries **in-place**.\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+	     "- count: number of entries\n"
+	     "- lengths: a writable buffer of type q, histogram of sequence lengths "
+	     "(longer sequences are in the last bin)\n"
+	     "- qualsums: a writable buffer of type q, sum of quality scores for each "
+	     "position (one less than the number of bins in lengths)\n"
+	     "- basecounts: a writable buffer of type q, counts of A, C, G, T, and "
+	     "other bases (5 values) for each position\n"
+	     "- gchist: a writable buffer of type q, histogram of GC content in "
+	     "percent (101 bins)\n"
+	     "- phredoffset: offset for quality scores\n");
+
+static PyObject *
+stats_chunk(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  Py_buffer lengths;
+  Py_buffer qualsums;
+  Py_buffer basecounts;
+  Py_buffer gchist;
+  int phredoffset;
+
+  if (!PyArg_ParseTuple(args, "y*y*nw*w*w*w*i", &blob, &positions, &count,
+			&lengths, &qualsums, &basecounts, &gchist, &phredoffset)) {
+    return NULL;
+  }
+
+  const char * error = NULL;
+  const Py_ssize_t maxpos = qualsums.len / (Py_ssize_t) sizeof(long long);
+  if (positions.itemsize != sizeof(long long) || lengths.itemsize != sizeof(long long) ||
+      qualsums.itemsize != sizeof(long long) || basecounts.itemsize != sizeof(long long) ||
+      gchist.itemsize != sizeof(long long)) {
+    error = "The buffers must be of format type q.";
+  } else if (count < 0 || positions.len < 6 * count * positions.itemsize) {
+    error = "The buffer of positions is too small for the number of entries.";
+  } else if (lengths.len != (maxpos + 1) * lengths.itemsize ||
+	     basecounts.len != 5 * maxpos * basecounts.itemsize ||
+	     gchist.len != 101 * gchist.itemsize) {
+    error = "The sizes of the buffers for statistics do not match.";
+  }
+
+  if (error == NULL) {
+    const char * blob_char = (const char *) blob.buf;
+    const long long * posarray = (const long long *) positions.buf;
+    long long * lenarray = (long long *) lengths.buf;
+    long long * qualarray = (long long *) qualsums.buf;
+    long long * basearray = (long long *) basecounts.buf;
+    long long * gcarray = (long long *) gchist.buf;
+
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const long long * pos = posarray + 6 * i;
+      const Py_ssize_t seqlen = pos[POS_SEQ_END] - pos[POS_SEQ_BEG];
+      if (pos[POS_SEQ_BEG] < 0 || pos[POS_QUAL_BEG] < 0 || seqlen < 0 ||
+	  pos[POS_SEQ_END] > blob.len || pos[POS_QUAL_BEG] + seqlen > blob.len) {
+	error = "Invalid positions.";
+	break;
+      }
+      const unsigned char * seq = (const unsigned char *) blob_char + pos[POS_SEQ_BEG];
+      const unsigned char * qual = (const unsigned char *) blob_char + pos[POS_QUAL_BEG];
+      lenarray[seqlen < maxpos ? seqlen : maxpos]++;
+      Py_ssize_t gc = 0;
+      for (Py_ssize_t j = 0; j < seqlen; j++) {
+	const unsigned char code = base2bit(seq[j]);
+	gc += (code == 1) | (code == 2);
+	if (j < maxpos) {
+	  qualarray[j] += qual[j] - phredoffset;
+	  basearray[5 * j + code]++;
+	}
+      }
+      if (seqlen > 0) {
+	gcarray[(200 * gc + seqlen) / (2 * seqlen)]++;
+      }
+    }
+    Py_END_ALLOW_THREADS
+  }
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  PyBuffer_Release(&lengths);
+  PyBuffer_Release(&qualsums);
+  PyBuffer_Release(&basecounts);
+  PyBuffer_Release(&gchist);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
+/* MurmurHash3 (x64, 128 bits) of a 64-bit integer (8 bytes, little-endian)
+ * with a seed. The first 64 bits of the hash are returned. */
+static inline uint64_t
+rotl64(const uint64_t x, const int r)
+{
+  return (x << r) | (x >> (64 - r));
+}
+
+static inline uint64_t
+fmix64(uint64_t k)
+{
+  k ^= k >> 33;
+  k *= 0xff51afd7ed558ccdULL;
+  k ^= k >> 33;
+  k *= 0xc4ceb9fe1a85ec53ULL;
+  k ^= k >> 33;
+  return k;
+}
+
+static inline uint64_t
+murmurhash3_u64(const uint64_t value, const uint32_t seed)
+{
+  const uint64_t c1 = 0x87c37b91114253d5ULL;
+  const uint64_t c2 = 0x4cf5ad432745937fULL;
+  uint64_t h1 = seed;
+  uint64_t h2 = seed;
+  uint64_t k1 = value;
+  k1 *= c1;
+  k1 = rotl64(k1, 31);
+  k1 *= c2;
+  h1 ^= k1;
+  h1 ^= 8;
+  h2 ^= 8;
+  h1 += h2;
+  h2 += h1;
+  h1 = fmix64(h1);
+  h2 = fmix64(h2);
+  h1 += h2;
+  return h1;
+}
+
+/* Compute the hashes of the canonical k-mers (the smallest of the 2-bit
+ * encodings of the k-mer and of its reverse complement) in a sequence,
+ * skipping k-mers with bases other than A, C, G, or T. BODY is run
+ * for each k-mer, with its hash in the variable `hash`. */
+#define FOREACH_KMERHASH(seq, seqlen, k, seed, hash, BODY)		\
+  {									\
+    const uint64_t mask_ = (k == 32) ? ~((uint64_t) 0) : ((((uint64_t) 1) << (2 * k)) - 1); \
+    const int shift_ = 2 * (k - 1);					\
+    uint64_t fwd_ = 0;							\
+    uint64_t rev_ = 0;							\
+    int valid_ = 0;							\
+    for (Py_ssize_t j_ = 0; j_ < seqlen; j_++) {			\
+      const unsigned char code_ = base2bit(seq[j_]);			\
+      if (code_ > 3) {							\
+	valid_ = 0;							\
+	continue;							\
+      }									\
+      fwd_ = ((fwd_ << 2) | code_) & mask_;				\
+      rev_ = (rev_ >> 2) | (((uint64_t) (3 - code_)) << shift_);	\
+      if (valid_ < k) {							\
+	valid_++;							\
+      }									\
+      if (valid_ == k) {						\
+	const uint64_t hash = murmurhash3_u64(fwd_ < rev_ ? fwd_ : rev_, seed); \
+	BODY								\
+      }									\
+    }									\
+  }
+
+/* Check the arguments common to the functions on k-mers in chunks. */
+static const char *
+check_kmer_args(Py_buffer * blob, Py_buffer * positions, const Py_ssize_t count,
+		const int k)
+{
+  if (k < 1 || k > 32) {
+    return "k must be between 1 and 32.";
+  }
+  if (positions->itemsize != sizeof(long long)) {
+    return "The buffer of positions must be of format type q.";
+  }
+  if (count < 0 || positions->len < 6 * count * positions->itemsize) {
+    return "The buffer of positions is too small for the number of entries.";
+  }
+  const long long * posarray = (const long long *) positions->buf;
+  for (Py_ssize_t i = 0; i < count; i++) {
+    const long long * pos = posarray + 6 * i;
+    if (pos[POS_SEQ_BEG] < 0 || pos[POS_SEQ_END] < pos[POS_SEQ_BEG] ||
+	pos[POS_SEQ_END] > blob->len) {
+      return "Invalid positions.";
+    }
+  }
+  return NULL;
+}
+
+PyDoc_STRVAR(kmerhashes_chunk_doc,
+             "kmerhashes_chunk(blob, positions, count, k, seed) -> bytes\n\n"
+             "Compute the hashes (MurmurHash3) of the canonical k-mers in the\n"
+             "sequences of FASTQ entries, skipping k-mers with bases other than\n"
+             "A, C, G, or T.\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+	     "- count: number of entries\n"
+	     "- k: size of the k-mers (at most 32)\n"
+	     "- seed: seed for the hash function\n"
+	     "Returns the hashes as unsigned 64-bit integers in native byte order.");
+
+static PyObject *
+kmerhashes_chunk(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  int k;
+  unsigned int seed;
+
+  if (!PyArg_ParseTuple(args, "y*y*niI", &blob, &positions, &count, &k, &seed)) {
+    return NULL;
+  }
+
+  PyObject * res = NULL;
+  const char * error = check_kmer_args(&blob, &positions, count, k);
+  if (error == NULL) {
+    const long long * posarray = (const long long *) positions.buf;
+    Py_ssize_t nmax = 0;
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const Py_ssize_t seqlen = posarray[6 * i + POS_SEQ_END] - posarray[6 * i + POS_SEQ_BEG];
+      if (seqlen >= k) {
+	nmax += seqlen - k + 1;
+      }
+    }
+    res = PyBytes_FromStringAndSize(NULL, nmax * sizeof(uint64_t));
+    if (res != NULL) {
+      uint64_t * hashes = (uint64_t *) PyBytes_AS_STRING(res);
+      Py_ssize_t n = 0;
+      Py_BEGIN_ALLOW_THREADS
+      for (Py_ssize_t i = 0; i < count; i++) {
+	const unsigned char * seq = (const unsigned char *) blob.buf + posarray[6 * i + POS_SEQ_BEG];
+	const Py_ssize_t seqlen = posarray[6 * i + POS_SEQ_END] - posarray[6 * i + POS_SEQ_BEG];
+	FOREACH_KMERHASH(seq, seqlen, k, seed, hash, {
+	    hashes[n++] = hash;
+	  })
+      }
+      Py_END_ALLOW_THREADS
+      if (n < nmax) {
+	_PyBytes_Resize(&res, n * sizeof(uint64_t));
+      }
+    }
+  }
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return res;
+}
+
+/* Insert a hash in a bottom sketch (sorted, distinct hashes) with
+ * capacity size and n hashes. Return the new number of hashes. */
+static inline Py_ssize_t
+sketch_insert(uint64_t * sketch, const Py_ssize_t size, Py_ssize_t n,
+	      const uint64_t hash)
+{
+  if (n == size && hash >= sketch[n - 1]) {
+    return n;
+  }
+  Py_ssize_t lo = 0;
+  Py_ssize_t hi = n;
+  while (lo < hi) {
+    const Py_ssize_t mid = lo + (hi - lo) / 2;
+    if (sketch[mid] < hash) {
+      lo = mid + 1;
+    } else {
+      hi = mid;
+    }
+  }
+  if (lo < n && sketch[lo] == hash) {
+    return n;
+  }
+  if (n == size) {
+    n--;
+  }
+  memmove(sketch + lo + 1, sketch + lo, (n - lo) * sizeof(uint64_t));
+  sketch[lo] = hash;
+  return n + 1;
+}
+
+PyDoc_STRVAR(sketch_chunk_doc,
+             "sketch_chunk(blob, positions, count, k, seed, sketch, n) -> int\n\n"
+             "Add the hashes of the canonical k-mers in the sequences of FASTQ\n"
+             "entries to a bottom sketch **in-place** (see kmerhashes_chunk).\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+	     "- count: number of entries\n"
+	     "- k: size of the k-mers (at most 32)\n"
+	     "- seed: seed for the hash function\n"
+	     "- sketch: a writable buffer of type Q with the smallest distinct hashes "
+	     "in increasing order (its size is the size of the sketch)\n"
+	     "- n: number of hashes in sketch\n"
+	     "Returns the number of hashes in sketch.");
+
+static PyObject *
+sketch_chunk(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  int k;
+  unsigned int seed;
+  Py_buffer sketch;
+  Py_ssize_t n;
+
+  if (!PyArg_ParseTuple(args, "y*y*niIw*n", &blob, &positions, &count, &k, &seed,
+			&sketch, &n)) {
+    return NULL;
+  }
+
+  const char * error = check_kmer_args(&blob, &positions, count, k);
+  const Py_ssize_t size = sketch.len / (Py_ssize_t) sizeof(uint64_t);
+  if (error == NULL && sketch.itemsize != sizeof(uint64_t)) {
+    error = "The sketch must be of format type Q.";
+  } else if (error == NULL && (n < 0 || n > size || size == 0)) {
+    error = "Invalid number of hashes in the sketch.";
+  }
+  if (error == NULL) {
+    const long long * posarray = (const long long *) positions.buf;
+    uint64_t * sketcharray = (uint64_t *) sketch.buf;
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const unsigned char * seq = (const unsigned char *) blob.buf + posarray[6 * i + POS_SEQ_BEG];
+      const Py_ssize_t seqlen = posarray[6 * i + POS_SEQ_END] - posarray[6 * i + POS_SEQ_BEG];
+      FOREACH_KMERHASH(seq, seqlen, k, seed, hash, {
+	  n = sketch_insert(sketcharray, size, n, hash);
+	})
+    }
+    Py_END_ALLOW_THREADS
+  }
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  PyBuffer_Release(&sketch);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return PyLong_FromSsize_t(n);
+}
+
+PyDoc_STRVAR(formatentries_doc,
+             "formatentries(entries, out, fasta) -> int\n\n"
+             "Append FASTQ (or FASTA) entries to a bytearray **in-place**.\n"
+	     "- entries: a sequence of (header, sequence, quality) with bytes-like\n"
+	     "  objects (the header without its leading @)\n"
+	     "- out: a bytearray\n"
+	     "- fasta: write FASTA entries (the qualities are ignored)\n"
+	     "Returns the number of bytes appended.");
+
+static PyObject *
+formatentries(PyObject * self, PyObject * args)
+{
+  PyObject * entries;
+  PyObject * out;
+  int fasta;
+
+  if (!PyArg_ParseTuple(args, "OO!p", &entries, &PyByteArray_Type, &out, &fasta)) {
+    return NULL;
+  }
+  PyObject * entries_fast = PySequence_Fast(entries, "entries must be a sequence.");
+  if (entries_fast == NULL) {
+    return NULL;
+  }
+  const Py_ssize_t nfields = fasta ? 2 : 3;
+  const Py_ssize_t start = PyByteArray_GET_SIZE(out);
+  Py_ssize_t size = start;
+  const Py_ssize_t count = PySequence_Fast_GET_SIZE(entries_fast);
+  PyObject ** items = PySequence_Fast_ITEMS(entries_fast);
+  int ok = 1;
+  for (Py_ssize_t i = 0; ok && i < count; i++) {
+    PyObject * entry = PySequence_Fast(items[i], "An entry must be a sequence.");
+    if (entry == NULL) {
+      ok = 0;
+      break;
+    }
+    Py_buffer fields[3];
+    Py_ssize_t nbuffers = 0;
+    if (PySequence_Fast_GET_SIZE(entry) < nfields) {
+      PyErr_SetString(PyExc_ValueError, "An entry must have a header, a sequence, and a quality.");
+      ok = 0;
+    }
+    for (; ok && nbuffers < nfields; nbuffers++) {
+      if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(entry, nbuffers),
+			     &fields[nbuffers], PyBUF_SIMPLE) != 0) {
+	ok = 0;
+	break;
+      }
+    }
+    if (ok && !fasta && fields[2].len != fields[1].len) {
+      PyErr_SetString(PyExc_ValueError, "The sequence and the quality must have the same length.");
+      ok = 0;
+    }
+    if (ok) {
+      /* @header\nsequence\n+\nquality\n or >header\nsequence\n */
+      const Py_ssize_t entrysize = fasta ?
+	fields[0].len + fields[1].len + 3 :
+	fields[0].len + 2 * fields[1].len + 6;
+      if (PyByteArray_Resize(out, size + entrysize) != 0) {
+	ok = 0;
+      } else {
+	char * dst = PyByteArray_AS_STRING(out) + size;
+	*dst++ = fasta ? '>' : '@';
+	memcpy(dst, fields[0].buf, fields[0].len);
+	dst += fields[0].len;
+	*dst++ = '\n';
+	memcpy(dst, fields[1].buf, fields[1].len);
+	dst += fields[1].len;
+	*dst++ = '\n';
+	if (!fasta) {
+	  *dst++ = '+';
+	  *dst++ = '\n';
+	  memcpy(dst, fields[2].buf, fields[2].len);
+	  dst += fields[2].len;
+	  *dst++ = '\n';
+	}
+	size += entrysize;
+      }
+    }
+    for (Py_ssize_t j = 0; j < nbuffers; j++) {
+      PyBuffer_Release(&fields[j]);
+    }
+    Py_DECREF(entry);
+  }
+  Py_DECREF(entries_fast);
+  if (!ok) {
+    return NULL;
+  }
+  return PyLong_FromSsize_t(size - start);
+}
+
+/* Whether the sequence and the quality of an entry end at the end of
+ * their lines (that is the entry was not trimmed and can be copied as
+ * it is in the blob). */
+static inline int
+entry_untrimmed(const char * blob_char, const Py_ssize_t len, const long long * pos)
+{
+  return pos[POS_SEQ_END] < len && blob_char[pos[POS_SEQ_END]] == '\n' &&
+    (pos[POS_QUAL_END] == len || blob_char[pos[POS_QUAL_END]] == '\n');
+}
+
+PyDoc_STRVAR(copyentries_doc,
+             "copyentries(blob, positions, count, keep, out, fasta) -> int\n\n"
+             "Append FASTQ entries in a buffer to a bytearray **in-place**, without\n"
+	     "building Python objects for the entries.\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+	     "- count: number of entries\n"
+	     "- keep: None (all entries are copied), or a bytes-like object with\n"
+	     "  one byte for each entry (entries with a zero byte are skipped)\n"
+	     "- out: a bytearray\n"
+	     "- fasta: write FASTA entries (the qualities are dropped)\n"
+	     "Entries trimmed with trimentries are written with a quality header\n"
+	     "that is just '+'.\n"
+	     "Returns the number of bytes appended.");
+
+static PyObject *
+copyentries(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  PyObject * keep_obj;
+  PyObject * out;
+  int fasta;
+
+  if (!PyArg_ParseTuple(args, "y*y*nOO!p", &blob, &positions, &count,
+			&keep_obj, &PyByteArray_Type, &out, &fasta)) {
+    return NULL;
+  }
+
+  Py_buffer keep;
+  keep.buf = NULL;
+  const char * error = NULL;
+  Py_ssize_t size = 0;
+  if (keep_obj != Py_None &&
+      PyObject_GetBuffer(keep_obj, &keep, PyBUF_SIMPLE) != 0) {
+    goto cleanup;
+  }
+  if (positions.itemsize != sizeof(long long)) {
+    error = "The buffer of positions must be of format type q.";
+    goto cleanup;
+  }
+  if (count < 0 || positions.len < 6 * count * positions.itemsize ||
+      (keep.buf != NULL && keep.len < count)) {
+    error = "The buffers are too small for the number of entries.";
+    goto cleanup;
+  }
+  const long long * posarray = (const long long *) positions.buf;
+  const unsigned char * keeparray = (const unsigned char *) keep.buf;
+  for (Py_ssize_t i = 0; i < count; i++) {
+    if (keeparray != NULL && keeparray[i] == 0) {
+      continue;
+    }
+    const long long * pos = posarray + 6 * i;
+    if (pos[POS_HEAD_BEG] < 0 || pos[POS_QUAL_END] > blob.len ||
+	pos[POS_HEAD_END] < pos[POS_HEAD_BEG] + 1 ||
+	pos[POS_SEQ_BEG] < pos[POS_HEAD_END] ||
+	pos[POS_SEQ_END] < pos[POS_SEQ_BEG] ||
+	pos[POS_QUAL_BEG] < pos[POS_SEQ_END] ||
+	pos[POS_QUAL_END] < pos[POS_QUAL_BEG]) {
+      error = "Invalid positions.";
+      goto cleanup;
+    }
+    size += fasta ?
+      pos[POS_HEAD_END] - pos[POS_HEAD_BEG] + pos[POS_SEQ_END] - pos[POS_SEQ_BEG] + 2 :
+      entry_untrimmed(blob.buf, blob.len, pos) ?
+      pos[POS_QUAL_END] - pos[POS_HEAD_BEG] + 1 :
+      pos[POS_SEQ_END] - pos[POS_HEAD_BEG] + pos[POS_QUAL_END] - pos[POS_QUAL_BEG] + 4;
+  }
+  const Py_ssize_t start = PyByteArray_GET_SIZE(out);
+  if (PyByteArray_Resize(out, start + size) != 0) {
+    size = -1;
+    goto cleanup;
+  }
+  char * dst = PyByteArray_AS_STRING(out) + start;
+  const char * blob_char = (const char *) blob.buf;
+  for (Py_ssize_t i = 0; i < count; i++) {
+    if (keeparray != NULL && keeparray[i] == 0) {
+      continue;
+    }
+    const long long * pos = posarray + 6 * i;
+    if (fasta) {
+      *dst++ = '>';
+      memcpy(dst, blob_char + pos[POS_HEAD_BEG] + 1, pos[POS_HEAD_END] - pos[POS_HEAD_BEG] - 1);
+      dst += pos[POS_HEAD_END] - pos[POS_HEAD_BEG] - 1;
+      *dst++ = '\n';
+      memcpy(dst, blob_char + pos[POS_SEQ_BEG], pos[POS_SEQ_END] - pos[POS_SEQ_BEG]);
+      dst += pos[POS_SEQ_END] - pos[POS_SEQ_BEG];
+    } else if (entry_untrimmed(blob_char, blob.len, pos)) {
+      memcpy(dst, blob_char + pos[POS_HEAD_BEG], pos[POS_QUAL_END] - pos[POS_HEAD_BEG]);
+      dst += pos[POS_QUAL_END] - pos[POS_HEAD_BEG];
+    } else {
+      /* Trimmed entry (see trimentries) */
+      memcpy(dst, blob_char + pos[POS_HEAD_BEG], pos[POS_SEQ_END] - pos[POS_HEAD_BEG]);
+      dst += pos[POS_SEQ_END] - pos[POS_HEAD_BEG];
+      memcpy(dst, "\n+\n", 3);
+      dst += 3;
+      memcpy(dst, blob_char + pos[POS_QUAL_BEG], pos[POS_QUAL_END] - pos[POS_QUAL_BEG]);
+      dst += pos[POS_QUAL_END] - pos[POS_QUAL_BEG];
+    }
+    *dst++ = '\n';
+  }
+
+ cleanup:
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  if (keep.buf != NULL) {
+    PyBuffer_Release(&keep);
+  }
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  if (PyErr_Occurred()) {
+    return NULL;
+  }
+  return PyLong_FromSsize_t(size);
+}
+
+/* Size of the window of a deflate stream (the largest distance back). */
+#define GZ_WINSIZE 32768
+/* Largest amount of compressed data given to zlib at once. */
+#define GZ_CHUNK ((Py_ssize_t) 1 << 30)
+
+/* Give zlib the input in cdata from the position pos. */
+static inline void
+gz_feed(z_stream * strm, const unsigned char * cdata, const Py_ssize_t clen,
+	const Py_ssize_t pos)
+{
+  const Py_ssize_t n = clen - pos;
+  strm->next_in = (Bytef *) cdata + pos;
+  strm->avail_in = (uInt) (n > GZ_CHUNK ? GZ_CHUNK : n);
+}
+
+/* Size of the buffer for the decompressed data when it is also passed on
+ * to a callable (the last GZ_WINSIZE bytes of it make the window). */
+#define GZ_OUTSIZE ((Py_ssize_t) 1 << 20)
+
+/* Update a CRC32 checksum with data of any length. */
+static inline uLong
+gz_crc32(uLong crc, const unsigned char * buf, Py_ssize_t len)
+{
+  while (len > 0) {
+    const Py_ssize_t n = len > GZ_CHUNK ? GZ_CHUNK : len;
+    crc = crc32(crc, buf, (uInt) n);
+    buf += n;
+    len -= n;
+  }
+  return crc;
+}
+
+/* Decompress gzip data and find checkpoints (see gzip_checkpoints). When
+ * out is not NULL, it is called with each block of decompressed data. The
+ * CRC32 checksum of cdata is stored in crc. Returns a new reference to the
+ * list of checkpoints, or NULL with an exception set. */
+static PyObject *
+gz_scan(Py_buffer * cdata, Py_ssize_t span, PyObject * out, uLong * crc)
+{
+  const char * error = NULL;
+  PyObject * res = NULL;
+  unsigned char * window = NULL;
+  unsigned char * dict = NULL;
+  const Py_ssize_t outsize = out == NULL ? GZ_WINSIZE : GZ_OUTSIZE;
+  z_stream strm;
+  memset(&strm, 0, sizeof(strm));
+  int initialized = 0;
+
+  if (span < 1) {
+    error = "span must be at least 1.";
+    goto cleanup;
+  }
+  window = PyMem_Malloc(outsize);
+  dict = PyMem_Malloc(GZ_WINSIZE);
+  res = PyList_New(0);
+  if (window == NULL || dict == NULL || res == NULL) {
+    if (!PyErr_Occurred()) {
+      PyErr_NoMemory();
+    }
+    Py_CLEAR(res);
+    goto cleanup;
+  }
+  /* 15 + 32: gzip (or zlib) header, detected automatically. */
+  if (inflateInit2(&strm, 47) != Z_OK) {
+    error = "Could not initialize zlib.";
+    goto cleanup;
+  }
+  initialized = 1;
+  const unsigned char * in = (const unsigned char *) cdata->buf;
+  Py_ssize_t totin = 0;
+  Py_ssize_t totout = 0;
+  Py_ssize_t last = 0;
+  /* Position in the input up to which the checksum is computed. */
+  Py_ssize_t crcpos = 0;
+  *crc = crc32(0L, Z_NULL, 0);
+  strm.avail_out = 0;
+  gz_feed(&strm, in, cdata->len, 0);
+  while (1) {
+    if (strm.avail_in == 0) {
+      if (totin == cdata->len) {
+	error = "Truncated gzip data.";
+	break;
+      }
+      gz_feed(&strm, in, cdata->len, totin);
+    }
+    /* The output goes to a circular buffer (with at least the last 32KB). */
+    if (strm.avail_out == 0) {
+      if (out != NULL && totout > 0) {
+	PyObject * ret = PyObject_CallFunction(out, "y#", window, outsize);
+	if (ret == NULL) {
+	  Py_CLEAR(res);
+	  break;
+	}
+	Py_DECREF(ret);
+      }
+      strm.next_out = window;
+      strm.avail_out = (uInt) outsize;
+    }
+    totin += strm.avail_in;
+    totout += strm.avail_out;
+    int ret;
+    Py_BEGIN_ALLOW_THREADS
+    ret = inflate(&strm, Z_BLOCK);
+    Py_END_ALLOW_THREADS
+    totin -= strm.avail_in;
+    totout -= strm.avail_out;
+    if (ret == Z_NEED_DICT || ret == Z_DATA_ERROR || ret == Z_MEM_ERROR) {
+      error = "Invalid gzip data.";
+      break;
+    }
+    if (ret == Z_STREAM_END) {
+      /* End of a gzip member, possibly followed by others (or by
+       * padding with zeros). */
+      while (totin < cdata->len && in[totin] == 0) {
+	totin++;
+      }
+      *crc = gz_crc32(*crc, in + crcpos, totin - crcpos);
+      crcpos = totin;
+      if (totin == cdata->len) {
+	const Py_ssize_t have = outsize - strm.avail_out;
+	if (out != NULL && have > 0) {
+	  PyObject * ret = PyObject_CallFunction(out, "y#", window, have);
+	  if (ret == NULL) {
+	    Py_CLEAR(res);
+	    break;
+	  }
+	  Py_DECREF(ret);
+	}
+	break;
+      }
+      inflateReset(&strm);
+      gz_feed(&strm, in, cdata->len, totin);
+      continue;
+    }
+    *crc = gz_crc32(*crc, in + crcpos, totin - crcpos);
+    crcpos = totin;
+    /* At the end of a deflate block (not the last one of a member). */
+    if ((strm.data_type & 128) && !(strm.data_type & 64) &&
+	(totout == 0 || totout - last >= span)) {
+      const Py_ssize_t have = outsize - strm.avail_out;
+      const Py_ssize_t wsize = totout >= GZ_WINSIZE ? GZ_WINSIZE : totout;
+      if (have >= wsize) {
+	memcpy(dict, window + have - wsize, wsize);
+      } else {
+	memcpy(dict, window + outsize - (wsize - have), wsize - have);
+	memcpy(dict + wsize - have, window, have);
+      }
+      PyObject * point = Py_BuildValue("(ninN)", totin, strm.data_type & 7, totout,
+				       PyBytes_FromStringAndSize((const char *) dict, wsize));
+      if (point == NULL || PyList_Append(res, point) != 0) {
+	Py_XDECREF(point);
+	Py_CLEAR(res);
+	break;
+      }
+      Py_DECREF(point);
+      last = totout;
+    }
+  }
+
+ cleanup:
+  if (initialized) {
+    inflateEnd(&strm);
+  }
+  PyMem_Free(window);
+  PyMem_Free(dict);
+  if (error != NULL) {
+    Py_XDECREF(res);
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return res;
+}
+
+PyDoc_STRVAR(gzip_checkpoints_doc,
+             "gzip_checkpoints(cdata, span) -> list\n\n"
+             "Find checkpoints to start decompressing gzip data from, at the\n"
+	     "boundaries of deflate blocks (as in zran.c, from zlib's examples).\n"
+	     "- cdata: a bytes-like object with gzip data (one or several members)\n"
+	     "- span: minimum number of decompressed bytes between checkpoints\n"
+	     "Returns a list of (cpos, bits, upos, window), with cpos the position in\n"
+	     "cdata, bits the number of bits of the byte before cpos (0 to 7) to\n"
+	     "start with, upos the position in the decompressed data, and window the\n"
+	     "decompressed data preceding upos (up to 32KB).");
+
+static PyObject *
+gzip_checkpoints(PyObject * self, PyObject * args)
+{
+  Py_buffer cdata;
+  Py_ssize_t span;
+
+  if (!PyArg_ParseTuple(args, "y*n", &cdata, &span)) {
+    return NULL;
+  }
+  uLong crc;
+  PyObject * res = gz_scan(&cdata, span, NULL, &crc);
+  PyBuffer_Release(&cdata);
+  return res;
+}
+
+PyDoc_STRVAR(gzip_scan_doc,
+             "gzip_scan(cdata, span, out) -> tuple\n\n"
+             "Decompress gzip data in one pass, finding checkpoints (see\n"
+	     "gzip_checkpoints) and computing the checksum of the compressed data.\n"
+	     "- cdata: a bytes-like object with gzip data (one or several members)\n"
+	     "- span: minimum number of decompressed bytes between checkpoints\n"
+	     "- out: a callable called with each block of decompressed data, in\n"
+	     "  order (an exception raised by it stops the decompression)\n"
+	     "Returns a tuple (checkpoints, crc32), with the list of checkpoints\n"
+	     "as returned by gzip_checkpoints and the CRC32 checksum of cdata.");
+
+static PyObject *
+gzip_scan(PyObject * self, PyObject * args)
+{
+  Py_buffer cdata;
+  Py_ssize_t span;
+  PyObject * out;
+
+  if (!PyArg_ParseTuple(args, "y*nO", &cdata, &span, &out)) {
+    return NULL;
+  }
+  PyObject * res = NULL;
+  if (!PyCallable_Check(out)) {
+    PyErr_SetString(PyExc_TypeError, "out must be callable.");
+    goto cleanup;
+  }
+  uLong crc;
+  PyObject * checkpoints = gz_scan(&cdata, span, out, &crc);
+  if (checkpoints != NULL) {
+    res = Py_BuildValue("(Nk)", checkpoints, crc);
+  }
+
+ cleanup:
+  PyBuffer_Release(&cdata);
+  return res;
+}
+
+PyDoc_STRVAR(gzip_extract_doc,
+             "gzip_extract(cdata, cpos, bits, window, skip, length) -> bytes\n\n"
+             "Decompress gzip data from a checkpoint (see gzip_checkpoints).\n"
+	     "- cdata: a bytes-like object with gzip data\n"
+	     "- cpos: position in cdata to start from\n"
+	     "- bits: number of bits of the byte before cpos to start with\n"
+	     "- window: decompressed data preceding the checkpoint, or None to\n"
+	     "  start at the beginning of a gzip member\n"
+	     "- skip: number of decompressed bytes to skip\n"
+	     "- length: number of decompressed bytes to return\n"
+	     "Returns the decompressed data (shorter than length if the end of\n"
+	     "the data is reached).");
+
+static PyObject *
+gzip_extract(PyObject * self, PyObject * args)
+{
+  Py_buffer cdata;
+  Py_ssize_t cpos;
+  int bits;
+  PyObject * window_obj;
+  Py_ssize_t skip;
+  Py_ssize_t length;
+
+  if (!PyArg_ParseTuple(args, "y*niOnn", &cdata, &cpos, &bits, &window_obj,
+			&skip, &length)) {
+    return NULL;
+  }
+
+  Py_buffer window;
+  window.buf = NULL;
+  const char * error = NULL;
+  PyObject * res = NULL;
+  unsigned char * discard = NULL;
+  z_stream strm;
+  memset(&strm, 0, sizeof(strm));
+  int initialized = 0;
+  int raw = (window_obj != Py_None);
+
+  if (raw && PyObject_GetBuffer(window_obj, &window, PyBUF_SIMPLE) != 0) {
+    goto cleanup;
+  }
+  if (cpos < 0 || cpos > cdata.len || bits < 0 || bits > 7 ||
+      (bits > 0 && cpos == 0) || skip < 0 || length < 0 ||
+      (raw && window.len > GZ_WINSIZE)) {
+    error = "Invalid checkpoint.";
+    goto cleanup;
+  }
+  discard = PyMem_Malloc(GZ_WINSIZE);
+  res = PyBytes_FromStringAndSize(NULL, length);
+  if (discard == NULL || res == NULL) {
+    if (!PyErr_Occurred()) {
+      PyErr_NoMemory();
+    }
+    goto cleanup;
+  }
+  if (inflateInit2(&strm, raw ? -15 : 47) != Z_OK) {
+    error = "Could not initialize zlib.";
+    goto cleanup;
+  }
+  initialized = 1;
+  const unsigned char * in = (const unsigned char *) cdata.buf;
+  if (raw) {
+    if (bits > 0 && inflatePrime(&strm, bits, in[cpos - 1] >> (8 - bits)) != Z_OK) {
+      error = "Invalid checkpoint.";
+      goto cleanup;
+    }
+    if (window.len > 0 &&
+	inflateSetDictionary(&strm, (const Bytef *) window.buf, (uInt) window.len) != Z_OK) {
+      error = "Invalid checkpoint.";
+      goto cleanup;
+    }
+  }
+  unsigned char * out = (unsigned char *) PyBytes_AS_STRING(res);
+  Py_ssize_t produced = 0;
+  Py_ssize_t pos = cpos;
+  Py_BEGIN_ALLOW_THREADS
+  gz_feed(&strm, in, cdata.len, pos);
+  while (produced < length) {
+    if (strm.avail_in == 0) {
+      pos = (const unsigned char *) strm.next_in - in;
+      if (pos == cdata.len) {
+	/* End of the data. */
+	break;
+      }
+      gz_feed(&strm, in, cdata.len, pos);
+    }
+    Py_ssize_t avail;
+    if (skip > 0) {
+      avail = skip > GZ_WINSIZE ? GZ_WINSIZE : skip;
+      strm.next_out = discard;
+    } else {
+      avail = length - produced > GZ_CHUNK ? GZ_CHUNK : length - produced;
+      strm.next_out = out + produced;
+    }
+    strm.avail_out = (uInt) avail;
+    int ret = inflate(&strm, Z_NO_FLUSH);
+    if (ret == Z_NEED_DICT || ret == Z_DATA_ERROR || ret == Z_MEM_ERROR) {
+      error = "Invalid gzip data.";
+      break;
+    }
+    const Py_ssize_t n = avail - strm.avail_out;
+    if (skip > 0) {
+      skip -= n;
+    } else {
+      produced += n;
+    }
+    if (ret == Z_STREAM_END) {
+      /* End of a gzip member, possibly followed by others. Without
+       * a header, the 8 bytes of the trailer are left. */
+      pos = (const unsigned char *) strm.next_in - in;
+      if (raw) {
+	pos += 8;
+	raw = 0;
+      }
+      while (pos < cdata.len && in[pos] == 0) {
+	pos++;
+      }
+      if (pos >= cdata.len) {
+	break;
+      }
+      inflateReset2(&strm, 47);
+      gz_feed(&strm, in, cdata.len, pos);
+    } else if (ret == Z_BUF_ERROR) {
+      error = "Truncated gzip data.";
+      break;
+    }
+  }
+  Py_END_ALLOW_THREADS
+  if (error == NULL && produced < length) {
+    _PyBytes_Resize(&res, produced);
+  }
+
+ cleanup:
+  if (initialized) {
+    inflateEnd(&strm);
+  }
+  PyMem_Free(discard);
+  if (window.buf != NULL) {
+    PyBuffer_Release(&window);
+  }
+  PyBuffer_Release(&cdata);
+  if (error != NULL) {
+    Py_XDECREF(res);
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return res;
+}
+
+/* Fields of Illumina (CASAVA 1.8) headers:
+ * @<instrument>:<run>:<flowcell>:<lane>:<tile>:<x>:<y>[:<UMI>] <read>:<filtered>:<control>:<index>
+ * The instrument and the flowcell are positions (begin, end) in the blob. */
+#define ILLUMINA_INSTRUMENT_BEG 0
+#define ILLUMINA_INSTRUMENT_END 1
+#define ILLUMINA_RUN 2
+#define ILLUMINA_FLOWCELL_BEG 3
+#define ILLUMINA_FLOWCELL_END 4
+#define ILLUMINA_LANE 5
+#define ILLUMINA_TILE 6
+#define ILLUMINA_X 7
+#define ILLUMINA_Y 8
+#define ILLUMINA_READ 9
+#define ILLUMINA_FILTERED 10
+#define ILLUMINA_CONTROL 11
+#define ILLUMINA_NFIELDS 12
+/* Status for a header */
+#define ILLUMINA_OK 0
+#define ILLUMINA_MALFORMED 1
+#define ILLUMINA_BARCODE_TRUNCATED 2
+
+/* Parse a field of digits in h[*cur:end] up to the separator sep (or
+ * end). Return -1 if the field is not a non-negative integer. */
+static inline long long
+illumina_int(const char * h, Py_ssize_t * cur, const Py_ssize_t end, const char sep)
+{
+  Py_ssize_t i = *cur;
+  long long value = 0;
+  while (i < end && h[i] != sep) {
+    if (h[i] < '0' || h[i] > '9' || i - *cur >= 18) {
+      return -1;
+    }
+    value = value * 10 + (h[i] - '0');
+    i++;
+  }
+  if (i == *cur) {
+    return -1;
+  }
+  *cur = i;
+  return value;
+}
+
+/* Position of the separator sep (or end) in h[cur:end]. */
+static inline Py_ssize_t
+illumina_str(const char * h, const Py_ssize_t cur, const Py_ssize_t end, const char sep)
+{
+  const char * adr = memchr(h + cur, sep, end - cur);
+  return adr == NULL ? end : adr - h;
+}
+
+/* Parse the Illumina header in blob_char[beg:end] into the ILLUMINA_NFIELDS
+ * values (spaced by stride) and the barcode. Return the status. */
+static int
+parse_illumina(const char * h, const Py_ssize_t beg, const Py_ssize_t end,
+	       long long * values, const Py_ssize_t stride,
+	       char * barcode, const Py_ssize_t barcodelen)
+{
+  long long v[ILLUMINA_NFIELDS];
+  for (int f = 0; f < ILLUMINA_NFIELDS; f++) {
+    v[f] = -1;
+  }
+  memset(barcode, 0, barcodelen);
+  int status = ILLUMINA_MALFORMED;
+  const Py_ssize_t idend = illumina_str(h, beg, end, ' ');
+  Py_ssize_t cur = beg;
+  /* instrument */
+  Py_ssize_t sep = illumina_str(h, cur, idend, ':');
+  if (sep == cur || sep == idend) {
+    goto done;
+  }
+  v[ILLUMINA_INSTRUMENT_BEG] = cur;
+  v[ILLUMINA_INSTRUMENT_END] = sep;
+  cur = sep + 1;
+  if ((v[ILLUMINA_RUN] = illumina_int(h, &cur, idend, ':')) < 0 || cur == idend) {
+    goto done;
+  }
+  cur++;
+  /* flowcell */
+  sep = illumina_str(h, cur, idend, ':');
+  if (sep == cur || sep == idend) {
+    goto done;
+  }
+  v[ILLUMINA_FLOWCELL_BEG] = cur;
+  v[ILLUMINA_FLOWCELL_END] = sep;
+  cur = sep + 1;
+  const int intfields[4] = {ILLUMINA_LANE, ILLUMINA_TILE, ILLUMINA_X, ILLUMINA_Y};
+  for (int f = 0; f < 4; f++) {
+    if ((v[intfields[f]] = illumina_int(h, &cur, idend, ':')) < 0 ||
+	(f < 3 && cur == idend)) {
+      goto done;
+    }
+    if (cur < idend) {
+      cur++;
+    }
+  }
+  /* An optional UMI follows y (without other fields). */
+  if (cur < idend && illumina_str(h, cur, idend, ':') != idend) {
+    goto done;
+  }
+  status = ILLUMINA_OK;
+  if (idend == end) {
+    /* No comment. */
+    goto done;
+  }
+  status = ILLUMINA_MALFORMED;
+  cur = idend + 1;
+  const Py_ssize_t commentend = illumina_str(h, cur, end, ' ');
+  if ((v[ILLUMINA_READ] = illumina_int(h, &cur, commentend, ':')) < 0 ||
+      cur == commentend) {
+    goto done;
+  }
+  cur++;
+  if (cur + 1 >= commentend || h[cur + 1] != ':' || (h[cur] != 'Y' && h[cur] != 'N')) {
+    goto done;
+  }
+  v[ILLUMINA_FILTERED] = (h[cur] == 'Y');
+  cur += 2;
+  if ((v[ILLUMINA_CONTROL] = illumina_int(h, &cur, commentend, ':')) < 0 ||
+      cur == commentend) {
+    goto done;
+  }
+  cur++;
+  /* index (possibly empty) */
+  Py_ssize_t n = commentend - cur;
+  status = ILLUMINA_OK;
+  if (n > barcodelen) {
+    n = barcodelen;
+    status = ILLUMINA_BARCODE_TRUNCATED;
+  }
+  memcpy(barcode, h + cur, n);
+
+ done:
+  if (status == ILLUMINA_MALFORMED) {
+    for (int f = 0; f < ILLUMINA_NFIELDS; f++) {
+      v[f] = -1;
+    }
+  }
+  for (int f = 0; f < ILLUMINA_NFIELDS; f++) {
+    values[f * stride] = v[f];
+  }
+  return status;
+}
+
+PyDoc_STRVAR(illumina_headers_doc,
+             "illumina_headers(blob, positions, count, fields, barcodes, barcodelen, status) -> int\n\n"
+             "Parse the Illumina (CASAVA 1.8) headers of FASTQ entries **in-place**.\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+	     "- count: number of entries\n"
+	     "- fields: a writable buffer of type q for the ILLUMINA_NFIELDS fields of\n"
+	     "  each entry, by field (field f of entry i is at f * count + i). The\n"
+	     "  instrument and the flowcell are positions in blob, and fields\n"
+	     "  missing or not parsed are -1.\n"
+	     "- barcodes: a writable buffer of barcodelen bytes for each entry, for\n"
+	     "  the index sequence (padded with zeros)\n"
+	     "- barcodelen: number of bytes for each index sequence\n"
+	     "- status: a writable buffer of one byte for each entry, with ILLUMINA_OK,\n"
+	     "  ILLUMINA_MALFORMED, or ILLUMINA_BARCODE_TRUNCATED\n"
+	     "Returns the number of entries with a status other than ILLUMINA_OK.");
+
+static PyObject *
+illumina_headers(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+  Py_buffer fields;
+  Py_buffer barcodes;
+  Py_ssize_t barcodelen;
+  Py_buffer status;
+
+  if (!PyArg_ParseTuple(args, "y*y*nw*w*nw*", &blob, &positions, &count,
+			&fields, &barcodes, &barcodelen, &status)) {
+    return NULL;
+  }
+
+  const char * error = NULL;
+  Py_ssize_t nbad = 0;
+  if (positions.itemsize != sizeof(long long) || fields.itemsize != sizeof(long long)) {
+    error = "The buffers of positions and fields must be of format type q.";
+  } else if (count < 0 || barcodelen < 0 ||
+	     positions.len < 6 * count * positions.itemsize ||
+	     fields.len < ILLUMINA_NFIELDS * count * fields.itemsize ||
+	     barcodes.len < count * barcodelen || status.len < count) {
+    error = "The buffers are too small for the number of entries.";
+  } else {
+    const long long * posarray = (const long long *) positions.buf;
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const long long * pos = posarray + 6 * i;
+      if (pos[POS_HEAD_BEG] < 0 || pos[POS_HEAD_END] <= pos[POS_HEAD_BEG] ||
+	  pos[POS_HEAD_END] > blob.len) {
+	error = "Invalid positions.";
+	break;
+      }
+    }
+  }
+  if (error == NULL) {
+    const long long * posarray = (const long long *) positions.buf;
+    long long * fieldarray = (long long *) fields.buf;
+    char * barcodearray = (char *) barcodes.buf;
+    char * statusarray = (char *) status.buf;
+    Py_BEGIN_ALLOW_THREADS
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const long long * pos = posarray + 6 * i;
+      statusarray[i] = parse_illumina((const char *) blob.buf, pos[POS_HEAD_BEG] + 1,
+				      pos[POS_HEAD_END], fieldarray + i, count,
+				      barcodearray + i * barcodelen, barcodelen);
+      if (statusarray[i] != ILLUMINA_OK) {
+	nbad++;
+      }
+    }
+    Py_END_ALLOW_THREADS
+  }
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  PyBuffer_Release(&fields);
+  PyBuffer_Release(&barcodes);
+  PyBuffer_Release(&status);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return PyLong_FromSsize_t(nbad);
+}
+
+PyDoc_STRVAR(newline_scan_doc,
+             "newline_scan(name=None) -> str\n\n"
+             "Get (or set) the implementation used to find newlines when\n"
+	     "scanning batches of entries: 'avx2', 'sse2', or 'scalar'. The\n"
+	     "fastest one supported by the CPU is chosen when the module is\n"
+	     "imported.\n"
+	     "- name: None, or the name of the implementation to use\n"
+	     "Returns the name of the implementation in use.");
+
+static PyObject *
+newline_scan(PyObject * self, PyObject * args)
+{
+  const char * name = NULL;
+
+  if (!PyArg_ParseTuple(args, "|z", &name)) {
+    return NULL;
+  }
+  if (name != NULL && newline_scan_select(name) != 0) {
+    PyErr_Format(PyExc_ValueError,
+		 "The implementation '%s' is not available.", name);
+    return NULL;
+  }
+  return PyUnicode_FromString(newline_scan_name);
+}
+
+/* FNV-1a hash of a read name, that is of name[:len] up to the first space. */
+static inline uint64_t
+name_fnv1a(const unsigned char * name, const Py_ssize_t len)
+{
+  uint64_t h = FNV_OFFSET;
+  for (Py_ssize_t i = 0; i < len && name[i] != ' '; i++) {
+    h ^= name[i];
+    h *= FNV_PRIME;
+  }
+  return h;
+}
+
+PyDoc_STRVAR(namehash_doc,
+             "namehash(name)\n"
+             "Compute a 64-bit hash (FNV-1a) of a read name, that is of the\n"
+             "header up to the first space.\n"
+             "- name: a bytes-like object\n");
+
+static PyObject *
+namehash(PyObject * self, PyObject * args)
+{
+  Py_buffer buf;
+
+  if (!PyArg_ParseTuple(args, "y*", &buf)) {
+    return NULL;
+  }
+
+  const uint64_t h = name_fnv1a((const unsigned char *) buf.buf, buf.len);
+
+  PyBuffer_Release(&buf);
+  return PyLong_FromUnsignedLongLong(h);
+}
+
+PyDoc_STRVAR(namehashes_chunk_doc,
+             "namehashes_chunk(blob, positions, count) -> bytes\n\n"
+             "Compute the hashes (see namehash) of the read names of FASTQ entries.\n"
+	     "- blob: a bytes-like object\n"
+	     "- positions: a buffer of type q with 6 positions for each entry in blob\n"
+	     "- count: number of entries\n"
+	     "Returns the hashes as unsigned 64-bit integers in native byte order.");
+
+static PyObject *
+namehashes_chunk(PyObject * self, PyObject * args)
+{
+  Py_buffer blob;
+  Py_buffer positions;
+  Py_ssize_t count;
+
+  if (!PyArg_ParseTuple(args, "y*y*n", &blob, &positions, &count)) {
+    return NULL;
+  }
+
+  PyObject * res = NULL;
+  const char * error = NULL;
+  const long long * posarray = (const long long *) positions.buf;
+  if (positions.itemsize != sizeof(long long)) {
+    error = "The buffer of positions must be of format type q.";
+  } else if (count < 0 || positions.len < 6 * count * positions.itemsize) {
+    error = "The buffers are too small for the number of entries.";
+  } else {
+    for (Py_ssize_t i = 0; i < count; i++) {
+      const long long * pos = posarray + 6 * i;
+      if (pos[POS_HEAD_BEG] < 0 || pos[POS_HEAD_END] <= pos[POS_HEAD_BEG] ||
+	  pos[POS_HEAD_END] > blob.len) {
+	error = "Invalid positions.";
+	break;
+      }
+    }
+  }
+  if (error == NULL) {
+    res = PyBytes_FromStringAndSize(NULL, count * sizeof(uint64_t));
+    if (res != NULL) {
+      uint64_t * hashes = (uint64_t *) PyBytes_AS_STRING(res);
+      const unsigned char * blob_char = (const unsigned char *) blob.buf;
+      Py_BEGIN_ALLOW_THREADS
+      for (Py_ssize_t i = 0; i < count; i++) {
+	const long long * pos = posarray + 6 * i;
+	hashes[i] = name_fnv1a(blob_char + pos[POS_HEAD_BEG] + 1,
+			       pos[POS_HEAD_END] - pos[POS_HEAD_BEG] - 1);
+      }
+      Py_END_ALLOW_THREADS
+    }
+  }
+
+  PyBuffer_Release(&blob);
+  PyBuffer_Release(&positions);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  return res;
+}
+
+/* Sort of hashes of read names with the indices of the entries, in
+ * parallel arrays and in-place (the index can have hundreds of millions
+ * of entries). Pairs are ordered by hash, then by index. */
+#define HASHPAIR_LESS(h1, o1, h2, o2) ((h1) < (h2) || ((h1) == (h2) && (o1) < (o2)))
+
+static inline void
+hashpair_swap(uint64_t * h, long long * o, const Py_ssize_t i, const Py_ssize_t j)
+{
+  const uint64_t th = h[i];
+  const long long to = o[i];
+  h[i] = h[j];
+  o[i] = o[j];
+  h[j] = th;
+  o[j] = to;
+}
+
+static void
+hashpair_heapsort(uint64_t * h, long long * o, const Py_ssize_t n)
+{
+  for (Py_ssize_t end = n, start = n / 2; end > 1;) {
+    Py_ssize_t root;
+    if (start > 0) {
+      root = --start;
+    } else {
+      hashpair_swap(h, o, 0, --end);
+      root = 0;
+    }
+    for (Py_ssize_t child = 2 * root + 1; child < end; child = 2 * root + 1) {
+      if (child + 1 < end && HASHPAIR_LESS(h[child], o[child], h[child + 1], o[child + 1])) {
+	child++;
+      }
+      if (!HASHPAIR_LESS(h[root], o[root], h[child], o[child])) {
+	break;
+      }
+      hashpair_swap(h, o, root, child);
+      root = child;
+    }
+  }
+}
+
+/* Introsort: quicksort with a median of three, heapsort when the
+ * recursion is too deep, and insertion sort for small ranges. */
+static void
+hashpair_sort(uint64_t * h, long long * o, Py_ssize_t n, int depth)
+{
+  while (n > 16) {
+    if (depth-- == 0) {
+      hashpair_heapsort(h, o, n);
+      return;
+    }
+    const Py_ssize_t mid = n / 2;
+    if (HASHPAIR_LESS(h[mid], o[mid], h[0], o[0])) {
+      hashpair_swap(h, o, 0, mid);
+    }
+    if (HASHPAIR_LESS(h[n - 1], o[n - 1], h[0], o[0])) {
+      hashpair_swap(h, o, 0, n - 1);
+    }
+    if (HASHPAIR_LESS(h[n - 1], o[n - 1], h[mid], o[mid])) {
+      hashpair_swap(h, o, mid, n - 1);
+    }
+    const uint64_t ph = h[mid];
+    const long long po = o[mid];
+    Py_ssize_t i = -1;
+    Py_ssize_t j = n;
+    for (;;) {
+      do {
+	i++;
+      } while (HASHPAIR_LESS(h[i], o[i], ph, po));
+      do {
+	j--;
+      } while (HASHPAIR_LESS(ph, po, h[j], o[j]));
+      if (i >= j) {
+	break;
+      }
+      hashpair_swap(h, o, i, j);
+    }
+    /* [0, j] and [j + 1, n): recurse on the smaller range. */
+    if (j + 1 < n - j - 1) {
+      hashpair_sort(h, o, j + 1, depth);
+      h += j + 1;
+      o += j + 1;
+      n -= j + 1;
+    } else {
+      hashpair_sort(h + j + 1, o + j + 1, n - j - 1, depth);
+      n = j + 1;
+    }
+  }
+  for (Py_ssize_t i = 1; i < n; i++) {
+    const uint64_t th = h[i];
+    const long long to = o[i];
+    Py_ssize_t j = i;
+    for (; j > 0 && HASHPAIR_LESS(th, to, h[j - 1], o[j - 1]); j--) {
+      h[j] = h[j - 1];
+      o[j] = o[j - 1];
+    }
+    h[j] = th;
+    o[j] = to;
+  }
+}
+
+PyDoc_STRVAR(sortnamehashes_doc,
+             "sortnamehashes(hashes, order) -> None\n\n"
+             "Sort hashes of read names **in-place**, and store the indices of the\n"
+	     "entries in the sorted order (ties are in the order of the entries).\n"
+	     "- hashes: a writable buffer of type Q\n"
+	     "- order: a writable buffer of type q, with the same number of values\n");
+
+static PyObject *
+sortnamehashes(PyObject * self, PyObject * args)
+{
+  Py_buffer hashes;
+  Py_buffer order;
+
+  if (!PyArg_ParseTuple(args, "w*w*", &hashes, &order)) {
+    return NULL;
+  }
+
+  const char * error = NULL;
+  if (hashes.itemsize != sizeof(uint64_t) || order.itemsize != sizeof(long long)) {
+    error = "The buffers must be of format type Q and q.";
+  } else if (hashes.len / hashes.itemsize != order.len / order.itemsize) {
+    error = "The buffers must have the same number of values.";
+  } else {
+    uint64_t * h = (uint64_t *) hashes.buf;
+    long long * o = (long long *) order.buf;
+    const Py_ssize_t n = hashes.len / hashes.itemsize;
+    Py_BEGIN_ALLOW_THREADS
+    int depth = 0;
+    for (Py_ssize_t m = n; m > 1; m >>= 1) {
+      depth += 2;
+    }
+    for (Py_ssize_t i = 0; i < n; i++) {
+      o[i] = i;
+    }
+    hashpair_sort(h, o, n, depth);
+    Py_END_ALLOW_THREADS
+  }
+
+  PyBuffer_Release(&hashes);
+  PyBuffer_Release(&order);
+  if (error != NULL) {
+    PyErr_SetString(PyExc_ValueError, error);
+    return NULL;
+  }
+  Py_RETURN_NONE;
+}
+
+
+static PyMethodDef fastqandfuriousModuleMethods[] = {
+    {
+      "entrypos", (PyCFunction)entrypos,
+        METH_VARARGS, entrypos_doc,
+    },
+    {
+      "entrypos_batch", (PyCFunction)entrypos_batch,
+        METH_VARARGS, entrypos_batch_doc,
+    },
+    {
+      "entrypos_fasta", (PyCFunction)entrypos_fasta,
+        METH_VARARGS, entrypos_fasta_doc,
+    },
+    {
+      "entrybuild_batch", (PyCFunction)entrybuild_batch,
+        METH_VARARGS, entrybuild_batch_doc,
+    },
+    {
+      "filterentry", (PyCFunction)filterentry,
+        METH_VARARGS, filterentry_doc,
+    },
+    {
+      "trimentries", (PyCFunction)trimentries,
+        METH_VARARGS, trimentries_doc,
+    },
+    {
+      "entryfunc", (PyCFunction)entryfunc,
+        METH_VARARGS, entryfunc_doc,
+    },
+    {
+      "entryfunc_namedtuple", (PyCFunction)entryfunc_namedtuple,
+        METH_VARARGS, entryfunc_namedtuple_doc,
+    },
+    {
+      "entryfunc_abspos", (PyCFunction)entryfunc_abspos,
+        METH_VARARGS, entryfunc_abspos_doc,
+    },
+    {
+      "entryfunc_sequence", (PyCFunction)entryfunc_sequence,
+        METH_VARARGS, entryfunc_sequence_doc,
+    },
+    {
+      "entryfunc_view", (PyCFunction)entryfunc_view,
+        METH_VARARGS, entryfunc_view_doc,
+    },
+    {
+      "entryfunc_unwrap", (PyCFunction)entryfunc_unwrap,
+        METH_VARARGS, entryfunc_unwrap_doc,
+    },
+    {
+      "entryfunc_fasta_unwrap", (PyCFunction)entryfunc_fasta_unwrap,
+        METH_VARARGS, entryfunc_fasta_unwrap_doc,
+    },
+    {
+      "fill_batch", (PyCFunction)fill_batch,
+        METH_VARARGS, fill_batch_doc,
+    },
+    {
+      "pack2bit", (PyCFunction)pack2bit,
+        METH_VARARGS, pack2bit_doc,
+    },
+    {
+      "unpack2bit", (PyCFunction)unpack2bit,
+        METH_VARARGS, unpack2bit_doc,
+    },
+    {
+      "pack2bit_chunk", (PyCFunction)pack2bit_chunk,
+        METH_VARARGS, pack2bit_chunk_doc,
+    },
+    {
+      "unpack2bit_chunk", (PyCFunction)unpack2bit_chunk,
+        METH_VARARGS, unpack2bit_chunk_doc,
+    },
+    {
+      "kmers2bit", (PyCFunction)kmers2bit,
+        METH_VARARGS, kmers2bit_doc,
+    },
+    {
+      "checkpairs", (PyCFunction)checkpairs,
+        METH_VARARGS, checkpairs_doc,
+    },
+    {
+      "stats_chunk", (PyCFunction)stats_chunk,
+        METH_VARARGS, stats_chunk_doc,
+    },
+    {
+      "kmerhashes_chunk", (PyCFunction)kmerhashes_chunk,
+        METH_VARARGS, kmerhashes_chunk_doc,
+    },
+    {
+      "sketch_chunk", (PyCFunction)sketch_chunk,
+        METH_VARARGS, sketch_chunk_doc,
+    },
+    {
+      "formatentries", (PyCFunction)formatentries,
+        METH_VARARGS, formatentries_doc,
+    },
+    {
+      "copyentries", (PyCFunction)copyentries,
+        METH_VARARGS, copyentries_doc,
+    },
+    {
+      "gzip_checkpoints", (PyCFunction)gzip_checkpoints,
+        METH_VARARGS, gzip_checkpoints_doc,
+    },
+    {
+      "gzip_scan", (PyCFunction)gzip_scan,
+        METH_VARARGS, gzip_scan_doc,
+    },
+    {
+      "gzip_extract", (PyCFunction)gzip_extract,
+        METH_VARARGS, gzip_extract_doc,
+    },
+    {
+      "illumina_headers", (PyCFunction)illumina_headers,
+        METH_VARARGS, illumina_headers_doc,
+    },
+    {
+      "newline_scan", (PyCFunction)newline_scan,
+        METH_VARARGS, newline_scan_doc,
+    },
+    {
+      "namehash", (PyCFunction)namehash,
+        METH_VARARGS, namehash_doc,
+    },
+    {
+      "namehashes_chunk", (PyCFunction)namehashes_chunk,
+        METH_VARARGS, namehashes_chunk_doc,
+    },
+    {
+      "sortnamehashes", (PyCFunction)sortnamehashes,
+        METH_VARARGS, sortnamehashes_doc,
+    },
+    {
+      "arrayadd_b", (PyCFunction)arrayadd_b,
+        METH_VARARGS, arrayadd_b_doc,
+    },
+    {
+      "arrayadd_q", (PyCFunction)arrayadd_q,
+        METH_VARARGS, arrayadd_q_doc,
+    },
+    { NULL} // sentinel
+};
 
-static PyMethodDef fastqandfuriousModuleMethods[] = {
-    {
-      "entrypos", (PyCFunction)entrypos,
-        METH_VARARGS, entrypos_doc,
-    },
-    {
-      "arrayadd_b", (PyCFunction)arrayadd_b,
-        METH_VARARGS, arrayadd_b_doc,
-    },
-    {
-      "arrayadd_q", (PyCFunction)arrayadd_q,
-        METH_VARARGS, arrayadd_q_doc,
-    },
-    { NULL} // sentinel
-};
-
 static struct PyModuleDef moduledef = {
   PyModuleDef_HEAD_INIT,
   "_fastqandfurious",
@@ -251,6 +3702,11 @@ PyInit__fastqandfurious(void)
         return NULL;
     }
 
+    /* The fastest implementation for newline scanning. */
+    if (newline_scan_select("avx2") != 0 && newline_scan_select("sse2") != 0) {
+        newline_scan_select("scalar");
+    }
+
     PyModule_AddObject(m, "INVALID", PyLong_FromLong(INVALID));
     PyModule_AddObject(m, "POS_HEAD_BEG", PyLong_FromLong(POS_HEAD_BEG));
     PyModule_AddObject(m, "POS_HEAD_END", PyLong_FromLong(POS_HEAD_END));
@@ -260,6 +3716,64 @@ PyInit__fastqandfurious(void)
     PyModule_AddObject(m, "POS_QUAL_END", PyLong_FromLong(POS_QUAL_END));
     PyModule_AddObject(m, "COMPLETE", PyLong_FromLong(COMPLETE));
     PyModule_AddObject(m, "MISSING_QUALHEADER_END", PyLong_FromLong(MISSING_QUALHEADER_END));
+    PyModule_AddObject(m, "BUILD_TUPLE", PyLong_FromLong(BUILD_TUPLE));
+    PyModule_AddObject(m, "BUILD_ENTRY", PyLong_FromLong(BUILD_ENTRY));
+    PyModule_AddObject(m, "BUILD_ABSPOS", PyLong_FromLong(BUILD_ABSPOS));
+    PyModule_AddObject(m, "BUILD_SEQUENCE", PyLong_FromLong(BUILD_SEQUENCE));
+    PyModule_AddObject(m, "BUILD_VIEW", PyLong_FromLong(BUILD_VIEW));
+    PyModule_AddObject(m, "ILLUMINA_INSTRUMENT_BEG", PyLong_FromLong(ILLUMINA_INSTRUMENT_BEG));
+    PyModule_AddObject(m, "ILLUMINA_INSTRUMENT_END", PyLong_FromLong(ILLUMINA_INSTRUMENT_END));
+    PyModule_AddObject(m, "ILLUMINA_RUN", PyLong_FromLong(ILLUMINA_RUN));
+    PyModule_AddObject(m, "ILLUMINA_FLOWCELL_BEG", PyLong_FromLong(ILLUMINA_FLOWCELL_BEG));
+    PyModule_AddObject(m, "ILLUMINA_FLOWCELL_END", PyLong_FromLong(ILLUMINA_FLOWCELL_END));
+    PyModule_AddObject(m, "ILLUMINA_LANE", PyLong_FromLong(ILLUMINA_LANE));
+    PyModule_AddObject(m, "ILLUMINA_TILE", PyLong_FromLong(ILLUMINA_TILE));
+    PyModule_AddObject(m, "ILLUMINA_X", PyLong_FromLong(ILLUMINA_X));
+    PyModule_AddObject(m, "ILLUMINA_Y", PyLong_FromLong(ILLUMINA_Y));
+    PyModule_AddObject(m, "ILLUMINA_READ", PyLong_FromLong(ILLUMINA_READ));
+    PyModule_AddObject(m, "ILLUMINA_FILTERED", PyLong_FromLong(ILLUMINA_FILTERED));
+    PyModule_AddObject(m, "ILLUMINA_CONTROL", PyLong_FromLong(ILLUMINA_CONTROL));
+    PyModule_AddObject(m, "ILLUMINA_NFIELDS", PyLong_FromLong(ILLUMINA_NFIELDS));
+    PyModule_AddObject(m, "ILLUMINA_OK", PyLong_FromLong(ILLUMINA_OK));
+    PyModule_AddObject(m, "ILLUMINA_MALFORMED", PyLong_FromLong(ILLUMINA_MALFORMED));
+    PyModule_AddObject(m, "ILLUMINA_BARCODE_TRUNCATED", PyLong_FromLong(ILLUMINA_BARCODE_TRUNCATED));
+    PyModule_AddObject(m, "FILTER_MINLEN", PyLong_FromLong(FILTER_MINLEN));
+    PyModule_AddObject(m, "FILTER_MAXLEN", PyLong_FromLong(FILTER_MAXLEN));
+    PyModule_AddObject(m, "FILTER_MINMEANQUAL", PyLong_FromLong(FILTER_MINMEANQUAL));
+    PyModule_AddObject(m, "FILTER_MINWINDOWQUAL", PyLong_FromLong(FILTER_MINWINDOWQUAL));
+    PyModule_AddObject(m, "FILTER_MAXNFRAC", PyLong_FromLong(FILTER_MAXNFRAC));
+    PyModule_AddObject(m, "TRIM_POLYG", PyLong_FromLong(TRIM_POLYG));
+    PyModule_AddObject(m, "TRIM_QUALITY", PyLong_FromLong(TRIM_QUALITY));
+    PyModule_AddObject(m, "TRIM_ADAPTER", PyLong_FromLong(TRIM_ADAPTER));
+
+    if (PyType_Ready(&EntryViewType) < 0) {
+      Py_DECREF(m);
+      return NULL;
+    }
+    Py_INCREF(&EntryViewType);
+    PyModule_AddObject(m, "EntryView", (PyObject *) &EntryViewType);
+
+    PyObject * arraymodule = PyImport_ImportModule("array");
+    if (arraymodule == NULL) {
+      Py_DECREF(m);
+      return NULL;
+    }
+    ArrayType = PyObject_GetAttrString(arraymodule, "array");
+    Py_DECREF(arraymodule);
+    if (ArrayType == NULL) {
+      Py_DECREF(m);
+      return NULL;
+    }
+
+    if (EntryType == NULL) {
+      EntryType = PyStructSequence_NewType(&entry_desc);
+      if (EntryType == NULL) {
+	Py_DECREF(m);
+	return NULL;
+      }
+    }
+    Py_INCREF(EntryType);
+    PyModule_AddObject(m, "Entry", (PyObject *) EntryType);
 
     return m;
 }
@@ -28,7 +28,9 @@ def benchmark_faf_c(fh, name='fastqandfurious w/ c-ext',
     from fastqandfurious import fastqandfurious, _fastqandfurious
     total_seq = int(0)
     t0 = time.time()
-    it = fastqandfurious.readfastq_iter(fh, bufsize, _entrypos=_fastqandfurious.entrypos)
+    it = fastqandfurious.readfastq_iter(fh, bufsize,
+                                        entryfunc=_fastqandfurious.entryfunc,
+                                        entrypos=_fastqandfurious.entrypos)
     try:
         for i, e in enumerate(it):
             total_seq += len(e[1])
@@ -44,42 +46,26 @@ def benchmark_faf_c(fh, name='fastqandfurious w/ c-ext',
         print(e)
 
 
-def benchmark_faf_c_index(fh, fh_index, name='fastqandfurious w/ c-ext + index',
-                          bufsize: int = int(2**16)):
-    from fastqandfurious import fastqandfurious, _fastqandfurious
-    from array import array
+def benchmark_faf_c_index(filename, indexfilename,
+                          name='fastqandfurious w/ c-ext + index'):
+    from fastqandfurious import fastqandfurious
     total_seq = int(0)
     t0 = time.time()
-    fh = io.BufferedReader(fh, buffer_size = bufsize)
     try:
-        offset = 0
         entry_i = 0
-        buf = None
-        while True:
-            posarray = array('q')
-            try:
-                posarray.fromfile(fh_index, 6)
-            except EOFError as eofe:
-                break
-            fh.seek(posarray[0])
-            buf = fh.read(posarray[-1]-offset+1)
-            tmp = posarray[-1]
-            _fastqandfurious.arrayadd_q(posarray, -offset)
-            e = (buf[posarray[0]:posarray[1]],
-                 buf[posarray[2]:posarray[3]],
-                 buf[posarray[4]:posarray[5]])
-            offset = tmp+1
-            entry_i += 1
-            total_seq += len(e[1])
-            if entry_i % REFRESH_RATE == 0:
-                t1 = time.time()
-                print('\r%.2fMB/s' % (total_seq/(1E6)/(t1-t0)), end='', flush=True)
+        with fastqandfurious.IndexedFastq(filename, indexfilename) as idx:
+            for entry_i in range(len(idx)):
+                e = idx[entry_i]
+                total_seq += len(e[1])
+                if entry_i % REFRESH_RATE == 0:
+                    t1 = time.time()
+                    print('\r%.2fMB/s' % (total_seq/(1E6)/(t1-t0)), end='', flush=True)
         t1 = time.time()
         print('\r%.2fMB/s' % (total_seq/(1E6)/(t1-t0)))
         logger.info('"{}" entries/s {} {}'.format(name, entry_i+1, time.time()-t0))
         logger.info('"{}" MB/s {} {}'.format(name, total_seq/(1E6)/(t1-t0), ''))
     except Exception as e:
-        print('Error with _fastqandfurious.entrypos().')
+        print('Error with fastqandfurious.IndexedFastq.')
         print(e)
 
 
@@ -268,23 +254,18 @@ def run_speed(args):
         elif name == 'fastqandfurious (w/ C-ext and indexing)':
             import tempfile
             from fastqandfurious import fastqandfurious, _fastqandfurious
+            if openfunc is not open:
+                print('  (skipped: the index requires an uncompressed file)')
+                continue
             bufsize = args.faf_buffersize
-            with tempfile.NamedTemporaryFile(mode='r+b') as fh_index:
-                with openfunc(args.filename, mode=mode) as fh:
-                    print('  building index...', end='', flush=True)
-                    it = fastqandfurious.readfastq_iter(fh, bufsize,
-                                                        entryfunc=fastqandfurious.entryfunc_abspos,
-                                                        _entrypos=_fastqandfurious.entrypos)
-                    for i, pos in enumerate(it):
-                        pos.tofile(fh_index)
-                    fh_index.flush()
-                    fh_index.seek(0)
-                    print('done.')
-                with openfunc(args.filename, mode=mode) as fh:
-                    #try:
-                    func(fh, fh_index)
-                    #except Exception as e:
-                    #    print('Error: %s' % str(e))
+            with tempfile.TemporaryDirectory() as dirname:
+                indexfilename = os.path.join(dirname, 'index')
+                print('  building index...', end='', flush=True)
+                fastqandfurious.build_index(
+                    args.filename, indexfilename, bufsize,
+                    entrypos_batch=_fastqandfurious.entrypos_batch)
+                print('done.')
+                func(args.filename, indexfilename)
         else:
             with open(args.filename, mode, buffering = args.io_buffersize) as f:
                 with openfunc(f) as fh:
@@ -335,7 +316,8 @@ def _fastqandfurious_c_iter(fn, mode, buffering, bufsize):
     with open(fn, mode, buffering = buffering) as f:
         with openfunc(f) as fh: 
             it = fastqandfurious.readfastq_iter(fh, bufsize,
-                                                _entrypos=_fastqandfurious.entrypos)
+                                                entryfunc=_fastqandfurious.entryfunc,
+                                                entrypos=_fastqandfurious.entrypos)
             for i, (header, sequence, quality) in enumerate(it):
                 yield (i, header, sequence)
 
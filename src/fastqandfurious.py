@@ -1,19 +1,38 @@
 from array import array
-from collections import namedtuple
+import bisect
+from collections import deque, namedtuple
+import concurrent.futures
+import gzip
 import importlib
+import io
+import math
+import mmap
+import multiprocessing
 import os
+import queue
+import struct
+import sys
+import threading
 import typing
+import zlib
+
+try:
+    from . import _fastqandfurious
+except ImportError:
+    _fastqandfurious = None
 
 CHAR_AT: int = ord(b'@')
 CHAR_GT: int = ord(b'>')
 CHAR_PLUS: int = ord(b'+')
 CHAR_NEWLINE: int = ord(b'\n')
+BYTES_NEWLINE: bytes = bytes([CHAR_NEWLINE])
 BYTES_NEWLINE_AT: bytes = bytes([CHAR_NEWLINE, CHAR_AT])
 BYTES_NEWLINE_PLUS: bytes = bytes([CHAR_NEWLINE, CHAR_PLUS])
 BYTES_NEWLINE_GT: bytes = bytes([CHAR_NEWLINE, CHAR_GT])
 ARRAY_INIT: int = array('q', [-1, ] * 6)
 
 Entry = namedtuple('Entry', 'header sequence quality')
+Chunk = namedtuple('Chunk', 'buffer positions count globaloffset')
 EntryType = typing.Tuple[bytes, bytes, typing.Optional[bytes]]
 
 INVALID: int = -1
@@ -36,6 +55,73 @@ def read(fh: typing.BinaryIO, fbufsize: int) -> typing.Tuple[bytes, bool]:
     return (blob, eof)
 
 
+def readinto(fh: typing.BinaryIO, buf: bytearray, start: int) -> bool:
+    """Fill a buffer in-place with data read from a stream.
+
+    :param fh: file-like object or stream (needs a method `readinto`)
+    :param buf: Buffer to fill from position `start` onwards.
+    :param start: Position in `buf` to start filling at.
+    :return: Whether the end of the stream was reached. When it was,
+      `buf` is truncated to the data it contains.
+    """
+    with memoryview(buf) as mblob:
+        n = fh.readinto(mblob[start:])
+    end = start + n
+    if end < len(buf):
+        del buf[end:]
+        return True
+    else:
+        return False
+
+
+def nextbufsize(bufsize: int, leftover: int, initsize: int,
+                shrink: bool = True) -> int:
+    """Compute the size of a parse buffer for the next refill.
+
+    The buffer grows geometrically (its size doubles) whenever the data
+    carried over from the previous buffer (an entry not complete yet) takes
+    more than half of it. Optionally, it shrinks back to its initial size once
+    the data carried over is small again.
+
+    :param bufsize: Current size of the buffer.
+    :param leftover: Size of the data carried over.
+    :param initsize: Initial size of the buffer.
+    :param shrink: Whether the buffer can shrink back to its initial size.
+    :return: The size of the buffer for the next refill.
+    """
+    if leftover * 2 > bufsize:
+        return bufsize * 2
+    elif shrink and bufsize > initsize and leftover * 2 <= initsize:
+        return initsize
+    else:
+        return bufsize
+
+
+def refill(fh: typing.BinaryIO, buf: bytearray, offset: int,
+           bufsize: int) -> bool:
+    """Refill a buffer in-place.
+
+    The bytes in `buf` from `offset` onwards (the data not parsed yet) are
+    moved to the beginning of `buf`, `buf` is resized to `bufsize` bytes,
+    and the rest of it is filled with data read from `fh`.
+
+    :param fh: file-like object or stream (needs a method `readinto`)
+    :param buf: Buffer to refill.
+    :param offset: Offset in the buffer for the data to keep.
+    :param bufsize: Size of the buffer after the refill (see
+      :func:`nextbufsize`).
+    :return: Whether the end of the stream was reached.
+    """
+    leftover = len(buf) - offset
+    with memoryview(buf) as mblob:
+        mblob[:leftover] = mblob[offset:]
+    if bufsize > len(buf):
+        buf.extend(bytes(bufsize - len(buf)))
+    elif bufsize < len(buf):
+        del buf[bufsize:]
+    return readinto(fh, buf, leftover)
+
+
 def entrypos(buf: bytes, offset: int, posbuffer: typing.Tuple[int]) -> int:
     """Find the position of the next FASTQ entry in a buffer.
 
@@ -53,7 +139,7 @@ def entrypos(buf: bytes, offset: int, posbuffer: typing.Tuple[int]) -> int:
         return MISSING_SEQHEADER_BEGIN
     else:
         posbuffer[MISSING_SEQHEADER_BEGIN] = headerbeg_i+1
-    headerend_i: int = buf.find(CHAR_NEWLINE, headerbeg_i+2)
+    headerend_i: int = buf.find(BYTES_NEWLINE, headerbeg_i+2)
     if headerend_i == -1:
         return MISSING_SEQHEADER_END
     else:
@@ -70,7 +156,7 @@ def entrypos(buf: bytes, offset: int, posbuffer: typing.Tuple[int]) -> int:
         posbuffer[MISSING_SEQ_END] = seqend_i
 
     # Quality.
-    qualheadend_i: int = buf.find(CHAR_NEWLINE, seqend_i+2)
+    qualheadend_i: int = buf.find(BYTES_NEWLINE, seqend_i+2)
     if qualheadend_i == -1:
         return MISSING_QUALHEADER_END
     elif ((qualheadend_i - seqend_i - 1) > 1
@@ -100,6 +186,34 @@ def entrypos(buf: bytes, offset: int, posbuffer: typing.Tuple[int]) -> int:
     return COMPLETE
 
 
+def entrypos_batch(buf: bytes, offset: int,
+                   posarray: array) -> typing.Tuple[int, int, int]:
+    """Find the positions of all complete FASTQ entries in a buffer.
+
+    :param buf: Buffer with FASTQ data
+    :param offset: Offset to start at in the buffer.
+    :param posarray: A buffer of signed 64-bit integers (e.g., `array('q')`)
+    able to store 6 positions for each entry. Entry `i` is stored at indices
+    `[6*i, 6*i+6)`.
+    :return: A tuple (number of entries found, offset to resume from,
+    status for the last entry). The status is `COMPLETE` when the scan
+    stopped because `posarray` is full.
+    """
+
+    table = memoryview(posarray)
+    nrows: int = len(table) // 6
+    count: int = 0
+    status: int = COMPLETE
+    while count < nrows:
+        row = table[(6*count):(6*count+6)]
+        status = entrypos(buf, offset, row)
+        if status != COMPLETE:
+            break
+        offset = row[MISSING_QUAL_END]-1
+        count += 1
+    return (count, offset, status)
+
+
 def entrypos_fasta(buf: bytes, offset: int,
                    posbuffer: typing.Tuple[int, ...]) -> int:
     """Find the position of the next FASTA entry in a buffer.
@@ -183,23 +297,432 @@ def entryfunc_fasta(buf: bytes, pos: array, globaloffset: int) -> EntryType:
     return (header, sequence)
 
 
-def entryfunc_abspos(buf: bytes, pos: array, globaloffset: int) -> int:
+def entryfunc_unwrap(buf: bytes, pos: array, globaloffset: int) -> EntryType:
+    """
+    Build a FASTQ entry as a tuple (header, sequence, quality), with
+    the newlines in multi-line sequences and quality strings removed.
+
+    - buf: bytes-like object
+    - pos: array of indices/positions in `buf`
+    """
+    header = buf[(pos[0]+1):pos[1]]
+    sequence = buf[pos[2]:pos[3]].replace(b'\n', b'')
+    quality = buf[pos[4]:pos[5]].replace(b'\n', b'')
+    return (header, sequence, quality)
+
+
+def entryfunc_fasta_unwrap(buf: bytes, pos: array,
+                           globaloffset: int) -> EntryType:
+    """
+    Build a FASTA entry as a tuple (header, sequence), with the newlines
+    in multi-line sequences removed.
+
+    - buf: bytes-like object
+    - pos: array of indices/positions in `buf`
+    """
+    header = buf[(pos[0]+1):pos[1]]
+    sequence = buf[pos[2]:pos[3]].replace(b'\n', b'')
+    return (header, sequence)
+
+
+def entryfunc_abspos(buf: bytes, pos: array, globaloffset: int) -> array:
     """
     Return the absolute positions of the entry in the stream
 
     - buf: bytes-like object
     - pos: array of indices/positions in `buf`
     """
+    abspos = array('q', pos)
     for i in (0, 1, 2, 3, 4, 5):
-        pos[i] += globaloffset
-    return pos
+        abspos[i] += globaloffset
+    return abspos
+
+
+def entryfunc_sequence(buf: bytes, pos: array, globaloffset: int) -> bytes:
+    """
+    Build the sequence of a FASTQ entry
+
+    - buf: bytes-like object
+    - pos: array of indices/positions in `buf`
+    """
+    return buf[pos[2]:pos[3]]
+
+
+FILTER_MINLEN: int = 0
+FILTER_MAXLEN: int = 1
+FILTER_MINMEANQUAL: int = 2
+FILTER_MINWINDOWQUAL: int = 3
+FILTER_MAXNFRAC: int = 4
+FILTER_RULES: typing.Tuple[str, ...] = ('minlen', 'maxlen', 'minmeanqual',
+                                        'minwindowqual', 'maxnfrac')
+
+
+def filterentry(buf: bytes, pos: array, spec: array) -> int:
+    """Return the first filter rule rejecting a FASTQ entry, or -1.
+
+    :param buf: Buffer with FASTQ data
+    :param pos: Positions of the entry in `buf`
+    :param spec: Filter specification (see :class:`EntryFilter`)
+
+    An implementation in C is `fastqandfurious._fastqandfurious.filterentry`.
+    """
+    (minlen, maxlen, minmeanqual, minwindowqual, maxnfrac,
+     window, phredoffset) = spec[:7]
+    seqlen = pos[3] - pos[2]
+    # Comparisons with NaN are False, so rules set to NaN never
+    # reject entries.
+    if seqlen < minlen:
+        return FILTER_MINLEN
+    if seqlen > maxlen:
+        return FILTER_MAXLEN
+    if not (math.isnan(minmeanqual) and math.isnan(minwindowqual)):
+        quality = bytes(buf[pos[4]:(pos[4]+seqlen)])
+        mean = sum(quality) / seqlen - phredoffset if seqlen else 0
+        if mean < minmeanqual:
+            return FILTER_MINMEANQUAL
+        if not math.isnan(minwindowqual):
+            window = int(window)
+            minmean = mean
+            if window > 0 and seqlen > window:
+                total = sum(quality[:window])
+                mintotal = total
+                for i in range(window, seqlen):
+                    total += quality[i] - quality[i-window]
+                    mintotal = min(total, mintotal)
+                minmean = mintotal / window - phredoffset
+            if minmean < minwindowqual:
+                return FILTER_MINWINDOWQUAL
+    if not math.isnan(maxnfrac):
+        sequence = bytes(buf[pos[2]:pos[3]])
+        n = sequence.count(b'N') + sequence.count(b'n')
+        if (n / seqlen if seqlen else 0) > maxnfrac:
+            return FILTER_MAXNFRAC
+    return -1
+
+
+class EntryFilter(object):
+    """Filter on FASTQ entries.
+
+    :param minlen: minimum length of the sequence
+    :param maxlen: maximum length of the sequence
+    :param minmeanqual: minimum mean quality score
+    :param minwindowqual: minimum mean quality score in any window of
+      `window` bases (the whole sequence when shorter)
+    :param window: size of the window for `minwindowqual`
+    :param maxnfrac: maximum fraction of N in the sequence
+    :param phredoffset: offset for quality scores
+    :param filterentry: a function to check the rules for an entry
+      (see :func:`filterentry`)
+
+    Rules that are `None` are not used. The number of entries rejected
+    by each rule (the first rule failing) is counted in `counts`.
+    """
+
+    def __init__(self,
+                 minlen: typing.Optional[int] = None,
+                 maxlen: typing.Optional[int] = None,
+                 minmeanqual: typing.Optional[float] = None,
+                 minwindowqual: typing.Optional[float] = None,
+                 window: int = 10,
+                 maxnfrac: typing.Optional[float] = None,
+                 phredoffset: int = 33,
+                 filterentry: typing.Callable[
+                     [bytes, array, array], int] = filterentry):
+        self.spec = array('d', [math.nan if x is None else x
+                                for x in (minlen, maxlen, minmeanqual,
+                                          minwindowqual, maxnfrac)])
+        self.spec.extend((window, phredoffset))
+        self.counts = array('q', [0, ] * len(FILTER_RULES))
+        self._filterentry = filterentry
+
+    def reject(self, buf: bytes, pos: array) -> bool:
+        """Check whether an entry is rejected (and count it if it is)."""
+        rule = self._filterentry(buf, pos, self.spec)
+        if rule < 0:
+            return False
+        self.counts[rule] += 1
+        return True
+
+    @property
+    def rejected(self) -> typing.Dict[str, int]:
+        """Number of entries rejected by each rule."""
+        return dict(zip(FILTER_RULES, self.counts))
+
+
+TRIM_POLYG: int = 0
+TRIM_QUALITY: int = 1
+TRIM_ADAPTER: int = 2
+TRIM_STEPS: typing.Tuple[str, ...] = ('polyg', 'quality', 'adapter')
+
+
+def _trim_polyg(sequence: bytes, minrun: float) -> int:
+    n = len(sequence) - len(sequence.rstrip(b'G'))
+    return len(sequence) - n if n >= minrun else len(sequence)
+
+
+def _trim_quality(quality: bytes, cutoff: float, window: int,
+                  phredoffset: float) -> int:
+    seqlen = len(quality)
+    if window <= 0:
+        s = 0.0
+        maxs = 0.0
+        stop = seqlen
+        for i in range(seqlen - 1, -1, -1):
+            s += cutoff - (quality[i] - phredoffset)
+            if s < 0:
+                break
+            if s > maxs:
+                maxs = s
+                stop = i
+        return stop
+    w = min(window, seqlen)
+    if w == 0:
+        return seqlen
+    total = sum(quality[:w])
+    for i in range(seqlen - w + 1):
+        if i > 0:
+            total += quality[i + w - 1] - quality[i - 1]
+        if total / w - phredoffset < cutoff:
+            stop = i
+            while stop < i + w and quality[stop] - phredoffset >= cutoff:
+                stop += 1
+            return stop
+    return seqlen
+
+
+def _trim_adapter(sequence: bytes, adapter: bytes, maxerrorrate: float,
+                  minoverlap: int) -> int:
+    seqlen = len(sequence)
+    for i in range(seqlen - minoverlap + 1):
+        overlap = min(seqlen - i, len(adapter))
+        errors = sum(x != y for x, y in zip(sequence[i:(i + overlap)],
+                                            adapter))
+        if errors <= int(maxerrorrate * overlap):
+            return i
+    return seqlen
+
+
+def trimentries(buf: bytes, positions: array, count: int, spec: array,
+                adapter: bytes, counts: array) -> int:
+    """Trim the 3' end of FASTQ entries **in-place**.
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Table of 6 positions for each entry in `buf`.
+      The ends of the sequence and of the quality are moved, and nothing
+      is copied.
+    :param count: Number of entries
+    :param spec: Trimming specification (see :class:`EntryTrimmer`)
+    :param adapter: Adapter sequence
+    :param counts: Number of entries trimmed by each step (the last step
+      trimming an entry), updated **in-place**
+    :return: Number of entries trimmed.
+
+    An implementation in C is `fastqandfurious._fastqandfurious.trimentries`.
+    """
+    if len(spec) < 6:
+        raise ValueError('The trimming specification must have 6 values.')
+    if len(counts) < len(TRIM_STEPS):
+        raise ValueError('The trimming counts must have %i values.' %
+                         len(TRIM_STEPS))
+    if count < 0 or len(positions) < 6 * count:
+        raise ValueError('The buffers are too small for the number '
+                         'of entries.')
+    for i in range(0, 6 * count, 6):
+        pos = positions[i:(i+6)]
+        if pos[2] < 0 or pos[3] < pos[2] or pos[4] < pos[3] or \
+           pos[5] > len(buf) or pos[5] - pos[4] != pos[3] - pos[2]:
+            raise ValueError('Invalid positions.')
+    polyg, cutoff, maxerrorrate, window, minoverlap, phredoffset = spec[:6]
+    adapter = bytes(adapter)
+    ntrimmed = 0
+    for i in range(0, 6 * count, 6):
+        sequence = bytes(buf[positions[i+2]:positions[i+3]])
+        length = len(sequence)
+        step = -1
+        if not math.isnan(polyg):
+            newlength = _trim_polyg(sequence, polyg)
+            if newlength < length:
+                length, step = newlength, TRIM_POLYG
+        if not math.isnan(cutoff):
+            quality = bytes(buf[positions[i+4]:(positions[i+4]+length)])
+            newlength = _trim_quality(quality, cutoff, int(window),
+                                      phredoffset)
+            if newlength < length:
+                length, step = newlength, TRIM_QUALITY
+        if not math.isnan(maxerrorrate) and adapter:
+            newlength = _trim_adapter(sequence[:length], adapter,
+                                      maxerrorrate, max(int(minoverlap), 1))
+            if newlength < length:
+                length, step = newlength, TRIM_ADAPTER
+        positions[i+3] = positions[i+2] + length
+        positions[i+5] = positions[i+4] + length
+        if step >= 0:
+            counts[step] += 1
+            ntrimmed += 1
+    return ntrimmed
+
+
+class EntryTrimmer(object):
+    """Trimming of the 3' end of FASTQ entries.
+
+    :param polyg: minimum length of a run of G at the end of the
+      sequence to trim it (as found with 2-color chemistries)
+    :param quality: quality score cutoff for quality trimming
+    :param window: size of the window for quality trimming. With 0,
+      the trimmed end maximizes the sum of `quality` minus the scores (as
+      BWA or cutadapt do). Otherwise the entry is trimmed at the first
+      window with a mean score below `quality`, keeping the bases above
+      `quality` at the beginning of that window (as Trimmomatic does).
+    :param adapter: adapter sequence, trimmed with everything after
+      it, or when the end of the sequence matches its beginning
+    :param maxerrorrate: maximum fraction of mismatches between the
+      sequence and the adapter
+    :param minoverlap: minimum number of bases matching the adapter
+    :param phredoffset: offset for quality scores
+    :param trimentries: a function to trim entries
+      (see :func:`trimentries`)
+
+    Steps that are `None` are not used, and steps are applied in the order
+    poly-G, quality, adapter. Entries are trimmed by changing the
+    positions in chunks (see :func:`readfastq_chunks`) **in-place**,
+    without copying them. The number of entries trimmed by each step (the
+    last step trimming an entry) is counted in `counts`.
+    """
+
+    def __init__(self,
+                 polyg: typing.Optional[int] = None,
+                 quality: typing.Optional[float] = None,
+                 window: int = 0,
+                 adapter: typing.Optional[bytes] = None,
+                 maxerrorrate: float = 0.1,
+                 minoverlap: int = 3,
+                 phredoffset: int = 33,
+                 trimentries: typing.Callable[..., int] = trimentries):
+        self.spec = array('d', [math.nan if x is None else x
+                                for x in (polyg, quality,
+                                          None if adapter is None
+                                          else maxerrorrate)])
+        self.spec.extend((window, minoverlap, phredoffset))
+        self.adapter = b'' if adapter is None else bytes(adapter)
+        self.counts = array('q', [0, ] * len(TRIM_STEPS))
+        self._trimentries = trimentries
+
+    def trim(self, chunk: Chunk) -> int:
+        """Trim the entries in a chunk **in-place**, and return the
+        number of entries trimmed."""
+        return self._trimentries(chunk.buffer, chunk.positions, chunk.count,
+                                 self.spec, self.adapter, self.counts)
+
+    @property
+    def trimmed(self) -> typing.Dict[str, int]:
+        """Number of entries trimmed by each step."""
+        return dict(zip(TRIM_STEPS, self.counts))
+
+
+class EntryView(object):
+    """View on a FASTQ entry in a buffer.
+
+    :param buf: Buffer with FASTQ data
+    :param pos: Positions of the entry in `buf` (see :func:`readfastq_iter`)
+
+    The header, sequence, and quality are only built (sliced from the
+    buffer) when accessed, and the length of the view is the length of
+    the sequence. A view holds a reference to the buffer, which must not
+    be modified (:func:`readfastq_iter` does not build views with
+    `reusebuffer=True`).
+
+    An implementation in C is `fastqandfurious._fastqandfurious.EntryView`.
+    """
+
+    __slots__ = ('_buf', '_pos')
+
+    def __init__(self, buf: bytes, pos: array):
+        self._buf = buf
+        self._pos = tuple(pos[:6])
+
+    @property
+    def header(self) -> bytes:
+        """Header (without the leading '@')."""
+        return self._buf[(self._pos[0]+1):self._pos[1]]
+
+    @property
+    def sequence(self) -> bytes:
+        """Sequence."""
+        return self._buf[self._pos[2]:self._pos[3]]
+
+    @property
+    def quality(self) -> bytes:
+        """Quality string."""
+        return self._buf[self._pos[4]:self._pos[5]]
+
+    @property
+    def header_view(self) -> memoryview:
+        """Header as a memoryview."""
+        return memoryview(self._buf)[(self._pos[0]+1):self._pos[1]]
+
+    @property
+    def sequence_view(self) -> memoryview:
+        """Sequence as a memoryview."""
+        return memoryview(self._buf)[self._pos[2]:self._pos[3]]
+
+    @property
+    def quality_view(self) -> memoryview:
+        """Quality string as a memoryview."""
+        return memoryview(self._buf)[self._pos[4]:self._pos[5]]
+
+    @property
+    def seq_len(self) -> int:
+        """Length of the sequence."""
+        return self._pos[3] - self._pos[2]
+
+    @property
+    def positions(self) -> typing.Tuple[int, ...]:
+        """Positions of the entry in the buffer."""
+        return self._pos
+
+    def __len__(self) -> int:
+        return self._pos[3] - self._pos[2]
+
+    def __repr__(self) -> str:
+        return 'EntryView(header=%r, seq_len=%i)' % (self.header, len(self))
+
+
+def entryfunc_view(buf: bytes, pos: array, globaloffset: int) -> EntryView:
+    """
+    Build a view on a FASTQ entry (see :class:`EntryView`)
+
+    - buf: bytes-like object
+    - pos: array of indices/positions in `buf`
+    """
+    return EntryView(buf, pos)
+
+
+if _fastqandfurious is None:
+    _C_BUILDERS: typing.Dict[typing.Callable, int] = {}
+    _ENTRYPOS_FUSABLE: typing.Tuple[typing.Callable, ...] = ()
+    _VIEW_BUILDERS: typing.Tuple[typing.Callable, ...] = (entryfunc_view, )
+else:
+    # Entry builders in the C-extension that readfastq_iter can
+    # fuse with the search of positions.
+    _C_BUILDERS = {
+        _fastqandfurious.entryfunc: _fastqandfurious.BUILD_TUPLE,
+        _fastqandfurious.entryfunc_namedtuple: _fastqandfurious.BUILD_ENTRY,
+        _fastqandfurious.entryfunc_abspos: _fastqandfurious.BUILD_ABSPOS,
+        _fastqandfurious.entryfunc_sequence: _fastqandfurious.BUILD_SEQUENCE,
+        _fastqandfurious.entryfunc_view: _fastqandfurious.BUILD_VIEW
+    }
+    _ENTRYPOS_FUSABLE = (entrypos, _fastqandfurious.entrypos)
+    _VIEW_BUILDERS = (entryfunc_view, _fastqandfurious.entryfunc_view)
 
 
 def readfastq_iter(
         fh: typing.BinaryIO, fbufsize: int,
         entryfunc: typing.Callable[[bytes, array, int], tuple] = entryfunc,
         entrypos: typing.Callable[[bytes, array, int], int] = entrypos,
-        globaloffset: int = 0
+        globaloffset: int = 0,
+        reusebuffer: bool = False,
+        shrinkbuffer: bool = True,
+        entryfilter: typing.Optional[EntryFilter] = None
 ) -> typing.Iterator[EntryType]:
     """Iterate through entries in a FASTQ stream.
 
@@ -208,6 +731,16 @@ def readfastq_iter(
     :param entryfunc: a function to build an entry object (taking a bytes-like
       object and an array of positions)
     :param entrypos: a function to find positions of entries
+    :param globaloffset: position of the beginning of `fh` in the stream
+      (e.g., when `fh` was moved with `seek`). Positions passed to
+      `entryfunc` are relative to that beginning unless this is set.
+    :param entryfilter: entries rejected by that filter are skipped
+      (see :class:`EntryFilter`)
+    :param reusebuffer: read data with `fh.readinto` into one `bytearray`
+      reused across buffer refills rather than creating new `bytes` objects
+      (see note below)
+    :param shrinkbuffer: let the buffer shrink back to `fbufsize` once it
+      no longer needs to be larger (see note below)
 
     :returns: An iterator over entries in the FASTQ file.
 
@@ -216,10 +749,11 @@ def readfastq_iter(
     faster alternative to the default is implemented in C:
     `fastqandfurious._fastqandfurious.entrypos`.
 
-    With the current implementation, `fbufsize` must be large enough to contain
-    the largest entry in the file. For example, if the longest read is 250bp
-    long, and the identifier is 25-char long, the minimum buffer size will be
-    about 525. Aiming for that minimum is not advised though, as some of the
+    The buffer grows automatically (its size doubles) when an entry does
+    not fit in it, and unless `shrinkbuffer` is `False` it shrinks back to
+    `fbufsize` once the entries fit again. `fbufsize` does not have to be
+    large enough to contain the largest entry in the file, but buffers
+    should be able to contain many entries as some of the
     speed comes for minimizing data copying through the use of buffers. Larger
     buffers are able to contain many entries which will lead to better
     performances (with the cave at that very large
@@ -227,32 +761,69 @@ def readfastq_iter(
     wanted. The iterator will need to read data
     to fill the buffer (or all data, whichever is the smallest) before starting
     to yield entries. A value between 20,000 and 50,000 (20KB-50KB) empircally
-    gives pretty good results for short-read sequencing on this end. If the
-    FASTQ file contains PacBio reads bumping this to 200,000 or more (200KB or
-    more) is advised.
+    gives pretty good results for short-read sequencing on this end, and
+    with the automatic growth of the buffer it remains a reasonable choice
+    when the file also contains a number of long reads (e.g., PacBio or
+    Nanopore).
 
     `entryfunc` can be any function taking a bytes-like objects and an
     array of position (array of signed integers of length 6:
     header (begin, end), sequence (begin, end), and quality (begin, end).
     This allows plugging this parser into existing code bases / frameworks
     very easily.
+
+    With `reusebuffer=True` the parse buffer is a `bytearray` that is
+    overwritten when refilled (data not parsed yet is moved to its beginning
+    and the rest is filled with `fh.readinto`). This avoids allocating and
+    copying a new buffer at each refill, which matters with large buffers.
+    `fh` must have a method `readinto`, and `entryfunc` is then called with
+    a `bytearray` (slicing it returns `bytearray` objects). Views on the
+    buffer (:func:`entryfunc_view`) would refer to overwritten data, so a
+    :class:`ValueError` is raised when `entryfunc` builds them.
+
+    When `entryfunc` is one of the builders in the C-extension
+    (`entryfunc`, `entryfunc_namedtuple`, `entryfunc_abspos`,
+    `entryfunc_sequence`, or `entryfunc_view` in
+    `fastqandfurious._fastqandfurious`) and `entrypos`
+    is the default or its C implementation, finding and building entries
+    is done in C for all entries in the buffer at once, and the rules
+    in `entryfilter` are then also checked in C.
     """
 
+    if reusebuffer and entryfunc in _VIEW_BUILDERS:
+        raise ValueError('Views on entries cannot be built with '
+                         'reusebuffer=True (the buffer is overwritten).')
     posbuffer = array('q', [-1, ] * 6)
-    globaloffset: int = -1
+    buildkind = None
+    if entrypos in _ENTRYPOS_FUSABLE:
+        buildkind = _C_BUILDERS.get(entryfunc)
+    filterargs = ()
+    if entryfilter is not None:
+        filterargs = (entryfilter.spec, entryfilter.counts)
+    # The buffer starts with an extra newline.
+    globaloffset -= 1
     offset: int = 0
-    buf, eof = read(fh, fbufsize)
-    buf = b'\n' + buf
-    # TODO: Would using a memoryview on the read buffer lead to further
-    # performance improvement ? (more related TODOs below)
-    # fbuf = bytearray(fbufsize)
-    # fh.readinto(fbuf)
-    # mblob = memoryview(fbuf)
+    bufsize: int = fbufsize + 1
+    if reusebuffer:
+        buf = bytearray(bufsize)
+        buf[0] = CHAR_NEWLINE
+        eof = readinto(fh, buf, 1)
+    else:
+        buf, eof = read(fh, fbufsize)
+        buf = b'\n' + buf
     while True:
-        status = entrypos(buf, offset, posbuffer)
+        if buildkind is None:
+            status = entrypos(buf, offset, posbuffer)
+        else:
+            entries, offset, status = _fastqandfurious.entrybuild_batch(
+                buf, offset, posbuffer, buildkind, globaloffset, *filterargs)
+            yield from entries
+            del entries
         if status == COMPLETE:
             offset = posbuffer[-1]-1
-            yield entryfunc(buf, posbuffer, globaloffset)
+            if entryfilter is None or \
+               not entryfilter.reject(buf, posbuffer):
+                yield entryfunc(buf, posbuffer, globaloffset)
         elif eof:
             if status == MISSING_SEQHEADER_BEGIN:
                 break
@@ -262,7 +833,9 @@ def readfastq_iter(
                     raise ValueError('Incomplete final quality string at byte')
                 else:
                     posbuffer[-1] = qualend_i
-                    yield entryfunc(buf, posbuffer, globaloffset)
+                    if entryfilter is None or \
+                       not entryfilter.reject(buf, posbuffer):
+                        yield entryfunc(buf, posbuffer, globaloffset)
                     break
 
             elif status != INVALID:
@@ -273,17 +846,2651 @@ def readfastq_iter(
                              (globaloffset + offset))
         else:
             globaloffset += offset
-            tmp_buf, eof = read(fh, fbufsize)
+            leftover = len(buf) - offset
+            bufsize = nextbufsize(bufsize, leftover, fbufsize + 1,
+                                  shrink=shrinkbuffer)
+            if reusebuffer:
+                eof = refill(fh, buf, offset, bufsize)
+            else:
+                tmp_buf, eof = read(fh, bufsize - leftover)
+                buf = buf[offset:] + tmp_buf
+                del tmp_buf
+            offset = 0
+
+
+async def _aread(fh, n: int) -> bytes:
+    # Read n bytes, or less at the end of the stream, from a stream that
+    # can return less than requested.
+    pieces = []
+    size = 0
+    while size < n:
+        piece = await fh.read(n - size)
+        if not piece:
+            break
+        pieces.append(piece)
+        size += len(piece)
+    return b''.join(pieces)
+
+
+async def readfastq_aiter(
+        fh, fbufsize: int,
+        entryfunc: typing.Callable[[bytes, array, int], tuple] = entryfunc,
+        entrypos: typing.Callable[[bytes, array, int], int] = entrypos,
+        globaloffset: int = 0,
+        batches: bool = False
+) -> typing.AsyncIterator[typing.Any]:
+    """Iterate asynchronously through entries in a FASTQ stream.
+
+    :param fh: stream with a coroutine method `read` (for example an
+      :class:`asyncio.StreamReader`)
+    :param fbufsize: buffer size (see :func:`readfastq_iter`)
+    :param entryfunc: a function to build an entry object
+      (see :func:`readfastq_iter`)
+    :param entrypos: a function to find positions of entries
+      (see :func:`readfastq_iter`)
+    :param globaloffset: position of the beginning of `fh` in the stream
+    :param batches: yield lists with the entries in each buffer rather
+      than entries
+    :return: An asynchronous iterator.
+
+    This works like :func:`readfastq_iter`, except that data are read with
+    `await fh.read(n)`. A read returning less than `n` bytes is not
+    the end of the stream (only an empty read is): pieces are gathered
+    until the buffer is full (or the stream ends) and the entries in it
+    are yielded, so that the cost of parsing does not depend on the size
+    of the pieces. The event loop is only blocked for the time it takes to
+    parse one buffer.
+    """
+    posbuffer = array('q', [-1, ] * 6)
+    buildkind = None
+    if entrypos in _ENTRYPOS_FUSABLE:
+        buildkind = _C_BUILDERS.get(entryfunc)
+    # The buffer starts with an extra newline.
+    globaloffset -= 1
+    offset: int = 0
+    bufsize: int = fbufsize + 1
+    blob = await _aread(fh, fbufsize)
+    eof = len(blob) < fbufsize
+    buf = b'\n' + blob
+    while True:
+        if buildkind is None:
+            entries = []
+            while True:
+                status = entrypos(buf, offset, posbuffer)
+                if status != COMPLETE:
+                    break
+                offset = posbuffer[-1]-1
+                entries.append(entryfunc(buf, posbuffer, globaloffset))
+        else:
+            entries, offset, status = _fastqandfurious.entrybuild_batch(
+                buf, offset, posbuffer, buildkind, globaloffset)
+        error = None
+        if status == INVALID:
+            error = 'Entry is invalid at byte %i' % (globaloffset + offset)
+        elif eof and status == MISSING_QUAL_END:
+            qualend_i = posbuffer[-2] + (posbuffer[3] - posbuffer[2])
+            if qualend_i >= len(buf):
+                error = 'Incomplete final quality string at byte'
+            else:
+                posbuffer[-1] = qualend_i
+                entries.append(entryfunc(buf, posbuffer, globaloffset))
+        elif eof and status != MISSING_SEQHEADER_BEGIN:
+            error = 'Incomplete entry at byte %i' % (globaloffset + offset)
+        if entries:
+            if batches:
+                yield entries
+            else:
+                for entry in entries:
+                    yield entry
+        del entries
+        if error is not None:
+            raise ValueError(error)
+        if eof:
+            break
+        globaloffset += offset
+        leftover = len(buf) - offset
+        bufsize = nextbufsize(bufsize, leftover, fbufsize + 1)
+        blob = await _aread(fh, bufsize - leftover)
+        eof = len(blob) < bufsize - leftover
+        buf = buf[offset:] + blob
+        del blob
+        offset = 0
+
+
+def readfastq_mmap(
+        filename: str,
+        entryfunc: typing.Callable[[bytes, array, int], EntryType] = entryfunc,
+        entrypos: typing.Callable[[bytes, int, array], int] = entrypos
+) -> typing.Iterator[EntryType]:
+    """Iterate over the entries in an uncompressed FASTQ file mapped
+    in memory.
+
+    :param filename: path to an uncompressed FASTQ file
+    :param entryfunc: a function to build an entry object
+      (see :func:`readfastq_iter`)
+    :param entrypos: a function to find the positions of an entry
+      (see :func:`readfastq_iter`)
+
+    The whole file is memory-mapped once and there is no buffer to fill.
+    `entrypos` is called with the :class:`mmap.mmap` object and `entryfunc`
+    with a :class:`memoryview` on it, so the default `entryfunc` returns
+    :class:`memoryview` objects rather than copies and `entryfunc_abspos`
+    returns positions in the file. Data are read from the file by the
+    operating system when accessed (and are in its page cache), which makes
+    entries only partially used (for example filters on the length of reads)
+    cheap.
+
+    The memoryview objects returned keep the file mapped as long as they
+    exist.
+    """
+    with open(filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mm, 'madvise'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    data = memoryview(mm)
+    posbuffer = array('q', [-1, ] * 6)
+    # entrypos finds entries after a newline. For the first entry the
+    # beginning of the file is prefixed with a newline.
+    headsize = 2**16
+    while True:
+        head = b'\n' + mm[:headsize]
+        status = entrypos(head, 0, posbuffer)
+        if status == COMPLETE or headsize >= len(mm):
+            break
+        headsize *= 2
+    del head
+    for i in range(6):
+        posbuffer[i] -= 1
+    offset = 0
+    while True:
+        if status == COMPLETE:
+            offset = posbuffer[-1]-1
+            yield entryfunc(data, posbuffer, 0)
+        elif status == MISSING_SEQHEADER_BEGIN:
+            break
+        elif status == MISSING_QUAL_END:
+            qualend_i = posbuffer[-2] + (posbuffer[3] - posbuffer[2])
+            if qualend_i > len(mm):
+                raise ValueError('Incomplete final quality string at byte')
+            posbuffer[-1] = qualend_i
+            yield entryfunc(data, posbuffer, 0)
+            break
+        elif status == INVALID:
+            raise ValueError('Entry is invalid at byte %i' % offset)
+        else:
+            raise ValueError('Incomplete entry at byte %i' % offset)
+        status = entrypos(mm, offset, posbuffer)
+
+
+def readfastq_chunks(
+        fh: typing.BinaryIO, fbufsize: int,
+        entrypos_batch: typing.Callable[
+            [bytes, int, array], typing.Tuple[int, int, int]
+        ] = entrypos_batch,
+        reusebuffer: bool = False,
+        shrinkbuffer: bool = True
+) -> typing.Iterator[Chunk]:
+    """Iterate through chunks of entries in a FASTQ stream.
+
+    :param fh: file-like object or stream (just needs a method `read`)
+    :param fbufsize: buffer size (see :func:`readfastq_iter`)
+    :param entrypos_batch: a function to find positions of all entries
+      in a buffer. A faster alternative to the default is implemented in C:
+      `fastqandfurious._fastqandfurious.entrypos_batch`.
+    :param reusebuffer: read data into one `bytearray` reused across
+      buffer refills (see :func:`readfastq_iter`).
+    :param shrinkbuffer: let the buffer shrink back to `fbufsize` once it
+      no longer needs to be larger (see :func:`readfastq_iter`).
+
+    :returns: An iterator over :class:`Chunk` objects.
+
+    Each chunk is a namedtuple with the attributes `buffer` (the parse
+    buffer), `positions` (an `array('q')` with 6 positions per entry,
+    relative to `buffer`), `count` (the number of entries in the chunk),
+    and `globaloffset` (the offset to add to positions in order to obtain
+    absolute positions in the stream). Only the first `6*count` values in
+    `positions` are meaningful, and the table of positions is reused
+    (and replaced by a larger one as needed) from one chunk to the next.
+    Entry `i` in a chunk can be built with the same functions as for
+    :func:`readfastq_iter`:
+
+    .. code-block:: python
+
+       pos = memoryview(chunk.positions)[(6*i):(6*i+6)]
+       entry = entryfunc(chunk.buffer, pos, chunk.globaloffset)
+    """
+
+    posarray = array('q', ARRAY_INIT * (fbufsize // 256 + 1))
+    globaloffset: int = -1
+    offset: int = 0
+    bufsize: int = fbufsize + 1
+    if reusebuffer:
+        buf = bytearray(bufsize)
+        buf[0] = CHAR_NEWLINE
+        eof = readinto(fh, buf, 1)
+    else:
+        buf, eof = read(fh, fbufsize)
+        buf = b'\n' + buf
+    while True:
+        count = 0
+        while True:
+            with memoryview(posarray) as table:
+                n, offset, status = entrypos_batch(buf, offset,
+                                                   table[(6*count):])
+            count += n
+            if status != COMPLETE:
+                break
+            # The table of positions is full. A new table is created
+            # rather than resizing it in-place since views on it
+            # may still exist.
+            posarray = posarray + posarray
+        if status == INVALID:
+            raise ValueError('Entry is invalid at byte %i' %
+                             (globaloffset + offset))
+        if eof:
+            if status == MISSING_QUAL_END:
+                i = 6 * count
+                qualend_i = posarray[i+4] + (posarray[i+3] - posarray[i+2])
+                if qualend_i >= len(buf):
+                    raise ValueError('Incomplete final quality string at byte')
+                posarray[i+5] = qualend_i
+                count += 1
+            elif status != MISSING_SEQHEADER_BEGIN:
+                raise ValueError('Incomplete entry at byte %i' %
+                                 (globaloffset + offset))
+            if count:
+                yield Chunk(buf, posarray, count, globaloffset)
+            break
+        if count:
+            yield Chunk(buf, posarray, count, globaloffset)
+        globaloffset += offset
+        leftover = len(buf) - offset
+        bufsize = nextbufsize(bufsize, leftover, fbufsize + 1,
+                              shrink=shrinkbuffer)
+        if reusebuffer:
+            eof = refill(fh, buf, offset, bufsize)
+        else:
+            tmp_buf, eof = read(fh, bufsize - leftover)
             buf = buf[offset:] + tmp_buf
             del tmp_buf
-            offset = 0
+        offset = 0
+
+
+def _bytesview(m: memoryview) -> memoryview:
+    # Views with zeros in their shape (e.g., rows of width 0) cannot be cast.
+    return m.cast('B') if m.nbytes else memoryview(bytearray())
+
+
+def fill_batch(buf: bytes, positions: array, count: int,
+               sequences, qualities, lengths, headers, headeroffsets,
+               phredoffset: int) -> None:
+    """Copy the entries in a buffer into preallocated buffers **in-place**.
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Table of 6 positions for each entry in `buf`
+      (see :func:`readfastq_chunks`)
+    :param count: Number of entries
+    :param sequences: A writable buffer with `count` rows of bytes.
+      Each sequence is copied to its row, truncated to the width of the row
+      and padded with zeros.
+    :param qualities: A writable buffer with the same size as `sequences`,
+      for the quality strings with `phredoffset` subtracted.
+    :param lengths: A writable buffer of signed 64-bit integers for the
+      lengths of the sequences (after truncation).
+    :param headers: A writable buffer of bytes for all headers,
+      one after the other.
+    :param headeroffsets: A writable buffer of signed 64-bit integers for
+      the `count+1` offsets of the headers in `headers`.
+    :param phredoffset: Offset for the quality scores (usually 33).
+
+    An implementation in C is `fastqandfurious._fastqandfurious.fill_batch`.
+    """
+    qualtable = bytes((i - phredoffset) % 256 for i in range(256))
+    with memoryview(sequences) as m_seq, _bytesview(m_seq) as seqview, \
+            memoryview(qualities) as m_qual, \
+            _bytesview(m_qual) as qualview, \
+            memoryview(lengths) as m_len, m_len.cast('B') as m_len_b, \
+            m_len_b.cast('q') as lenview, \
+            memoryview(headers) as m_head, m_head.cast('B') as headview, \
+            memoryview(headeroffsets) as m_ho, m_ho.cast('B') as m_ho_b, \
+            m_ho_b.cast('q') as headoffview:
+        if len(seqview) != len(qualview) or \
+           (count and len(seqview) % count):
+            raise ValueError('The buffers for sequences and qualities must '
+                             'have count rows of the same size.')
+        width = len(seqview) // count if count else 0
+        headeroffset = 0
+        headoffview[0] = 0
+        for i in range(count):
+            pos = positions[(6*i):(6*i+6)]
+            header = buf[(pos[0]+1):pos[1]]
+            headview[headeroffset:(headeroffset+len(header))] = header
+            headeroffset += len(header)
+            headoffview[i+1] = headeroffset
+            seqlen = min(pos[3] - pos[2], width)
+            lenview[i] = seqlen
+            row = i * width
+            seqview[row:(row+seqlen)] = buf[pos[2]:(pos[2]+seqlen)]
+            qualview[row:(row+seqlen)] = \
+                bytes(buf[pos[4]:(pos[4]+seqlen)]).translate(qualtable)
+            padding = bytes(width - seqlen)
+            seqview[(row+seqlen):(row+width)] = padding
+            qualview[(row+seqlen):(row+width)] = padding
+
+
+Batch = namedtuple('Batch',
+                   'sequences qualities lengths headers headeroffsets')
+
+
+def readfastq_numpy(
+        fh: typing.BinaryIO, fbufsize: int,
+        entrypos_batch: typing.Callable[
+            [bytes, int, array], typing.Tuple[int, int, int]
+        ] = entrypos_batch,
+        fill_batch: typing.Callable[..., None] = fill_batch,
+        maxlen: typing.Optional[int] = None,
+        phredoffset: int = 33,
+        reusebuffer: bool = False
+) -> typing.Iterator[Batch]:
+    """Iterate over batches of FASTQ entries as numpy arrays.
+
+    :param fh: A file handle (see :func:`readfastq_iter`)
+    :param fbufsize: Size of the buffer (see :func:`readfastq_iter`)
+    :param entrypos_batch: A function to find the positions of all entries
+      in a buffer (see :func:`readfastq_chunks`)
+    :param fill_batch: A function to copy entries into arrays
+      (see :func:`fill_batch`)
+    :param maxlen: Number of columns for the matrices of sequences and
+      qualities. If `None` it is the length of the longest sequence in
+      the batch, otherwise longer sequences are truncated.
+    :param phredoffset: Offset for the quality scores
+    :param reusebuffer: (see :func:`readfastq_chunks`)
+    :return: An iterator of :class:`Batch` objects, one for each chunk,
+      with `sequences` and `qualities` (2D arrays of type uint8 with one
+      row per entry, padded with zeros), `lengths` (int64), and the headers
+      one after the other in `headers` (uint8) with their offsets in
+      `headeroffsets` (int64, one more than the number of entries).
+
+    This requires :mod:`numpy`.
+    """
+    import numpy
+    for chunk in readfastq_chunks(fh, fbufsize,
+                                  entrypos_batch=entrypos_batch,
+                                  reusebuffer=reusebuffer):
+        count = chunk.count
+        pos = numpy.array(chunk.positions[:(6*count)],
+                          dtype=numpy.int64).reshape(count, 6)
+        if maxlen is None:
+            width = int((pos[:, 3] - pos[:, 2]).max())
+        else:
+            width = maxlen
+        headerslen = int((pos[:, 1] - pos[:, 0] - 1).sum())
+        batch = Batch(numpy.empty((count, width), dtype=numpy.uint8),
+                      numpy.empty((count, width), dtype=numpy.uint8),
+                      numpy.empty(count, dtype=numpy.int64),
+                      numpy.empty(headerslen, dtype=numpy.uint8),
+                      numpy.empty(count + 1, dtype=numpy.int64))
+        fill_batch(chunk.buffer, chunk.positions, count,
+                   batch.sequences, batch.qualities, batch.lengths,
+                   batch.headers, batch.headeroffsets, phredoffset)
+        yield batch
+
+
+def stats_chunk(buf: bytes, positions: array, count: int,
+                lengths: array, qualsums: array, basecounts: array,
+                gchist: array, phredoffset: int) -> None:
+    """Accumulate statistics for FASTQ entries **in-place**.
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Table of 6 positions for each entry in `buf`
+    :param count: Number of entries
+    :param lengths: Histogram of sequence lengths (longer sequences are
+      in the last bin)
+    :param qualsums: Sum of quality scores for each position
+      (one less than the number of bins in `lengths`)
+    :param basecounts: Counts of A, C, G, T, and other bases (5 values)
+      for each position
+    :param gchist: Histogram of GC content in percent (101 bins)
+    :param phredoffset: Offset for quality scores
+
+    All statistics are arrays of signed 64-bit integers.
+    An implementation in C is `fastqandfurious._fastqandfurious.stats_chunk`.
+    """
+    maxpos = len(qualsums)
+    if len(lengths) != maxpos + 1 or len(basecounts) != 5 * maxpos or \
+       len(gchist) != 101:
+        raise ValueError('The sizes of the buffers for statistics '
+                         'do not match.')
+    for i in range(0, 6 * count, 6):
+        seqlen = positions[i+3] - positions[i+2]
+        sequence = bytes(buf[positions[i+2]:positions[i+3]])
+        quality = bytes(buf[positions[i+4]:(positions[i+4]+seqlen)])
+        lengths[min(seqlen, maxpos)] += 1
+        for j, (base, score) in enumerate(zip(sequence[:maxpos],
+                                              quality[:maxpos])):
+            qualsums[j] += score - phredoffset
+            basecounts[5*j + _PACK_2BIT[base]] += 1
+        gc = sequence.count(b'C') + sequence.count(b'G')
+        if seqlen:
+            gchist[(200 * gc + seqlen) // (2 * seqlen)] += 1
+
+
+class FastqStats(object):
+    """Statistics for FASTQ entries (quality control).
+
+    :param maxlen: Number of positions for the statistics per position
+      (longer sequences are in the last bin of the histogram of lengths)
+    :param phredoffset: Offset for quality scores
+    :param stats_chunk: A function to accumulate statistics
+      (see :func:`stats_chunk`)
+
+    Statistics are accumulated from chunks of entries (see
+    :func:`readfastq_chunks` and :func:`fastq_stats`) and stored in
+    arrays of fixed size. Statistics for different chunks, files, or
+    processes can be merged with :meth:`merge`.
+    """
+
+    BASES = ('A', 'C', 'G', 'T', 'other')
+
+    def __init__(self, maxlen: int = 1000, phredoffset: int = 33,
+                 stats_chunk: typing.Callable[..., None] = stats_chunk):
+        self.maxlen = maxlen
+        self.phredoffset = phredoffset
+        self._stats_chunk = stats_chunk
+        self.lengths = array('q', bytes(8 * (maxlen + 1)))
+        self.qualsums = array('q', bytes(8 * maxlen))
+        self.basecounts = array('q', bytes(8 * 5 * maxlen))
+        self.gchist = array('q', bytes(8 * 101))
+
+    def add(self, chunk: Chunk) -> None:
+        """Add the entries in a chunk."""
+        self._stats_chunk(chunk.buffer, chunk.positions, chunk.count,
+                          self.lengths, self.qualsums, self.basecounts,
+                          self.gchist, self.phredoffset)
+
+    def merge(self, other: 'FastqStats') -> None:
+        """Add the statistics in another :class:`FastqStats` **in-place**."""
+        if other.maxlen != self.maxlen or \
+           other.phredoffset != self.phredoffset:
+            raise ValueError('The statistics have different parameters.')
+        for name in ('lengths', 'qualsums', 'basecounts', 'gchist'):
+            mine = getattr(self, name)
+            for i, x in enumerate(getattr(other, name)):
+                mine[i] += x
+
+    @property
+    def count(self) -> int:
+        """Number of entries."""
+        return sum(self.lengths)
+
+    def coverage(self) -> array:
+        """Number of sequences covering each position."""
+        res = array('q', bytes(8 * self.maxlen))
+        total = 0
+        for i in range(self.maxlen, 0, -1):
+            total += self.lengths[i]
+            res[i-1] = total
+        return res
+
+    def meanquality(self) -> array:
+        """Mean quality score for each position (NaN where there
+        are no sequences)."""
+        return array('d', (qualsum / n if n else math.nan
+                           for qualsum, n in zip(self.qualsums,
+                                                 self.coverage())))
+
+    def gccontent(self) -> float:
+        """Mean GC content (in percent) of the sequences, from the
+        histogram (NaN if there are no sequences)."""
+        n = sum(self.gchist)
+        if n == 0:
+            return math.nan
+        return sum(i * x for i, x in enumerate(self.gchist)) / n
+
+    def tonumpy(self) -> typing.Dict[str, typing.Any]:
+        """Statistics as numpy arrays (the base counts are a matrix with
+        one row per position and one column per base in `BASES`).
+
+        This requires :mod:`numpy`.
+        """
+        import numpy
+        return {'lengths': numpy.array(self.lengths),
+                'qualsums': numpy.array(self.qualsums),
+                'basecounts': numpy.array(self.basecounts).reshape(
+                    self.maxlen, len(self.BASES)),
+                'gchist': numpy.array(self.gchist),
+                'coverage': numpy.array(self.coverage()),
+                'meanquality': numpy.array(self.meanquality())}
+
+
+def fastq_stats(
+        fh: typing.BinaryIO, fbufsize: int,
+        entrypos_batch: typing.Callable[
+            [bytes, int, array], typing.Tuple[int, int, int]
+        ] = entrypos_batch,
+        stats_chunk: typing.Callable[..., None] = stats_chunk,
+        maxlen: int = 1000,
+        phredoffset: int = 33
+) -> FastqStats:
+    """Compute statistics for the entries in a FASTQ stream.
+
+    :param fh: file-like object or stream (see :func:`readfastq_iter`)
+    :param fbufsize: buffer size (see :func:`readfastq_iter`)
+    :param entrypos_batch: a function to find positions of all entries
+      in a buffer (see :func:`readfastq_chunks`)
+    :param stats_chunk: a function to accumulate statistics
+      (see :func:`stats_chunk`)
+    :param maxlen: (see :class:`FastqStats`)
+    :param phredoffset: offset for quality scores
+    :return: The statistics.
+    """
+    stats = FastqStats(maxlen=maxlen, phredoffset=phredoffset,
+                       stats_chunk=stats_chunk)
+    for chunk in readfastq_chunks(fh, fbufsize,
+                                  entrypos_batch=entrypos_batch,
+                                  reusebuffer=True):
+        stats.add(chunk)
+    return stats
+
+
+ILLUMINA_INSTRUMENT_BEG: int = 0
+ILLUMINA_INSTRUMENT_END: int = 1
+ILLUMINA_RUN: int = 2
+ILLUMINA_FLOWCELL_BEG: int = 3
+ILLUMINA_FLOWCELL_END: int = 4
+ILLUMINA_LANE: int = 5
+ILLUMINA_TILE: int = 6
+ILLUMINA_X: int = 7
+ILLUMINA_Y: int = 8
+ILLUMINA_READ: int = 9
+ILLUMINA_FILTERED: int = 10
+ILLUMINA_CONTROL: int = 11
+ILLUMINA_FIELDS: typing.Tuple[str, ...] = (
+    'instrument_beg', 'instrument_end', 'run', 'flowcell_beg',
+    'flowcell_end', 'lane', 'tile', 'x', 'y', 'read', 'filtered', 'control')
+ILLUMINA_NFIELDS: int = len(ILLUMINA_FIELDS)
+ILLUMINA_OK: int = 0
+ILLUMINA_MALFORMED: int = 1
+ILLUMINA_BARCODE_TRUNCATED: int = 2
+
+
+def _illumina_int(field: bytes) -> int:
+    if 0 < len(field) <= 18 and field.isdigit():
+        return int(field)
+    return -1
+
+
+def _parse_illumina(header: bytes, offset: int) -> typing.Tuple[
+        typing.List[int], bytes, int]:
+    # Parse an Illumina header (without the '@') starting at `offset`
+    # in the buffer.
+    values = [-1, ] * ILLUMINA_NFIELDS
+    malformed = ([-1, ] * ILLUMINA_NFIELDS, b'', ILLUMINA_MALFORMED)
+    name, space, comment = header.partition(b' ')
+    parts = name.split(b':')
+    if len(parts) not in (7, 8) or not parts[0] or not parts[2]:
+        return malformed
+    ints = [_illumina_int(x) for x in (parts[1], ) + tuple(parts[3:7])]
+    if min(ints) < 0:
+        return malformed
+    values[ILLUMINA_INSTRUMENT_BEG] = offset
+    values[ILLUMINA_INSTRUMENT_END] = offset + len(parts[0])
+    values[ILLUMINA_RUN] = ints[0]
+    values[ILLUMINA_FLOWCELL_BEG] = values[ILLUMINA_INSTRUMENT_END] + \
+        len(parts[1]) + 2
+    values[ILLUMINA_FLOWCELL_END] = values[ILLUMINA_FLOWCELL_BEG] + \
+        len(parts[2])
+    (values[ILLUMINA_LANE], values[ILLUMINA_TILE],
+     values[ILLUMINA_X], values[ILLUMINA_Y]) = ints[1:]
+    if not space:
+        return values, b'', ILLUMINA_OK
+    parts = comment.split(b' ', 1)[0].split(b':', 3)
+    if len(parts) != 4 or parts[1] not in (b'Y', b'N'):
+        return malformed
+    values[ILLUMINA_READ] = _illumina_int(parts[0])
+    values[ILLUMINA_FILTERED] = int(parts[1] == b'Y')
+    values[ILLUMINA_CONTROL] = _illumina_int(parts[2])
+    if min(values) < 0:
+        return malformed
+    return values, parts[3], ILLUMINA_OK
+
+
+def illumina_headers(buf: bytes, positions: array, count: int,
+                     fields: array, barcodes: bytearray, barcodelen: int,
+                     status: bytearray) -> int:
+    """Parse the Illumina (CASAVA 1.8) headers of FASTQ entries
+    **in-place**.
+
+    Headers are expected to be like
+    ``@<instrument>:<run>:<flowcell>:<lane>:<tile>:<x>:<y>[:<UMI>]
+    <read>:<filtered>:<control>:<index>`` (the part after the space
+    is optional).
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Table of 6 positions for each entry in `buf`
+    :param count: Number of entries
+    :param fields: Array of signed 64-bit integers for the
+      `ILLUMINA_NFIELDS` fields of each entry, by field (field `f` of
+      entry `i` is at `f * count + i`). The instrument and the flowcell
+      are positions in `buf`, the filter flag is 1 for `Y` and 0 for `N`,
+      and fields that are missing or could not be parsed are -1.
+    :param barcodes: Buffer of `barcodelen` bytes for each entry, for
+      the index sequence (padded with zeros)
+    :param barcodelen: Number of bytes for each index sequence
+    :param status: Buffer of one byte for each entry, with `ILLUMINA_OK`,
+      `ILLUMINA_MALFORMED`, or `ILLUMINA_BARCODE_TRUNCATED`
+    :return: Number of entries with a status other than `ILLUMINA_OK`.
+
+    Malformed headers do not raise exceptions, they are reported in
+    `status`.
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.illumina_headers`.
+    """
+    if len(fields) < ILLUMINA_NFIELDS * count or \
+       len(barcodes) < barcodelen * count or len(status) < count:
+        raise ValueError('The buffers are too small for the number '
+                         'of entries.')
+    nbad = 0
+    for i in range(count):
+        begin, end = positions[6*i] + 1, positions[6*i+1]
+        values, barcode, res = _parse_illumina(bytes(buf[begin:end]), begin)
+        if len(barcode) > barcodelen:
+            barcode = barcode[:barcodelen]
+            res = ILLUMINA_BARCODE_TRUNCATED
+        for f, value in enumerate(values):
+            fields[f * count + i] = value
+        barcodes[(i * barcodelen):((i + 1) * barcodelen)] = \
+            barcode.ljust(barcodelen, b'\x00')
+        status[i] = res
+        if res != ILLUMINA_OK:
+            nbad += 1
+    return nbad
+
+
+class IlluminaHeaders(object):
+    """Fields of the Illumina headers for a chunk of FASTQ entries,
+    as columns.
+
+    :param chunk: A chunk of entries (see :func:`readfastq_chunks`)
+    :param barcodelen: Maximum length for the index sequences
+    :param illumina_headers: A function to parse the headers
+      (see :func:`illumina_headers`)
+
+    The instrument and the flowcell are positions in the buffer of
+    the chunk, so they are only valid as long as that buffer is (this
+    is not the case with `reusebuffer=True` once the next chunk is read).
+    """
+
+    def __init__(self, chunk: Chunk, barcodelen: int = 16,
+                 illumina_headers: typing.Callable[
+                     ..., int] = illumina_headers):
+        self.buffer = chunk.buffer
+        self.count = chunk.count
+        self.barcodelen = barcodelen
+        self.fields = array('q', bytes(8 * ILLUMINA_NFIELDS * chunk.count))
+        self.barcodes = bytearray(barcodelen * chunk.count)
+        self.status = bytearray(chunk.count)
+        self.nbad = illumina_headers(chunk.buffer, chunk.positions,
+                                     chunk.count, self.fields, self.barcodes,
+                                     barcodelen, self.status)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def column(self, name: str) -> memoryview:
+        """Values of a field (one of `ILLUMINA_FIELDS`) for all entries."""
+        f = ILLUMINA_FIELDS.index(name)
+        return memoryview(self.fields)[(f * self.count):
+                                       ((f + 1) * self.count)]
+
+    def _text(self, i: int, f: int) -> typing.Optional[bytes]:
+        begin = self.fields[f * self.count + i]
+        if begin < 0:
+            return None
+        return bytes(self.buffer[begin:self.fields[(f + 1) * self.count + i]])
+
+    def instrument(self, i: int) -> typing.Optional[bytes]:
+        """Instrument for entry `i` (None if the header is malformed)."""
+        return self._text(i, ILLUMINA_INSTRUMENT_BEG)
+
+    def flowcell(self, i: int) -> typing.Optional[bytes]:
+        """Flowcell for entry `i` (None if the header is malformed)."""
+        return self._text(i, ILLUMINA_FLOWCELL_BEG)
+
+    def barcode(self, i: int) -> bytes:
+        """Index sequence for entry `i` (empty if there is none)."""
+        barcode = self.barcodes[(i * self.barcodelen):
+                                ((i + 1) * self.barcodelen)]
+        return bytes(barcode).rstrip(b'\x00')
+
+    def tonumpy(self) -> typing.Dict[str, typing.Any]:
+        """Fields as numpy arrays (plus the index sequences as an
+        array of fixed-length bytes and the status).
+
+        This requires :mod:`numpy`.
+        """
+        import numpy
+        res = {name: numpy.array(self.column(name))
+               for name in ILLUMINA_FIELDS}
+        res['barcode'] = numpy.frombuffer(bytes(self.barcodes),
+                                          dtype='S%i' % self.barcodelen) \
+            if self.barcodelen else numpy.zeros(self.count, dtype='S1')
+        res['status'] = numpy.frombuffer(bytes(self.status),
+                                         dtype=numpy.uint8)
+        return res
+
+
+def _pairname(buf: bytes, posarray) -> bytes:
+    name = bytes(buf[(posarray[0]+1):posarray[1]]).split(b' ', 1)[0]
+    if name[-2:] in (b'/1', b'/2'):
+        name = name[:-2]
+    return name
+
+
+def checkpairs(buf1: bytes, positions1: array, start1: int,
+               buf2: bytes, positions2: array, start2: int,
+               count: int) -> int:
+    """Check that the read names of paired FASTQ entries agree.
+
+    :param buf1: Buffer with FASTQ data for the first reads
+    :param positions1: Table of positions for the entries in `buf1`
+    :param start1: Index of the first entry to check in `positions1`
+    :param buf2: Buffer with FASTQ data for the second reads
+    :param positions2: Table of positions for the entries in `buf2`
+    :param start2: Index of the first entry to check in `positions2`
+    :param count: Number of pairs to check
+    :return: The index (from `start1` and `start2`) of the first pair
+      with different names, or -1.
+
+    The read name is the header up to the first space (which drops
+    Illumina comments like ` 1:N:0:ATCACG`), without a trailing `/1`
+    or `/2`.
+
+    An implementation in C is `fastqandfurious._fastqandfurious.checkpairs`.
+    """
+    if start1 < 0 or start2 < 0 or count < 0 or \
+       6 * (start1 + count) > len(positions1) or \
+       6 * (start2 + count) > len(positions2):
+        raise ValueError('Positions out of bounds.')
+    for i in range(count):
+        j1 = 6 * (start1 + i)
+        j2 = 6 * (start2 + i)
+        if _pairname(buf1, positions1[j1:(j1+2)]) != \
+           _pairname(buf2, positions2[j2:(j2+2)]):
+            return i
+    return -1
+
+
+def readfastq_paired(
+        fh1: typing.BinaryIO, fh2: typing.BinaryIO, fbufsize: int,
+        entryfunc: typing.Callable[[bytes, array, int], tuple] = entryfunc,
+        entrypos_batch: typing.Callable[
+            [bytes, int, array], typing.Tuple[int, int, int]
+        ] = entrypos_batch,
+        checkpairs: typing.Optional[typing.Callable[..., int]] = checkpairs,
+        batches: bool = False
+) -> typing.Iterator[typing.Tuple[typing.Any, typing.Any]]:
+    """Iterate through pairs of entries in two FASTQ streams (paired-end
+    reads).
+
+    :param fh1: file-like object or stream for the first reads
+    :param fh2: file-like object or stream for the second reads
+    :param fbufsize: buffer size (see :func:`readfastq_iter`)
+    :param entryfunc: a function to build an entry object
+      (see :func:`readfastq_iter`)
+    :param entrypos_batch: a function to find positions of all entries
+      in a buffer (see :func:`readfastq_chunks`)
+    :param checkpairs: a function to check that the read names in pairs
+      agree (see :func:`checkpairs`), or `None` to not check them
+    :param batches: yield pairs of :class:`Chunk` objects with the same
+      number of entries rather than pairs of entries
+    :return: An iterator of pairs.
+
+    Both streams are parsed in chunks (see :func:`readfastq_chunks`) and the
+    names are checked for all pairs matched between the current chunks at
+    once. A :class:`ValueError` is raised when names differ, or when one
+    stream has more entries than the other.
+
+    With streams from :func:`automagic_open` with `readahead`, each file
+    is read and decompressed on its own thread.
+    """
+    it1 = readfastq_chunks(fh1, fbufsize, entrypos_batch=entrypos_batch)
+    it2 = readfastq_chunks(fh2, fbufsize, entrypos_batch=entrypos_batch)
+    chunk1 = chunk2 = None
+    i1 = i2 = 0
+    while True:
+        if chunk1 is None or i1 == chunk1.count:
+            chunk1 = next(it1, None)
+            i1 = 0
+        if chunk2 is None or i2 == chunk2.count:
+            chunk2 = next(it2, None)
+            i2 = 0
+        if chunk1 is None or chunk2 is None:
+            if chunk1 is not None or chunk2 is not None:
+                raise ValueError('The streams have different numbers '
+                                 'of entries.')
+            break
+        n = min(chunk1.count - i1, chunk2.count - i2)
+        if checkpairs is not None:
+            mismatch = checkpairs(chunk1.buffer, chunk1.positions, i1,
+                                  chunk2.buffer, chunk2.positions, i2, n)
+            if mismatch >= 0:
+                j1 = 6 * (i1 + mismatch)
+                j2 = 6 * (i2 + mismatch)
+                raise ValueError(
+                    'The read names differ in a pair: %r and %r.' %
+                    (_pairname(chunk1.buffer,
+                               chunk1.positions[j1:(j1+2)]),
+                     _pairname(chunk2.buffer,
+                               chunk2.positions[j2:(j2+2)])))
+        if batches:
+            yield (Chunk(chunk1.buffer,
+                         chunk1.positions[(6*i1):(6*(i1+n))],
+                         n, chunk1.globaloffset),
+                   Chunk(chunk2.buffer,
+                         chunk2.positions[(6*i2):(6*(i2+n))],
+                         n, chunk2.globaloffset))
+        else:
+            with memoryview(chunk1.positions) as table1, \
+                    memoryview(chunk2.positions) as table2:
+                for j in range(n):
+                    j1 = 6 * (i1 + j)
+                    j2 = 6 * (i2 + j)
+                    yield (entryfunc(chunk1.buffer, table1[j1:(j1+6)],
+                                     chunk1.globaloffset),
+                           entryfunc(chunk2.buffer, table2[j2:(j2+6)],
+                                     chunk2.globaloffset))
+        i1 += n
+        i2 += n
+
+
+BASES_2BIT: bytes = b'ACGT'
+_PACK_2BIT: bytes = bytes(BASES_2BIT.index(i) if i in BASES_2BIT else 4
+                          for i in range(256))
+_COMPLEMENT: bytes = bytes.maketrans(b'ACGTRYKMBVDHNSWacgtrykmbvdhnsw',
+                                     b'TGCAYRMKVBHDNSWtgcayrmkvbhdnsw')
+
+
+def pack2bit(buf: bytes, begin: int, end: int,
+             packed: bytearray, start: int) -> typing.Optional[list]:
+    """Pack the bases in `buf[begin:end]` with 2 bits each **in-place**.
+
+    :param buf: Buffer with the bases
+    :param begin: Position of the first base in `buf`
+    :param end: Position after the last base in `buf`
+    :param packed: A writable buffer with zeros from the base `start`.
+      The base `i` is in the bits `2*(i%4)` and `2*(i%4)+1` of the
+      byte `i//4`.
+    :param start: Index of the base to start at in `packed`
+    :return: `None`, or a list of `(index, character)` for the characters
+      that are not A, C, G, or T (packed as A).
+
+    An implementation in C is `fastqandfurious._fastqandfurious.pack2bit`.
+    """
+    if begin < 0 or end > len(buf) or end < begin or start < 0 or \
+       (start + end - begin + 3) // 4 > len(packed):
+        raise ValueError('Positions out of bounds.')
+    exceptions = None
+    for j, c in enumerate(bytes(buf[begin:end])):
+        code = _PACK_2BIT[c]
+        if code > 3:
+            if exceptions is None:
+                exceptions = []
+            exceptions.append((j, c))
+            code = 0
+        i = start + j
+        packed[i >> 2] |= code << ((i & 3) << 1)
+    return exceptions
+
+
+def unpack2bit(packed: bytes, start: int, length: int,
+               out: bytearray, reverse: bool) -> None:
+    """Unpack bases packed with 2 bits each into a buffer **in-place**.
+
+    :param packed: Packed bases (see :func:`pack2bit`)
+    :param start: Index of the first base in `packed`
+    :param length: Number of bases
+    :param out: A writable buffer of at least `length` bytes
+    :param reverse: Write the reverse complement
+
+    An implementation in C is `fastqandfurious._fastqandfurious.unpack2bit`.
+    """
+    if start < 0 or length < 0 or (start + length + 3) // 4 > len(packed) \
+       or length > len(out):
+        raise ValueError('Positions out of bounds.')
+    for j in range(length):
+        i = start + j
+        code = (packed[i >> 2] >> ((i & 3) << 1)) & 3
+        if reverse:
+            out[length - 1 - j] = BASES_2BIT[3 - code]
+        else:
+            out[j] = BASES_2BIT[code]
+
+
+def pack2bit_chunk(buf: bytes, positions: array, count: int,
+                   packed: bytearray,
+                   offsets: array) -> typing.Optional[list]:
+    """Pack the sequences of FASTQ entries with 2 bits per base
+    **in-place**.
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Table of 6 positions for each entry in `buf`
+    :param count: Number of entries
+    :param packed: A bytearray with zeros from the base `offsets[0]`
+      (see :func:`pack2bit`), extended with zeros as needed
+    :param offsets: Array of `count + 1` signed 64-bit integers. The
+      first one is the index of the base to start at in `packed`, and
+      the index after each sequence is written in the others.
+    :return: `None`, or a list of `(index, character)` for the characters
+      that are not A, C, G, or T (packed as A), with indices in `packed`.
+
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.pack2bit_chunk`.
+    """
+    if count < 0 or len(positions) < 6 * count or len(offsets) < count + 1:
+        raise ValueError('The buffers are too small for the number '
+                         'of entries.')
+    total = offsets[0]
+    if total < 0:
+        raise ValueError('Positions out of bounds.')
+    for i in range(0, 6 * count, 6):
+        if positions[i+2] < 0 or positions[i+3] < positions[i+2] or \
+           positions[i+3] > len(buf):
+            raise ValueError('Positions out of bounds.')
+        total += positions[i+3] - positions[i+2]
+    nbytes = (total + 3) // 4
+    if nbytes > len(packed):
+        packed.extend(bytes(max(nbytes - len(packed), len(packed) // 2)))
+    exceptions = None
+    for i in range(count):
+        begin, end = positions[6*i+2], positions[6*i+3]
+        res = pack2bit(buf, begin, end, packed, offsets[i])
+        if res is not None:
+            if exceptions is None:
+                exceptions = []
+            exceptions.extend((offsets[i] + j, c) for j, c in res)
+        offsets[i+1] = offsets[i] + end - begin
+    return exceptions
+
+
+def unpack2bit_chunk(packed: bytes, offsets: array,
+                     indices: typing.Optional[array],
+                     exception_pos: array, exception_chars: bytes) -> list:
+    """Unpack sequences packed with 2 bits per base
+    (see :func:`pack2bit_chunk`).
+
+    :param packed: Packed bases
+    :param offsets: Index of the first base of each sequence in `packed`,
+      and of the end of the last one
+    :param indices: Indices of the sequences (negative indices count from
+      the end), or `None` for all sequences
+    :param exception_pos: Indices in `packed` of the characters that are
+      not A, C, G, or T, in increasing order
+    :param exception_chars: These characters
+    :return: A list of bytes.
+
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.unpack2bit_chunk`.
+    """
+    n = len(offsets) - 1
+    if indices is None:
+        indices = range(n)
+    res = []
+    for i in indices:
+        if i < 0:
+            i += n
+        if i < 0 or i >= n:
+            raise IndexError('Index out of range.')
+        start = offsets[i]
+        length = offsets[i+1] - start
+        out = bytearray(length)
+        unpack2bit(packed, start, length, out, False)
+        e = bisect.bisect_left(exception_pos, start)
+        while e < len(exception_pos) and exception_pos[e] < start + length:
+            out[exception_pos[e] - start] = exception_chars[e]
+            e += 1
+        res.append(bytes(out))
+    return res
+
+
+def kmers2bit(packed: bytes, start: int, length: int, k: int,
+              out: array) -> None:
+    """Compute the k-mers in bases packed with 2 bits each **in-place**.
+
+    :param packed: Packed bases (see :func:`pack2bit`)
+    :param start: Index of the first base in `packed`
+    :param length: Number of bases
+    :param k: Size of the k-mers (at most 32)
+    :param out: A writable buffer of unsigned 64-bit integers for the
+      `length-k+1` k-mers, each one with its first base in the highest bits.
+
+    An implementation in C is `fastqandfurious._fastqandfurious.kmers2bit`.
+    """
+    if k < 1 or k > 32:
+        raise ValueError('k must be between 1 and 32.')
+    if start < 0 or length < 0 or (start + length + 3) // 4 > len(packed) \
+       or (length >= k and length - k + 1 > len(out)):
+        raise ValueError('Positions out of bounds.')
+    mask = (1 << (2 * k)) - 1
+    kmer = 0
+    for j in range(length):
+        i = start + j
+        kmer = ((kmer << 2) | ((packed[i >> 2] >> ((i & 3) << 1)) & 3)) & mask
+        if j >= k - 1:
+            out[j - k + 1] = kmer
+
+
+class PackedSequences(object):
+    """Sequences packed with 2 bits per base.
+
+    :param pack2bit: A function to pack bases (see :func:`pack2bit`)
+    :param unpack2bit: A function to unpack bases (see :func:`unpack2bit`)
+    :param kmers2bit: A function to compute k-mers (see :func:`kmers2bit`)
+    :param pack2bit_chunk: A function to pack the sequences in a chunk
+      (see :func:`pack2bit_chunk`)
+    :param unpack2bit_chunk: A function to unpack sequences
+      (see :func:`unpack2bit_chunk`)
+
+    Bases other than A, C, G, and T (for example N or other IUPAC codes)
+    are rare in sequencing reads and are stored separately with their
+    position. Sequences are added with :meth:`append`, that has the
+    signature of an `entryfunc` (see :func:`readfastq_iter`), or
+    with :meth:`extend` for chunks of entries (packed with one call
+    to `pack2bit_chunk`).
+    """
+
+    def __init__(self, pack2bit=pack2bit, unpack2bit=unpack2bit,
+                 kmers2bit=kmers2bit, pack2bit_chunk=pack2bit_chunk,
+                 unpack2bit_chunk=unpack2bit_chunk):
+        self._pack2bit = pack2bit
+        self._unpack2bit = unpack2bit
+        self._kmers2bit = kmers2bit
+        self._pack2bit_chunk = pack2bit_chunk
+        self._unpack2bit_chunk = unpack2bit_chunk
+        self._packed = bytearray()
+        # Index of the first base of each sequence, and of the end.
+        self._offsets = array('q', [0])
+        self._exception_pos = array('q')
+        self._exception_chars = bytearray()
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the packed data (in bytes)."""
+        return (len(self._packed) +
+                self._offsets.itemsize * len(self._offsets) +
+                self._exception_pos.itemsize * len(self._exception_pos) +
+                len(self._exception_chars))
+
+    def _add(self, buf, begin: int, end: int) -> None:
+        start = self._offsets[-1]
+        nbytes = (start + end - begin + 3) // 4
+        if nbytes > len(self._packed):
+            self._packed.extend(bytes(max(nbytes - len(self._packed),
+                                          len(self._packed) // 2)))
+        exceptions = self._pack2bit(buf, begin, end, self._packed, start)
+        if exceptions is not None:
+            for j, c in exceptions:
+                self._exception_pos.append(start + j)
+                self._exception_chars.append(c)
+        self._offsets.append(start + end - begin)
+
+    def append(self, buf: bytes, posarray: array, globaloffset: int) -> None:
+        """Add the sequence of a FASTQ entry.
+
+        :param buf: Buffer with FASTQ data
+        :param posarray: Positions for the entry
+          (see :func:`readfastq_iter`)
+        :param globaloffset: Ignored
+        """
+        self._add(buf, posarray[2], posarray[3])
+
+    def extend(self, chunk: Chunk) -> None:
+        """Add the sequences of a chunk of FASTQ entries
+        (see :func:`readfastq_chunks`)."""
+        offsets = array('q', bytes(8 * (chunk.count + 1)))
+        offsets[0] = self._offsets[-1]
+        exceptions = self._pack2bit_chunk(chunk.buffer, chunk.positions,
+                                          chunk.count, self._packed, offsets)
+        if exceptions is not None:
+            for j, c in exceptions:
+                self._exception_pos.append(j)
+                self._exception_chars.append(c)
+        self._offsets.extend(offsets[1:])
+
+    def _exceptions(self, i: int) -> typing.Tuple[int, int]:
+        lo = bisect.bisect_left(self._exception_pos, self._offsets[i])
+        hi = bisect.bisect_left(self._exception_pos, self._offsets[i+1], lo)
+        return lo, hi
+
+    def _decode(self, i: int, reverse: bool) -> bytes:
+        start = self._offsets[i]
+        length = self._offsets[i+1] - start
+        out = bytearray(length)
+        self._unpack2bit(self._packed, start, length, out, reverse)
+        lo, hi = self._exceptions(i)
+        for e in range(lo, hi):
+            j = self._exception_pos[e] - start
+            c = self._exception_chars[e]
+            if reverse:
+                out[length - 1 - j] = _COMPLEMENT[c]
+            else:
+                out[j] = c
+        return bytes(out)
+
+    def __getitem__(self, i: int) -> bytes:
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('Index out of range.')
+        return self._decode(i, False)
+
+    def decode(self,
+               indices: typing.Optional[typing.Iterable[int]] = None) -> list:
+        """Get sequences (all of them if `indices` is `None`), unpacked
+        with one call to `unpack2bit_chunk`."""
+        if indices is not None:
+            indices = array('q', indices)
+        return self._unpack2bit_chunk(self._packed, self._offsets, indices,
+                                      self._exception_pos,
+                                      self._exception_chars)
+
+    def reverse_complement(self, i: int) -> bytes:
+        """Get the reverse complement of a sequence."""
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('Index out of range.')
+        return self._decode(i, True)
+
+    def kmers(self, i: int, k: int) -> array:
+        """Get the k-mers in a sequence, as unsigned 64-bit integers with
+        2 bits per base (the first base in the highest bits). The k-mers
+        with a base other than A, C, G, or T are skipped."""
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('Index out of range.')
+        start = self._offsets[i]
+        length = self._offsets[i+1] - start
+        res = array('Q', bytes(8 * max(length - k + 1, 0)))
+        self._kmers2bit(self._packed, start, length, k, res)
+        lo, hi = self._exceptions(i)
+        if lo < hi:
+            skip = set()
+            for e in range(lo, hi):
+                j = self._exception_pos[e] - start
+                skip.update(range(max(j - k + 1, 0), min(j + 1, len(res))))
+            res = array('Q', (x for j, x in enumerate(res)
+                              if j not in skip))
+        return res
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _fmix64(k: int) -> int:
+    k ^= k >> 33
+    k = (k * 0xff51afd7ed558ccd) & _MASK64
+    k ^= k >> 33
+    k = (k * 0xc4ceb9fe1a85ec53) & _MASK64
+    k ^= k >> 33
+    return k
+
+
+def kmerhash(kmer: int, seed: int) -> int:
+    """Hash a k-mer encoded with 2 bits per base (see :func:`kmers2bit`).
+
+    :param kmer: The k-mer, as an unsigned 64-bit integer
+    :param seed: Seed for the hash function (unsigned 32-bit integer)
+    :return: The first 64 bits of MurmurHash3 (x64, 128 bits) for the
+      8 bytes (little-endian) of `kmer`.
+    """
+    k1 = (kmer * 0x87c37b91114253d5) & _MASK64
+    k1 = ((k1 << 31) | (k1 >> 33)) & _MASK64
+    k1 = (k1 * 0x4cf5ad432745937f) & _MASK64
+    h1 = (seed ^ k1) ^ 8
+    h2 = seed ^ 8
+    h1 = (h1 + h2) & _MASK64
+    h2 = (h2 + h1) & _MASK64
+    return (_fmix64(h1) + _fmix64(h2)) & _MASK64
+
+
+def _kmerhashes(buf, begin: int, end: int, k: int, seed: int):
+    mask = (1 << (2 * k)) - 1
+    shift = 2 * (k - 1)
+    fwd = 0
+    rev = 0
+    valid = 0
+    for c in bytes(buf[begin:end]):
+        code = _PACK_2BIT[c]
+        if code > 3:
+            valid = 0
+            continue
+        fwd = ((fwd << 2) | code) & mask
+        rev = (rev >> 2) | ((3 - code) << shift)
+        if valid < k:
+            valid += 1
+        if valid == k:
+            yield kmerhash(min(fwd, rev), seed)
+
+
+def _check_kmer_args(buf, positions, count: int, k: int) -> None:
+    if k < 1 or k > 32:
+        raise ValueError('k must be between 1 and 32.')
+    if count < 0 or len(positions) < 6 * count:
+        raise ValueError('The buffer of positions is too small '
+                         'for the number of entries.')
+    for i in range(0, 6 * count, 6):
+        if positions[i+2] < 0 or positions[i+3] < positions[i+2] or \
+           positions[i+3] > len(buf):
+            raise ValueError('Invalid positions.')
+
+
+def kmerhashes_chunk(buf: bytes, positions: array, count: int,
+                     k: int, seed: int) -> bytes:
+    """Compute the hashes of the canonical k-mers in the sequences of
+    FASTQ entries.
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Positions for the entries, with 6 positions for
+      each entry (see :func:`readfastq_chunks`)
+    :param count: Number of entries
+    :param k: Size of the k-mers (at most 32)
+    :param seed: Seed for the hash function (see :func:`kmerhash`)
+    :return: The hashes, as unsigned 64-bit integers in native byte order
+      (`array('Q', res)` makes an array of them).
+
+    The canonical k-mer is the smallest of the k-mer and of its reverse
+    complement, encoded with 2 bits per base. The k-mers with a base
+    other than A, C, G, or T are skipped.
+
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.kmerhashes_chunk`.
+    """
+    _check_kmer_args(buf, positions, count, k)
+    res = array('Q')
+    for i in range(0, 6 * count, 6):
+        res.extend(_kmerhashes(buf, positions[i+2], positions[i+3], k, seed))
+    return res.tobytes()
+
+
+def _sketch_insert(sketch: array, n: int, value: int) -> int:
+    size = len(sketch)
+    if n == size and value >= sketch[n-1]:
+        return n
+    i = bisect.bisect_left(sketch, value, 0, n)
+    if i < n and sketch[i] == value:
+        return n
+    if n == size:
+        n -= 1
+    sketch[(i+1):(n+1)] = sketch[i:n]
+    sketch[i] = value
+    return n + 1
+
+
+def sketch_chunk(buf: bytes, positions: array, count: int,
+                 k: int, seed: int, sketch: array, n: int) -> int:
+    """Add the hashes of the canonical k-mers in the sequences of FASTQ
+    entries to a bottom sketch **in-place**.
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Positions for the entries (see :func:`kmerhashes_chunk`)
+    :param count: Number of entries
+    :param k: Size of the k-mers (at most 32)
+    :param seed: Seed for the hash function (see :func:`kmerhash`)
+    :param sketch: An `array('Q')` with the smallest distinct hashes
+      in increasing order. Its length is the size of the sketch.
+    :param n: Number of hashes in `sketch`
+    :return: The number of hashes in `sketch`.
+
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.sketch_chunk`.
+    """
+    _check_kmer_args(buf, positions, count, k)
+    if n < 0 or n > len(sketch) or len(sketch) == 0:
+        raise ValueError('Invalid number of hashes in the sketch.')
+    for i in range(0, 6 * count, 6):
+        for value in _kmerhashes(buf, positions[i+2], positions[i+3],
+                                 k, seed):
+            n = _sketch_insert(sketch, n, value)
+    return n
+
+
+class BottomSketch(object):
+    """Bottom sketch (MinHash sketch) of the canonical k-mers in sequences.
+
+    :param size: Maximum number of hashes in the sketch
+    :param k: Size of the k-mers (at most 32)
+    :param seed: Seed for the hash function (see :func:`kmerhash`)
+    :param sketch_chunk: A function to add the k-mers in a chunk of
+      entries to the sketch (see :func:`sketch_chunk`)
+
+    The sketch keeps the `size` smallest distinct hashes, in increasing
+    order. It is built from chunks of entries (see
+    :func:`readfastq_chunks`) without creating Python objects for
+    the sequences.
+    """
+
+    def __init__(self, size: int, k: int, seed: int = 42,
+                 sketch_chunk=sketch_chunk):
+        if size < 1:
+            raise ValueError('The size must be at least 1.')
+        if k < 1 or k > 32:
+            raise ValueError('k must be between 1 and 32.')
+        self.size = size
+        self.k = k
+        self.seed = seed
+        self._sketch_chunk = sketch_chunk
+        self._sketch = array('Q', bytes(8 * size))
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    @property
+    def hashes(self) -> array:
+        """The hashes in the sketch, in increasing order."""
+        return self._sketch[:self._n]
+
+    def add(self, chunk: Chunk) -> None:
+        """Add the k-mers in a chunk of FASTQ entries."""
+        self._n = self._sketch_chunk(chunk.buffer, chunk.positions,
+                                     chunk.count, self.k, self.seed,
+                                     self._sketch, self._n)
+
+    def _check_compatible(self, other: 'BottomSketch') -> None:
+        if (self.size, self.k, self.seed) != (other.size, other.k, other.seed):
+            raise ValueError('The sketches do not have the same size, k, '
+                             'and seed.')
+
+    def merge(self, other: 'BottomSketch') -> None:
+        """Merge the hashes in an other sketch (for example a sketch
+        for an other part of the same file)."""
+        self._check_compatible(other)
+        for value in other.hashes:
+            self._n = _sketch_insert(self._sketch, self._n, value)
+
+    def jaccard(self, other: 'BottomSketch') -> float:
+        """Estimate the Jaccard index with an other sketch."""
+        self._check_compatible(other)
+        union = sorted(set(self.hashes) | set(other.hashes))[:self.size]
+        if len(union) == 0:
+            return 0.0
+        common = set(self.hashes) & set(other.hashes)
+        return sum(1 for x in union if x in common) / len(union)
+
+
+def sketch_fastq(
+        fh: typing.BinaryIO, fbufsize: int, size: int, k: int,
+        seed: int = 42,
+        entrypos_batch: typing.Callable[
+            [bytes, int, array], typing.Tuple[int, int, int]
+        ] = entrypos_batch,
+        sketch_chunk: typing.Callable[..., int] = sketch_chunk
+) -> BottomSketch:
+    """Compute the bottom sketch for the entries in a FASTQ stream.
+
+    :param fh: file-like object or stream (see :func:`readfastq_iter`)
+    :param fbufsize: buffer size (see :func:`readfastq_iter`)
+    :param size: (see :class:`BottomSketch`)
+    :param k: (see :class:`BottomSketch`)
+    :param seed: (see :class:`BottomSketch`)
+    :param entrypos_batch: a function to find positions of all entries
+      in a buffer (see :func:`readfastq_chunks`)
+    :param sketch_chunk: (see :class:`BottomSketch`)
+    :return: The sketch.
+    """
+    sketch = BottomSketch(size, k, seed=seed, sketch_chunk=sketch_chunk)
+    for chunk in readfastq_chunks(fh, fbufsize,
+                                  entrypos_batch=entrypos_batch,
+                                  reusebuffer=True):
+        sketch.add(chunk)
+    return sketch
+
+
+def entryboundary(fh: typing.BinaryIO, start: int,
+                  fbufsize: int = 2**16) -> int:
+    """Find the beginning of the first FASTQ entry at or after a position.
+
+    :param fh: seekable file-like object with FASTQ data
+    :param start: position in `fh`
+    :param fbufsize: size of the blocks read to find the beginning of an entry
+    :return: position of the character `@` beginning the entry, or
+      the size of the data if there is no entry after `start`.
+
+    A line beginning with `@` can be either a header or a quality string.
+    A header is followed by a sequence, which does not begin with `@`,
+    and by a line beginning with `+`. A quality string beginning with `@`
+    is followed by a header, which does. This assumes that entries are on
+    4 lines (no multi-line sequences or quality strings).
+    """
+    if start == 0:
+        return 0
+    bufsize = fbufsize
+    while True:
+        fh.seek(start - 1)
+        buf = fh.read(bufsize)
+        eof = len(buf) < bufsize
+        i = buf.find(BYTES_NEWLINE_AT)
+        while i != -1:
+            headerend_i = buf.find(CHAR_NEWLINE, i+1)
+            if headerend_i == -1:
+                break
+            seqend_i = buf.find(CHAR_NEWLINE, headerend_i+1)
+            if seqend_i == -1 or (seqend_i+1) >= len(buf):
+                break
+            if (buf[headerend_i+1] != CHAR_AT and
+                    buf[seqend_i+1] == CHAR_PLUS):
+                return start + i
+            i = buf.find(BYTES_NEWLINE_AT, i+1)
+        if eof:
+            return start - 1 + len(buf)
+        bufsize *= 2
+
+
+def _readfastq_shard(args) -> list:
+    filename, start, end, fbufsize, entryfunc, entrypos = args
+    res = list()
+    with open(filename, 'rb') as fh:
+        begin = entryboundary(fh, start)
+        if begin >= end:
+            return res
+        fh.seek(begin)
+
+        def shard_entryfunc(buf, pos, globaloffset):
+            return (pos[0] + globaloffset, entryfunc(buf, pos, globaloffset))
+
+        it = readfastq_iter(fh, fbufsize,
+                            entryfunc=shard_entryfunc,
+                            entrypos=entrypos,
+                            globaloffset=begin)
+        for headerbeg_i, entry in it:
+            if headerbeg_i >= end:
+                break
+            res.append(entry)
+    return res
+
+
+def readfastq_parallel(
+        filename: str, fbufsize: int,
+        entryfunc: typing.Callable[[bytes, array, int], tuple] = entryfunc,
+        entrypos: typing.Callable[[bytes, array, int], int] = entrypos,
+        processes: typing.Optional[int] = None,
+        shardsize: int = 2**26,
+        ordered: bool = True
+) -> typing.Iterator[EntryType]:
+    """Iterate through entries in an uncompressed FASTQ file using
+    several processes.
+
+    :param filename: path to an uncompressed FASTQ file
+    :param fbufsize: buffer size (see :func:`readfastq_iter`)
+    :param entryfunc: a function to build an entry object
+      (see :func:`readfastq_iter`)
+    :param entrypos: a function to find positions of entries
+      (see :func:`readfastq_iter`)
+    :param processes: number of worker processes (`None` for the number
+      of CPUs)
+    :param shardsize: size in bytes of the ranges of the file parsed by
+      workers.
+    :param ordered: whether entries are returned in the order they are in
+      the file, or in the order the shards are done being parsed.
+
+    :returns: An iterator over entries in the FASTQ file.
+
+    The file is split into byte ranges of size `shardsize` (shards), and each
+    worker parses the entries beginning in a range (see
+    :func:`entryboundary`). `entryfunc` and `entrypos` must be picklable
+    (e.g., defined at the level of a module), and positions passed to
+    `entryfunc` are relative to the beginning of the file. Since entries
+    are sent back from the workers, an `entryfunc` returning only what is
+    needed (e.g., filtering entries out) will scale better with the number
+    of processes. Multi-line FASTQ files are not supported.
+    """
+    size = os.path.getsize(filename)
+    shards = [(filename, start, min(start + shardsize, size),
+               fbufsize, entryfunc, entrypos)
+              for start in range(0, size, shardsize)]
+    with multiprocessing.Pool(processes) as pool:
+        if ordered:
+            it = pool.imap(_readfastq_shard, shards)
+        else:
+            it = pool.imap_unordered(_readfastq_shard, shards)
+        for entries in it:
+            yield from entries
+
+
+class _BlockReader(io.BufferedIOBase):
+    """Stream serving data from a sequence of blocks.
+
+    Child classes implement the method `_getblock`, returning the next block
+    (or `b''` when there are no more blocks).
+    """
+
+    def __init__(self):
+        self._block = b''
+        self._blockpos = 0
+        self._eof = False
+
+    def _getblock(self) -> bytes:
+        raise NotImplementedError()
+
+    def _nextblock(self) -> bool:
+        if self._eof:
+            return False
+        try:
+            block = self._getblock()
+        except BaseException:
+            self._eof = True
+            raise
+        if not block:
+            self._eof = True
+            return False
+        self._block = block
+        self._blockpos = 0
+        return True
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        with memoryview(b) as mb, mb.cast('B') as mview:
+            n = 0
+            size = len(mview)
+            while n < size:
+                avail = len(self._block) - self._blockpos
+                if avail == 0:
+                    if not self._nextblock():
+                        break
+                    continue
+                k = min(avail, size - n)
+                with memoryview(self._block) as mblock:
+                    mview[n:(n+k)] = mblock[self._blockpos:(self._blockpos+k)]
+                self._blockpos += k
+                n += k
+        return n
+
+    def read(self, size: typing.Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            size = -1
+        pieces = list()
+        n = 0
+        while size == -1 or n < size:
+            avail = len(self._block) - self._blockpos
+            if avail == 0:
+                if not self._nextblock():
+                    break
+                continue
+            if size == -1:
+                k = avail
+            else:
+                k = min(avail, size - n)
+            if self._blockpos == 0 and k == len(self._block):
+                pieces.append(self._block)
+            else:
+                pieces.append(self._block[self._blockpos:(self._blockpos+k)])
+            self._blockpos += k
+            n += k
+        if len(pieces) == 1:
+            return pieces[0]
+        else:
+            return b''.join(pieces)
+
+
+class ReadAheadReader(_BlockReader):
+    """Stream reading ahead from another stream on a background thread.
+
+    :param fh: file-like object or stream (just needs a method `read`)
+    :param blocksize: size of the blocks read from `fh`
+    :param nblocks: maximum number of blocks read ahead
+
+    Blocks are read from `fh` by a producer thread into a bounded queue.
+    When `fh` is decompressing data (e.g., with :mod:`gzip`, :mod:`bz2`,
+    or :mod:`lzma`, which release the GIL while they work), decompressing
+    the next blocks happens while the current one is being parsed.
+    Closing the reader closes `fh`.
+    """
+
+    def __init__(self, fh: typing.BinaryIO, blocksize: int = 2**20,
+                 nblocks: int = 4):
+        super().__init__()
+        self._fh = fh
+        self._blocksize = blocksize
+        self._queue: queue.Queue = queue.Queue(maxsize=nblocks)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._readblocks, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> None:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _readblocks(self) -> None:
+        try:
+            while not self._stop.is_set():
+                block = self._fh.read(self._blocksize)
+                self._put(block)
+                if not block:
+                    break
+        except BaseException as e:
+            self._put(e)
+
+    def _getblock(self) -> bytes:
+        block = self._queue.get()
+        if isinstance(block, BaseException):
+            raise block
+        return block
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._fh.close()
+        super().close()
+
+
+BGZF_HEADER: bytes = b'\x1f\x8b\x08\x04'
+
+
+def _bgzf_blocksize(header: bytes, extra: bytes) -> int:
+    """Size of a BGZF block given its header and extra field, or -1."""
+    if len(header) < 12 or header[:4] != BGZF_HEADER:
+        return -1
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack_from('<H', extra, i+2)[0]
+        if extra[i:(i+2)] == b'BC' and slen == 2 and i + 6 <= len(extra):
+            return struct.unpack_from('<H', extra, i+4)[0] + 1
+        i += 4 + slen
+    return -1
+
+
+def isbgzf(fh: typing.BinaryIO) -> bool:
+    """Test whether a seekable stream has BGZF-compressed data.
+
+    BGZF files (e.g., written by `bgzip`) are gzip files made of
+    concatenated gzip members (blocks) with the size of the block
+    in the extra field of the gzip header.
+
+    :param fh: seekable file-like object or stream
+    :return: Whether the data at the current position is a BGZF block.
+    """
+    pos = fh.tell()
+    try:
+        header = fh.read(12)
+        if len(header) < 12:
+            return False
+        xlen = struct.unpack_from('<H', header, 10)[0]
+        extra = fh.read(xlen)
+        return _bgzf_blocksize(header, extra) != -1
+    finally:
+        fh.seek(pos)
+
+
+def _bgzf_inflate(block: bytes) -> bytes:
+    """Decompress a BGZF block (without its header and extra field)."""
+    crc, isize = struct.unpack_from('<II', block, len(block) - 8)
+    with memoryview(block) as mblock:
+        data = zlib.decompress(mblock[:-8], wbits=-15)
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise ValueError('Corrupted BGZF block.')
+    return data
+
+
+class BgzfReader(_BlockReader):
+    """Stream decompressing BGZF data with a pool of threads.
+
+    :param fh: file-like object or stream with BGZF-compressed data
+    :param threads: number of threads decompressing blocks (`None` for
+      the number of CPUs)
+    :param nblocks: maximum number of blocks being decompressed ahead
+      (`None` for 4 times the number of threads)
+
+    Compressed blocks are read in order from `fh` and decompressed
+    concurrently (:mod:`zlib` releases the GIL while it works). The
+    decompressed data is served in order, and can be parsed with
+    :func:`readfastq_iter` like any other stream. Closing the reader
+    closes `fh`.
+    """
+
+    def __init__(self, fh: typing.BinaryIO,
+                 threads: typing.Optional[int] = None,
+                 nblocks: typing.Optional[int] = None):
+        super().__init__()
+        if threads is None:
+            threads = os.cpu_count() or 1
+        if nblocks is None:
+            nblocks = 4 * threads
+        self._fh = fh
+        self._nblocks = nblocks
+        self._executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self._pending: deque = deque()
+        self._rawdone = False
+
+    def _readrawblock(self) -> typing.Optional[bytes]:
+        header = self._fh.read(12)
+        if not header:
+            return None
+        if len(header) < 12:
+            raise ValueError('Truncated BGZF block.')
+        xlen = struct.unpack_from('<H', header, 10)[0]
+        extra = self._fh.read(xlen)
+        blocksize = _bgzf_blocksize(header, extra)
+        if blocksize == -1:
+            raise ValueError('Not a BGZF block.')
+        size = blocksize - 12 - xlen
+        block = self._fh.read(size)
+        if len(block) < size:
+            raise ValueError('Truncated BGZF block.')
+        return block
+
+    def _getblock(self) -> bytes:
+        while True:
+            while not self._rawdone and len(self._pending) < self._nblocks:
+                block = self._readrawblock()
+                if block is None:
+                    self._rawdone = True
+                else:
+                    self._pending.append(
+                        self._executor.submit(_bgzf_inflate, block)
+                    )
+            if not self._pending:
+                return b''
+            data = self._pending.popleft().result()
+            # Empty blocks (e.g., the end-of-file marker) are skipped.
+            if data:
+                return data
+
+    def close(self) -> None:
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._fh.close()
+        super().close()
+
+
+def gzip_open(filename, threads: typing.Optional[int] = None,
+              mode: str = 'rb') -> typing.BinaryIO:
+    """Open a gzip-compressed file, BGZF-aware.
+
+    :param filename: A path to a gzip-compressed file.
+    :param threads: number of threads decompressing BGZF blocks
+      (see :class:`BgzfReader`).
+    :param mode: `'rb'` to read, or a mode to write (see :func:`gzip.open`).
+    :returns: A :class:`BgzfReader` if the file is BGZF-compressed,
+      and a :class:`gzip.GzipFile` otherwise.
+    """
+    if mode != 'rb':
+        return gzip.open(filename, mode)
+    fh = open(filename, 'rb')
+    try:
+        bgzf = isbgzf(fh)
+    except BaseException:
+        fh.close()
+        raise
+    if bgzf:
+        return BgzfReader(fh, threads=threads)
+    else:
+        fh.close()
+        return gzip.open(filename, 'rb')
+
+
+def formatentries(entries: typing.Sequence, out: bytearray,
+                  fasta: bool) -> int:
+    """Append FASTQ (or FASTA) entries to a bytearray **in-place**.
+
+    :param entries: A sequence of `(header, sequence, quality)`
+      with bytes-like objects (the header without its leading `@`),
+      for example entries from :func:`readfastq_iter`
+    :param out: A bytearray
+    :param fasta: Write FASTA entries (the qualities are ignored)
+    :return: The number of bytes appended.
+
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.formatentries`.
+    """
+    start = len(out)
+    for entry in entries:
+        if len(entry) < (2 if fasta else 3):
+            raise ValueError('An entry must have a header, a sequence, '
+                             'and a quality.')
+        if fasta:
+            out += b'>'
+            out += entry[0]
+            out += BYTES_NEWLINE
+            out += entry[1]
+            out += BYTES_NEWLINE
+        else:
+            if len(entry[2]) != len(entry[1]):
+                raise ValueError('The sequence and the quality must have '
+                                 'the same length.')
+            out += b'@'
+            out += entry[0]
+            out += BYTES_NEWLINE
+            out += entry[1]
+            out += b'\n+\n'
+            out += entry[2]
+            out += BYTES_NEWLINE
+    return len(out) - start
+
+
+def _entry_untrimmed(buf: bytes, pos: array) -> bool:
+    # Whether the sequence and the quality end at the end of their lines.
+    return pos[3] < len(buf) and buf[pos[3]] == CHAR_NEWLINE and \
+        (pos[5] == len(buf) or buf[pos[5]] == CHAR_NEWLINE)
+
+
+def copyentries(buf: bytes, positions: array, count: int,
+                keep: typing.Optional[bytes], out: bytearray,
+                fasta: bool) -> int:
+    """Append FASTQ entries in a buffer to a bytearray **in-place**.
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Positions for the entries, with 6 positions for
+      each entry (see :func:`readfastq_chunks`)
+    :param count: Number of entries
+    :param keep: `None` (all entries are copied), or a bytes-like object
+      with one byte for each entry (entries with a zero byte are skipped)
+    :param out: A bytearray
+    :param fasta: Write FASTA entries (the qualities are dropped)
+    :return: The number of bytes appended.
+
+    Entries trimmed with :func:`trimentries` are written with a quality
+    header that is just `+`.
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.copyentries`.
+    """
+    if count < 0 or len(positions) < 6 * count or \
+       (keep is not None and len(keep) < count):
+        raise ValueError('The buffers are too small for the number '
+                         'of entries.')
+    for i in range(count):
+        if keep is not None and not keep[i]:
+            continue
+        pos = positions[(6*i):(6*i+6)]
+        if pos[0] < 0 or pos[5] > len(buf) or pos[1] < pos[0] + 1 or \
+           any(pos[j+1] < pos[j] for j in range(1, 5)):
+            raise ValueError('Invalid positions.')
+    start = len(out)
+    with memoryview(buf) as mbuf:
+        for i in range(count):
+            if keep is not None and not keep[i]:
+                continue
+            pos = positions[(6*i):(6*i+6)]
+            if fasta:
+                out += b'>'
+                out += mbuf[(pos[0]+1):pos[1]]
+                out += BYTES_NEWLINE
+                out += mbuf[pos[2]:pos[3]]
+            elif _entry_untrimmed(buf, pos):
+                out += mbuf[pos[0]:pos[5]]
+            else:
+                out += mbuf[pos[0]:pos[3]]
+                out += b'\n+\n'
+                out += mbuf[pos[4]:pos[5]]
+            out += BYTES_NEWLINE
+    return len(out) - start
+
+
+class WriteBehindWriter(io.BufferedIOBase):
+    """Stream writing to another stream on a background thread.
+
+    :param fh: file-like object or stream (just needs methods `write`
+      and `close`)
+    :param nblocks: maximum number of blocks waiting to be written
+
+    Blocks are written to `fh` by a consumer thread from a bounded queue.
+    When `fh` is compressing data (e.g., with :mod:`gzip`, :mod:`bz2`,
+    or :mod:`lzma`, which release the GIL while they work), compressing
+    the blocks happens while the next ones are being produced.
+    Closing the writer closes `fh`.
+    """
+
+    def __init__(self, fh: typing.BinaryIO, nblocks: int = 4):
+        super().__init__()
+        self._fh = fh
+        self._queue: queue.Queue = queue.Queue(maxsize=nblocks)
+        self._error: typing.Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._writeblocks,
+                                        daemon=True)
+        self._thread.start()
+
+    def _writeblocks(self) -> None:
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            if self._error is None:
+                try:
+                    self._fh.write(block)
+                except BaseException as e:
+                    self._error = e
+
+    def _raise(self) -> None:
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        self._raise()
+        # The caller can reuse `b` as soon as this returns.
+        block = bytes(b)
+        self._queue.put(block)
+        return len(block)
+
+    def close(self) -> None:
+        if not self.closed:
+            self._queue.put(None)
+            self._thread.join()
+            self._fh.close()
+            super().close()
+            self._raise()
+
+
+class FastqWriter(object):
+    """Writer for FASTQ (or FASTA) entries, gathering them into large
+    buffers.
+
+    :param fh: file-like object or stream (just needs methods `write`
+      and `close`), for example from :func:`automagic_open`
+    :param bufsize: size of the buffer before it is written to `fh`
+    :param fasta: write FASTA entries
+    :param formatentries: A function to format entries
+      (see :func:`formatentries`)
+    :param copyentries: A function to copy entries in a buffer
+      (see :func:`copyentries`)
+
+    Entries are appended to a buffer, written to `fh` with one call to
+    its method `write` each time it is larger than `bufsize`. Entries
+    are either written as `(header, sequence, quality)` with
+    :meth:`write` and :meth:`writeentries`, or copied from chunks of
+    entries (see :func:`readfastq_chunks`) without building Python
+    objects with :meth:`writechunk`. Closing the writer closes `fh`.
+    """
+
+    def __init__(self, fh: typing.BinaryIO, bufsize: int = 2**20,
+                 fasta: bool = False, formatentries=formatentries,
+                 copyentries=copyentries):
+        self._fh = fh
+        self._bufsize = bufsize
+        self._fasta = fasta
+        self._formatentries = formatentries
+        self._copyentries = copyentries
+        self._buffer = bytearray()
+        self.closed = False
+
+    def _check(self) -> None:
+        if self.closed:
+            raise ValueError('I/O operation on closed writer.')
+        if len(self._buffer) >= self._bufsize:
+            self.flush()
+
+    def write(self, header: bytes, sequence: bytes,
+              quality: typing.Optional[bytes] = None) -> None:
+        """Write an entry (the header without its leading `@`)."""
+        self.writeentries(((header, sequence, quality), ))
+
+    def writeentries(self, entries: typing.Iterable) -> None:
+        """Write entries `(header, sequence, quality)`."""
+        if isinstance(entries, (list, tuple)):
+            self._formatentries(entries, self._buffer, self._fasta)
+            self._check()
+            return
+        batch = list()
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) == 1024:
+                self._formatentries(batch, self._buffer, self._fasta)
+                self._check()
+                batch.clear()
+        self._formatentries(batch, self._buffer, self._fasta)
+        self._check()
+
+    def writechunk(self, chunk: Chunk,
+                   keep: typing.Optional[bytes] = None) -> None:
+        """Write the entries in a chunk.
+
+        :param chunk: A chunk of entries
+          (see :func:`readfastq_chunks`)
+        :param keep: `None` (all entries are written) or a bytes-like
+          object with one byte for each entry in the chunk (entries with
+          a zero byte are skipped)
+        """
+        self._copyentries(chunk.buffer, chunk.positions, chunk.count,
+                          keep, self._buffer, self._fasta)
+        self._check()
+
+    def flush(self) -> None:
+        """Write the buffer to the stream."""
+        if self._buffer:
+            self._fh.write(self._buffer)
+            self._buffer.clear()
+
+    def close(self) -> None:
+        """Write the buffer to the stream and close it."""
+        if not self.closed:
+            try:
+                self.flush()
+            finally:
+                self.closed = True
+                self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+INDEX_MAGIC: bytes = b'FAFINDEX'
+INDEX_VERSION: int = 1
+# magic, version, flags, source size, source mtime (ns), number of entries,
+# CRC32 checksum of the source, reserved.
+INDEX_HEADER = struct.Struct('<8sIIqqqII')
+# The index has a section with the hashes of read names.
+INDEX_FLAG_NAMES: int = 1
+# The FASTQ file is gzip-compressed and the index has a section with
+# checkpoints to decompress from.
+INDEX_FLAG_GZIP: int = 2
+GZIP_MAGIC: bytes = b'\x1f\x8b'
+
+
+def arrayadd_q(a: array, value: int) -> None:
+    """Add an integer to each value in an array of signed 64-bit
+    integers **in-place**.
+
+    An implementation in C is `fastqandfurious._fastqandfurious.arrayadd_q`.
+    """
+    for i in range(len(a)):
+        a[i] += value
+
+
+def namehash(name: bytes) -> int:
+    """Compute a 64-bit hash (FNV-1a) of a read name, that is of the
+    header up to the first space.
+
+    :param name: a bytes-like object (the header or read name)
+
+    An implementation in C is `fastqandfurious._fastqandfurious.namehash`.
+    """
+    h = 0xcbf29ce484222325
+    for c in bytes(name):
+        if c == 32:
+            break
+        h = ((h ^ c) * 0x100000001b3) & 0xffffffffffffffff
+    return h
+
+
+def namehashes_chunk(buf: bytes, positions: array, count: int) -> bytes:
+    """Compute the hashes of the read names of FASTQ entries
+    (see :func:`namehash`).
+
+    :param buf: Buffer with FASTQ data
+    :param positions: Table of 6 positions for each entry in `buf`
+    :param count: Number of entries
+    :return: The hashes as unsigned 64-bit integers in native byte order.
+
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.namehashes_chunk`.
+    """
+    if count < 0 or len(positions) < 6 * count:
+        raise ValueError('The buffers are too small for the number '
+                         'of entries.')
+    with memoryview(buf) as mbuf:
+        return array('Q', (namehash(mbuf[(positions[i]+1):positions[i+1]])
+                           for i in range(0, 6 * count, 6))).tobytes()
+
+
+def sortnamehashes(hashes: array, order: array) -> None:
+    """Sort hashes of read names **in-place**, and store the indices
+    of the entries in the sorted order (ties are in the order of the
+    entries).
+
+    :param hashes: Array of unsigned 64-bit integers
+    :param order: Array of signed 64-bit integers, with the same length
+
+    An implementation in C is
+    `fastqandfurious._fastqandfurious.sortnamehashes`.
+    """
+    if len(hashes) != len(order):
+        raise ValueError('The buffers must have the same number of values.')
+    perm = sorted(range(len(hashes)), key=hashes.__getitem__)
+    order[:] = array('q', perm)
+    hashes[:] = array('Q', (hashes[i] for i in perm))
+
+
+if _fastqandfurious is None:
+    _ARRAYADD_Q = arrayadd_q
+    _NAMEHASH = namehash
+    _NAMEHASHES_CHUNK = namehashes_chunk
+    _SORTNAMEHASHES = sortnamehashes
+else:
+    _ARRAYADD_Q = _fastqandfurious.arrayadd_q
+    _NAMEHASH = _fastqandfurious.namehash
+    _NAMEHASHES_CHUNK = _fastqandfurious.namehashes_chunk
+    _SORTNAMEHASHES = _fastqandfurious.sortnamehashes
+
+
+def _readname(buf, posarray) -> bytes:
+    name = bytes(buf[(posarray[0]+1):posarray[1]])
+    return name.split(b' ', 1)[0]
+
+
+class _Crc32Reader(object):
+    """Stream computing the CRC32 checksum of the data read from another."""
+
+    def __init__(self, fh: typing.BinaryIO):
+        self._fh = fh
+        self.crc32 = 0
+
+    def read(self, size: int = -1) -> bytes:
+        blob = self._fh.read(size)
+        self.crc32 = zlib.crc32(blob, self.crc32)
+        return blob
+
+    def readinto(self, b) -> int:
+        n = self._fh.readinto(b)
+        with memoryview(b) as mb, mb.cast('B') as mview:
+            self.crc32 = zlib.crc32(mview[:n], self.crc32)
+        return n
+
+
+class _GzipScanReader(_BlockReader):
+    """Stream of the data decompressed from gzip-compressed data on
+    a background thread while finding checkpoints (see :func:`build_index`).
+
+    :param cdata: gzip-compressed data
+    :param span: number of decompressed bytes between checkpoints
+    :param nblocks: maximum number of blocks decompressed ahead
+
+    Once all the data was read, `result` has the checkpoints and the
+    CRC32 checksum of `cdata` (see `_fastqandfurious.gzip_scan`).
+    """
+
+    def __init__(self, cdata, span: int, nblocks: int = 4):
+        super().__init__()
+        self.result = None
+        self._queue: queue.Queue = queue.Queue(maxsize=nblocks)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._scan,
+                                        args=(cdata, span), daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> None:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise ValueError('The stream is closed.')
+
+    def _scan(self, cdata, span: int) -> None:
+        try:
+            self.result = _fastqandfurious.gzip_scan(cdata, span, self._put)
+            self._put(b'')
+        except BaseException as e:
+            if not self._stop.is_set():
+                self._put(e)
+
+    def _getblock(self) -> bytes:
+        block = self._queue.get()
+        if isinstance(block, BaseException):
+            raise block
+        return block
+
+    def close(self) -> None:
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+        super().close()
+
+
+def build_index(
+        filename: str, indexfilename: str, fbufsize: int = 2**16,
+        entrypos_batch: typing.Callable[
+            [bytes, int, array], typing.Tuple[int, int, int]
+        ] = entrypos_batch,
+        names: bool = False,
+        namehash: typing.Optional[typing.Callable[[bytes], int]] = None,
+        span: int = 2**22
+) -> int:
+    """Build an index of the positions of entries in an uncompressed
+    or gzip-compressed FASTQ file.
+
+    :param filename: path to an uncompressed or gzip-compressed FASTQ file
+    :param indexfilename: path to the index file to write
+    :param fbufsize: buffer size (see :func:`readfastq_iter`)
+    :param entrypos_batch: a function to find positions of all entries
+      in a buffer (see :func:`readfastq_chunks`)
+    :param names: also index the read names (see :meth:`IndexedFastq.fetch`)
+    :param namehash: a function to compute the hash of a read name
+      (the default is :func:`namehash`, computed for all entries in a
+      chunk at once and in C when the C extension is available)
+    :param span: for gzip-compressed files, the (approximate) number of
+      decompressed bytes between checkpoints
+    :return: The number of entries in the index.
+
+    The index file has a header (see `INDEX_HEADER`) with a magic string,
+    a version number, the size, modification time, and CRC32 checksum of
+    the FASTQ file, followed by a table of 6 absolute positions
+    (signed 64-bit little-endian integers) for each entry (header, sequence,
+    and quality, begin and end). The index can be used with
+    :class:`IndexedFastq`.
+
+    With `names`, the table is followed by the 64-bit hashes of the read
+    names (the header up to the first space) in increasing order (unsigned),
+    and by the indices of the corresponding entries (signed).
+
+    For gzip-compressed files (detected from their content), the positions
+    are in the decompressed data and the checksum is for the compressed
+    file. The index has a section with checkpoints at which decompressing
+    can start (as in `zran.c` in zlib's examples), every `span` bytes of
+    decompressed data: the number of checkpoints, 5 signed integers for each
+    checkpoint (position in the compressed file, number of bits in the
+    byte before it, position in the decompressed data, offset and length
+    of the window), and the windows (up to 32KB of decompressed data before
+    each checkpoint). The file is decompressed once, on a background thread,
+    to find the checkpoints, compute the checksum, and parse the entries.
+    This requires the C extension.
+    """
+    stat = os.stat(filename)
+    with open(filename, 'rb') as fh:
+        isgzip = fh.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+    if isgzip:
+        if _fastqandfurious is None:
+            raise ValueError('Indexing gzip-compressed files requires '
+                             'the C extension.')
+        # The checkpoints, the checksum, and the data to parse all come
+        # from one decompression.
+        mm = _mmap_file(filename)
+        try:
+            with _GzipScanReader(mm, span) as fh:
+                return _build_index(fh, stat, indexfilename, fbufsize,
+                                    entrypos_batch, names, namehash)
+        finally:
+            mm.close()
+    with open(filename, 'rb') as fh:
+        return _build_index(_Crc32Reader(fh), stat, indexfilename, fbufsize,
+                            entrypos_batch, names, namehash)
+
+
+def _build_index(fh, stat: os.stat_result, indexfilename: str,
+                 fbufsize: int, entrypos_batch, names: bool,
+                 namehash) -> int:
+    nentries = 0
+    hashes = array('Q')
+    with open(indexfilename, 'wb') as fh_index:
+        fh_index.write(bytes(INDEX_HEADER.size))
+        for chunk in readfastq_chunks(fh, fbufsize,
+                                      entrypos_batch=entrypos_batch,
+                                      reusebuffer=True):
+            abspos = chunk.positions[:(6*chunk.count)]
+            _ARRAYADD_Q(abspos, chunk.globaloffset)
+            if names and namehash is None:
+                hashes.frombytes(_NAMEHASHES_CHUNK(
+                    chunk.buffer, chunk.positions, chunk.count))
+            elif names:
+                pos = chunk.positions
+                with memoryview(chunk.buffer) as buf:
+                    for i in range(0, len(abspos), 6):
+                        hashes.append(
+                            namehash(buf[(pos[i]+1):pos[i+1]]))
+            if sys.byteorder != 'little':
+                abspos.byteswap()
+            abspos.tofile(fh_index)
+            nentries += chunk.count
+        flags = 0
+        if names:
+            flags |= INDEX_FLAG_NAMES
+            order = array('q', bytes(8 * nentries))
+            _SORTNAMEHASHES(hashes, order)
+            for a in (hashes, order):
+                if sys.byteorder != 'little':
+                    a.byteswap()
+                a.tofile(fh_index)
+        if isinstance(fh, _GzipScanReader):
+            # All the data was read, so the decompression is complete.
+            checkpoints, crc32 = fh.result
+            flags |= INDEX_FLAG_GZIP
+            table = array('q', [len(checkpoints)])
+            woffset = 0
+            for cpos, bits, upos, window in checkpoints:
+                table.extend((cpos, bits, upos, woffset, len(window)))
+                woffset += len(window)
+            if sys.byteorder != 'little':
+                table.byteswap()
+            table.tofile(fh_index)
+            for cpos, bits, upos, window in checkpoints:
+                fh_index.write(window)
+        else:
+            crc32 = fh.crc32
+        fh_index.seek(0)
+        fh_index.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, flags,
+                                         stat.st_size, stat.st_mtime_ns,
+                                         nentries, crc32, 0))
+    return nentries
+
+
+def _mmap_file(filename: str) -> typing.Optional[mmap.mmap]:
+    with open(filename, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _index_table(mindex: memoryview, begin: int, n: int,
+                 typecode: str) -> memoryview:
+    table = mindex[begin:(begin + n * 8)]
+    if sys.byteorder == 'little':
+        res = table.cast(typecode)
+    else:
+        values = array(typecode)
+        values.frombytes(table)
+        values.byteswap()
+        res = memoryview(values)
+    table.release()
+    return res
+
+
+class IndexedFastq(object):
+    """Random access to the entries in an uncompressed or gzip-compressed
+    FASTQ file with an index.
+
+    :param filename: path to an uncompressed or gzip-compressed FASTQ file
+    :param indexfilename: path to an index built with :func:`build_index`
+    :param entryfunc: a function to build an entry object
+      (see :func:`readfastq_iter`)
+    :param check: check that the FASTQ file has the size and
+      modification time recorded in the index
+    :param verify: check that the FASTQ file has the CRC32 checksum
+      recorded in the index (this reads the whole file)
+    :param namehash: a function to compute the hash of a read name
+      (see :func:`namehash`, in C when the C extension is available
+      by default)
+
+    Both the FASTQ file and the index are memory-mapped. Entries are built
+    with `entryfunc` from a :class:`memoryview` on the FASTQ file and the
+    positions in the index, and the default `entryfunc` returns
+    :class:`memoryview` objects (no copy). Getting an entry `i`, a slice
+    of entries, or entries for arbitrary indices (:meth:`take`) does
+    not require parsing.
+
+    For gzip-compressed files, the data for an entry (or for a slice of
+    entries) is decompressed from the nearest checkpoint before it
+    (see :func:`build_index`), and entries are built from :class:`bytes`.
+    Slices of entries can be read concurrently (e.g., in different
+    processes, each with its own :class:`IndexedFastq`) since they
+    do not depend on each other.
+    """
+
+    def __init__(self, filename: str, indexfilename: str,
+                 entryfunc: typing.Callable[
+                     [bytes, array, int], tuple] = entryfunc,
+                 check: bool = True, verify: bool = False,
+                 namehash: typing.Optional[
+                     typing.Callable[[bytes], int]] = None):
+        self._entryfunc = entryfunc
+        self._namehash = _NAMEHASH if namehash is None else namehash
+        self._mm = None
+        self._data = memoryview(b'')
+        self._positions = None
+        self._hashes = None
+        self._order = None
+        self._checkpoints = None
+        self._windows = None
+        self._index_mm = _mmap_file(indexfilename)
+        # Release what is already open if the files cannot be used.
+        try:
+            self._load(filename, check, verify)
+        except BaseException:
+            self.close()
+            raise
+
+    def _load(self, filename: str, check: bool, verify: bool) -> None:
+        if (self._index_mm is None or
+                len(self._index_mm) < INDEX_HEADER.size):
+            raise ValueError('Invalid index file.')
+        (magic, version, flags, size, mtime_ns, nentries, crc,
+         _) = INDEX_HEADER.unpack_from(self._index_mm, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError('Invalid index file.')
+        if version != INDEX_VERSION:
+            raise ValueError('Unsupported index version %i.' % version)
+        tablesize = nentries * 6 * 8
+        if flags & INDEX_FLAG_NAMES:
+            tablesize += nentries * 2 * 8
+        if len(self._index_mm) < INDEX_HEADER.size + tablesize:
+            raise ValueError('Truncated index file.')
+        ncheckpoints = 0
+        if flags & INDEX_FLAG_GZIP:
+            tablesize += 8
+            if len(self._index_mm) < INDEX_HEADER.size + tablesize:
+                raise ValueError('Truncated index file.')
+            ncheckpoints = struct.unpack_from(
+                '<q', self._index_mm, INDEX_HEADER.size + tablesize - 8)[0]
+            tablesize += ncheckpoints * 5 * 8
+            if len(self._index_mm) < INDEX_HEADER.size + tablesize:
+                raise ValueError('Truncated index file.')
+        stat = os.stat(filename)
+        if check and (stat.st_size != size or stat.st_mtime_ns != mtime_ns):
+            raise ValueError('The index does not match the file %s.' %
+                             filename)
+        self._mm = _mmap_file(filename)
+        if self._mm is not None:
+            self._data = memoryview(self._mm)
+        if verify and zlib.crc32(self._data) != crc:
+            raise ValueError('The index does not match the file %s '
+                             '(different checksum).' % filename)
+        self.flags = flags
+        self._nentries = nentries
+        with memoryview(self._index_mm) as mindex:
+            begin = INDEX_HEADER.size
+            self._positions = _index_table(mindex, begin, nentries * 6, 'q')
+            begin += nentries * 6 * 8
+            if flags & INDEX_FLAG_NAMES:
+                self._hashes = _index_table(mindex, begin, nentries, 'Q')
+                begin += nentries * 8
+                self._order = _index_table(mindex, begin, nentries, 'q')
+                begin += nentries * 8
+            if flags & INDEX_FLAG_GZIP:
+                if _fastqandfurious is None:
+                    raise ValueError('Reading gzip-compressed files with '
+                                     'an index requires the C extension.')
+                begin += 8
+                self._checkpoints = _index_table(mindex, begin,
+                                                 ncheckpoints * 5, 'q')
+                self._upos = array('q', self._checkpoints[2::5])
+                self._windows = mindex[(begin + ncheckpoints * 5 * 8):]
+
+    @property
+    def positions(self) -> memoryview:
+        """Table of positions (6 for each entry)."""
+        return self._positions
+
+    def __len__(self) -> int:
+        return self._nentries
+
+    def _extract(self, begin: int, end: int) -> bytes:
+        """Decompress the data between 2 positions (gzip only)."""
+        k = bisect.bisect_right(self._upos, begin) - 1
+        if k < 0:
+            return _fastqandfurious.gzip_extract(self._data, 0, 0, None,
+                                                 begin, end - begin)
+        cpos, bits, upos, woffset, wlen = self._checkpoints[(5*k):(5*k+5)]
+        return _fastqandfurious.gzip_extract(
+            self._data, cpos, bits, self._windows[woffset:(woffset+wlen)],
+            begin - upos, end - begin)
+
+    def _entries(self, start: int, stop: int) -> list:
+        if self._checkpoints is None:
+            return [self._entry(j) for j in range(start, stop)]
+        if start >= stop:
+            return []
+        # Decompress the data for all the entries at once.
+        begin = self._positions[6*start]
+        data = self._extract(begin, self._positions[6*stop-1])
+        return [self._entryfunc(data,
+                                array('q', (x - begin for x in
+                                            self._positions[(6*j):(6*j+6)])),
+                                begin)
+                for j in range(start, stop)]
+
+    def _records(self, indices: typing.Sequence[int]):
+        """Generate the index, the data, the positions (relative to the
+        data), and the offset of the data for entries with indices in
+        increasing order.
+
+        For gzip-compressed files, the data for all the entries after
+        the same checkpoint is decompressed at once.
+        """
+        positions = self._positions
+        if self._checkpoints is None:
+            for i in indices:
+                yield i, self._data, positions[(6*i):(6*i+6)], 0
+            return
+        upos = self._upos
+        start = 0
+        while start < len(indices):
+            begin = positions[6*indices[start]]
+            k = bisect.bisect_right(upos, begin)
+            stop = start + 1
+            if k < len(upos):
+                while (stop < len(indices) and
+                       positions[6*indices[stop]] < upos[k]):
+                    stop += 1
+            else:
+                stop = len(indices)
+            data = self._extract(begin, positions[6*indices[stop-1]+5])
+            for i in indices[start:stop]:
+                yield (i, data,
+                       array('q', (x - begin for x in
+                                   positions[(6*i):(6*i+6)])),
+                       begin)
+            start = stop
+
+    def _entry(self, i: int):
+        if self._checkpoints is not None:
+            return self._entries(i, i + 1)[0]
+        return self._entryfunc(self._data,
+                               self._positions[(6*i):(6*i+6)], 0)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return self._entries(start, stop)
+            return self.take(range(start, stop, step))
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError('Index out of range.')
+        return self._entry(i)
+
+    def take(self, indices: typing.Iterable[int]) -> list:
+        """Get the entries for a sequence of indices.
+
+        The entries are read in the order of their position in the file.
+        For gzip-compressed files, the data for the entries after the same
+        checkpoint is decompressed at once.
+        """
+        n = len(self)
+        indices = [i + n if i < 0 else i for i in indices]
+        if any(i < 0 or i >= n for i in indices):
+            raise IndexError('Index out of range.')
+        entries = {i: self._entryfunc(data, pos, offset)
+                   for i, data, pos, offset in
+                   self._records(sorted(set(indices)))}
+        return [entries[i] for i in indices]
+
+    def _records_named(self, names: typing.Iterable[bytes]):
+        if self._hashes is None:
+            raise ValueError('The index does not have read names.')
+        names = set(bytes(name).split(b' ', 1)[0] for name in names)
+        hashes = self._hashes
+        indices = set()
+        for name in names:
+            h = self._namehash(name)
+            i = bisect.bisect_left(hashes, h)
+            while i < len(hashes) and hashes[i] == h:
+                indices.add(self._order[i])
+                i += 1
+        # Different names can have the same hash: check the names in
+        # the data for the entries, read in the order of their position.
+        return [(i, data, pos, offset)
+                for i, data, pos, offset in self._records(sorted(indices))
+                if _readname(data, pos) in names]
+
+    def lookup(self, name: bytes) -> typing.List[int]:
+        """Get the indices of the entries with a read name.
+
+        :param name: a read name (the header up to the first space)
+        :return: The indices, in increasing order, of the entries
+          with that name (an empty list if there are none).
+
+        The index must have been built with names
+        (see :func:`build_index`).
+        """
+        return [i for i, data, pos, offset in self._records_named((name,))]
+
+    def fetch(self, names: typing.Iterable[bytes]) -> list:
+        """Get the entries for read names.
+
+        :param names: read names (the header up to the first space)
+        :return: A list of entries, in the order they are in the file.
+          Names not found are ignored.
+
+        The candidate entries for all the names are read once, in the order
+        of their position in the file to make the access to it sequential.
+        """
+        return [self._entryfunc(data, pos, offset)
+                for i, data, pos, offset in self._records_named(names)]
+
+    def close(self) -> None:
+        """Close the index and the FASTQ file.
+
+        The memory-mapping of the FASTQ file stays open as long as
+        entries referring to it exist.
+        """
+        for table in (self._positions, self._hashes, self._order,
+                      self._checkpoints, self._windows):
+            if table is not None:
+                table.release()
+        self._data.release()
+        for mm in (self._mm, self._index_mm):
+            if mm is not None:
+                try:
+                    mm.close()
+                except BufferError:
+                    pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 FORMAT_OPENERS: typing.Dict[
     str,
     typing.Tuple[typing.Union[str, object], str, list]] = {
-    'gz': ('gzip', 'open', list()),
-    'gzip': ('gzip', 'open', list()),
+    'gz': (__name__, 'gzip_open', list()),
+    'gzip': (__name__, 'gzip_open', list()),
     'bz2': ('bz2', 'open', list()),
     'lzma': ('lzma', 'open', list())
 }
@@ -291,7 +3498,10 @@ FORMAT_OPENERS: typing.Dict[
 
 def automagic_open(
         filename,
-        openers: typing.Dict[str, typing.Tuple[str, str, list]] = None
+        openers: typing.Dict[str, typing.Tuple[str, str, list]] = None,
+        readahead: int = 0,
+        mode: str = 'rb',
+        writebehind: int = 0
 ) -> typing.BinaryIO:
     """Automagic file opener.
 
@@ -303,6 +3513,15 @@ def automagic_open(
       in the module, and tuple with unnamed parameters for the class/function).
       If `None` the module-level object `FORMAT_OPENERS` is used.
       See details below.
+    :param readahead: Number of blocks to read ahead (and decompress) on
+      a background thread (see :class:`ReadAheadReader`). No reading
+      ahead if 0.
+    :param mode: `'rb'` to read, or a mode to write (for example `'wb'`).
+      The mode is passed to the opener as a named parameter `mode`
+      when not `'rb'`.
+    :param writebehind: Number of blocks to write (and compress) on a
+      background thread when writing (see :class:`WriteBehindWriter`).
+      No writing behind if 0.
     :returns: A stream object returned by the opener found to
       match `filename`.
 
@@ -316,19 +3535,29 @@ def automagic_open(
     standard lib should be understood by default (gzip, lzma, bz2)
     but it is easy to add additional compression schemes.
     """
+    if openers is None:
+        openers = FORMAT_OPENERS
     maybe_ext = filename.rsplit(os.path.extsep, maxsplit=1)
     if len(maybe_ext) == 1:
         # No extension
         ext = None
     else:
         ext = maybe_ext[-1]
+    kwargs = dict() if mode == 'rb' else {'mode': mode}
     try:
-        modulename, funcname, args = FORMAT_OPENERS[ext]
+        modulename, funcname, args = openers[ext]
     except KeyError:
-        modulename, funcname, args = ('io', 'open', ('rb', ))
+        modulename, funcname, args = ('io', 'open', ())
+        kwargs = {'mode': mode}
     if isinstance(modulename, str):
-        module = importlib.importmodule(modulename)
+        module = importlib.import_module(modulename)
     else:
         module = modulename
     opener = getattr(module, funcname)
-    return opener(filename, *args)
+    fh = opener(filename, *args, **kwargs)
+    if mode == 'rb':
+        if readahead:
+            fh = ReadAheadReader(fh, nblocks=readahead)
+    elif writebehind:
+        fh = WriteBehindWriter(fh, nblocks=writebehind)
+    return fh
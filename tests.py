@@ -1,8 +1,14 @@
 import pytest
+import asyncio
 from array import array
 import enum
+import gzip
+import io
+import random
+import struct
 import textwrap
 from fastqandfurious import fastqandfurious, _fastqandfurious
+import zlib
 from Bio import SeqIO
 
 HEADER = 'foo#2'
@@ -81,7 +87,8 @@ def test_parseentry(func, entries_tpl, status, test_sequence, test_quality):
 
 
 @pytest.mark.parametrize('func',
-                         (fastqandfurious.entrypos_fasta,))
+                         (fastqandfurious.entrypos_fasta,
+                          _fastqandfurious.entrypos_fasta))
 @pytest.mark.parametrize(
     'entries_tpl,status,test_sequence',
     ((ENTRIES_FA_TPL.NOTFINAL.value, fastqandfurious.COMPLETE, SEQUENCE),
@@ -91,7 +98,7 @@ def test_parseentry(func, entries_tpl, status, test_sequence, test_quality):
      (ENTRIES_FA_TPL.NOSEQ.value, fastqandfurious.MISSING_SEQ_BEG, ''),
     )
 )
-def test_parseentry(func, entries_tpl, status, test_sequence):
+def test_parseentry_fasta(func, entries_tpl, status, test_sequence):
     entries = entries_tpl.format(header=HEADER,
                                  sequence=test_sequence).encode('ascii')
     posbuffer = array('q', [-1, ] * 6)
@@ -107,6 +114,22 @@ def test_parseentry(func, entries_tpl, status, test_sequence):
     assert sequence == test_sequence.encode('ascii')
 
 
+@pytest.mark.parametrize('func',
+                         (fastqandfurious.entryfunc_fasta_unwrap,
+                          _fastqandfurious.entryfunc_fasta_unwrap))
+@pytest.mark.parametrize('test_sequence', (SEQUENCE, MLINE_SEQUENCE))
+def test_entryfunc_fasta_unwrap(func, test_sequence):
+    entries = ENTRIES_FA_TPL.NOTFINAL.value.format(
+        header=HEADER,
+        sequence=test_sequence).encode('ascii')
+    posbuffer = array('q', [-1, ] * 6)
+    res_status = _fastqandfurious.entrypos_fasta(entries, 0, posbuffer)
+    assert res_status == fastqandfurious.COMPLETE
+    header, sequence = func(entries, posbuffer, 0)
+    assert header == HEADER.encode('ascii')
+    assert sequence == test_sequence.replace('\n', '').encode('ascii')
+
+
 @pytest.mark.parametrize(
     'func',
     (fastqandfurious.entrypos, 
@@ -224,3 +247,1449 @@ def _test_readfastq_abspos(filename, bufsize, entrypos,
 def test_readfastq_abspos(filename, fixmultiline, bufsize):
     _test_readfastq_abspos(filename, bufsize, fastqandfurious.entrypos,
                            fixmultiline=fixmultiline)
+
+
+@pytest.mark.parametrize('func',
+                         (fastqandfurious.entrypos_batch,
+                          _fastqandfurious.entrypos_batch))
+@pytest.mark.parametrize('nrows', (1, 2, 10))
+def test_entrypos_batch(func, nrows):
+    entries = ('\n' + ''.join(
+        '@{header}_{i}\n{sequence}\n+\n{quality}\n'.format(
+            header=HEADER, i=i, sequence=SEQUENCE, quality=QUALITY)
+        for i in range(5))).encode('ascii')
+    posarray = array('q', [-1, ] * (6 * nrows))
+    count, offset, status = func(entries, 0, posarray)
+    # The last entry is not followed by a header and can't be known
+    # to be complete.
+    assert count == min(nrows, 4)
+    if nrows > 4:
+        assert status == fastqandfurious.MISSING_QUAL_END
+    else:
+        assert status == fastqandfurious.COMPLETE
+    posbuffer = array('q', [-1, ] * 6)
+    offset_ref = 0
+    for i in range(count):
+        assert fastqandfurious.entrypos(entries, offset_ref,
+                                        posbuffer) == fastqandfurious.COMPLETE
+        assert posarray[(6*i):(6*i+6)] == posbuffer
+        offset_ref = posbuffer[-1]-1
+    assert offset == offset_ref
+
+
+@pytest.mark.parametrize('filename',
+                         ('data/test.fq',
+                          'data/test_longqualityheader.fq',
+                          'data/test_multiline.fq'))
+@pytest.mark.parametrize('func',
+                         (fastqandfurious.entrypos_batch,
+                          _fastqandfurious.entrypos_batch))
+@pytest.mark.parametrize('bufsize', (100, 200, 600, 700))
+@pytest.mark.parametrize('reusebuffer', (False, True))
+def test_readfastq_chunks(filename, func, bufsize, reusebuffer):
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, bufsize))
+    res = list()
+    with open(filename, 'rb') as fh:
+        for chunk in fastqandfurious.readfastq_chunks(
+                fh, bufsize,
+                entrypos_batch=func,
+                reusebuffer=reusebuffer
+        ):
+            table = memoryview(chunk.positions)
+            for i in range(chunk.count):
+                res.append(
+                    fastqandfurious.entryfunc(chunk.buffer,
+                                              table[(6*i):(6*i+6)],
+                                              chunk.globaloffset)
+                )
+    assert res == entries
+
+
+@pytest.mark.parametrize('filename',
+                         ('data/test.fq',
+                          'data/test_longqualityheader.fq',
+                          'data/test_multiline.fq'))
+@pytest.mark.parametrize('func',
+                         (fastqandfurious.entrypos,
+                          _fastqandfurious.entrypos))
+@pytest.mark.parametrize('bufsize', (50, 100, 200, 600, 700))
+def test_readfastq_iter_reusebuffer(filename, func, bufsize):
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, bufsize))
+    with open(filename, 'rb') as fh:
+        res = list(fastqandfurious.readfastq_iter(fh, bufsize,
+                                                  entrypos=func,
+                                                  reusebuffer=True))
+    assert res == entries
+
+
+@pytest.mark.parametrize(
+    'bufsize,leftover,shrink,expected',
+    ((100, 10, True, 100),
+     (100, 60, True, 200),
+     (400, 10, True, 100),
+     (400, 10, False, 400),
+     (400, 80, True, 400)))
+def test_nextbufsize(bufsize, leftover, shrink, expected):
+    assert fastqandfurious.nextbufsize(bufsize, leftover, 100,
+                                       shrink=shrink) == expected
+
+
+@pytest.mark.parametrize('func',
+                         (fastqandfurious.entrypos,
+                          _fastqandfurious.entrypos))
+@pytest.mark.parametrize('bufsize', (10, 100, 1000))
+@pytest.mark.parametrize('reusebuffer', (False, True))
+@pytest.mark.parametrize('shrinkbuffer', (False, True))
+def test_readfastq_iter_longentries(func, bufsize, reusebuffer, shrinkbuffer):
+    data = b''.join(
+        b'@read_%i\n%s\n+\n%s\n' % (i, b'A' * n, b'I' * n)
+        for i, n in enumerate((30, 30, 5000, 30, 20000, 30, 30))
+    )
+    res = list(fastqandfurious.readfastq_iter(io.BytesIO(data), bufsize,
+                                              entrypos=func,
+                                              reusebuffer=reusebuffer,
+                                              shrinkbuffer=shrinkbuffer))
+    assert [len(sequence) for header, sequence, quality in res] == \
+        [30, 30, 5000, 30, 20000, 30, 30]
+    assert res[4] == (b'read_4', b'A' * 20000, b'I' * 20000)
+
+
+@pytest.mark.parametrize('func',
+                         (fastqandfurious.entryfunc_unwrap,
+                          _fastqandfurious.entryfunc_unwrap))
+@pytest.mark.parametrize('filename',
+                         ('data/test.fq', 'data/test_multiline.fq'))
+def test_readfastq_unwrap(filename, func):
+    with open(filename, 'rb') as fh, open(filename, 'rt') as fh_bp:
+        entry_iter = zip(fastqandfurious.readfastq_iter(fh, 100,
+                                                        entryfunc=func),
+                         SeqIO.parse(fh_bp, "fastq"))
+        for (header, sequence, quality), entry_bp in entry_iter:
+            assert header == entry_bp.description.encode('ascii')
+            assert sequence == str(entry_bp.seq).encode('ascii')
+            assert len(quality) == len(sequence)
+
+
+@pytest.mark.parametrize('filename',
+                         ('data/test.fq', 'data/test_longqualityheader.fq'))
+def test_entryboundary(filename):
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+        headers = [pos[0] for pos in
+                   fastqandfurious.readfastq_iter(
+                       io.BytesIO(data), 1000,
+                       entryfunc=fastqandfurious.entryfunc_abspos)]
+        for start in range(len(data)):
+            expected = min([x for x in headers if x >= start],
+                           default=len(data))
+            assert fastqandfurious.entryboundary(fh, start,
+                                                 fbufsize=16) == expected
+
+
+@pytest.mark.parametrize('filename',
+                         ('data/test.fq', 'data/test_longqualityheader.fq'))
+@pytest.mark.parametrize('shardsize', (7, 100, 2**20))
+@pytest.mark.parametrize('ordered', (True, False))
+def test_readfastq_parallel(filename, shardsize, ordered):
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, 1000))
+    res = list(fastqandfurious.readfastq_parallel(
+        filename, 100,
+        entrypos=_fastqandfurious.entrypos,
+        processes=2, shardsize=shardsize, ordered=ordered))
+    if ordered:
+        assert res == entries
+    else:
+        assert sorted(res) == sorted(entries)
+
+
+def test_readfastq_parallel_abspos():
+    filename = 'data/test.fq'
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+    entries = list(fastqandfurious.readfastq_iter(io.BytesIO(data), 1000))
+    res = fastqandfurious.readfastq_parallel(
+        filename, 100,
+        entryfunc=fastqandfurious.entryfunc_abspos,
+        processes=2, shardsize=50)
+    assert [data[(pos[0]+1):pos[1]] for pos in res] == \
+        [header for header, sequence, quality in entries]
+
+
+def test_readaheadreader():
+    with open('data/test.fq', 'rb') as fh:
+        data = fh.read() * 10
+    chunks = list()
+    with fastqandfurious.ReadAheadReader(io.BytesIO(data),
+                                         blocksize=37, nblocks=2) as fh:
+        for size in (1, 100, 36, 37, 38, 500):
+            chunks.append(fh.read(size))
+        buf = bytearray(77)
+        n = fh.readinto(buf)
+        chunks.append(bytes(buf[:n]))
+        chunks.append(fh.read())
+        assert fh.read(10) == b''
+    assert b''.join(chunks) == data
+
+
+def test_readaheadreader_error():
+
+    class FailingStream(io.BytesIO):
+        def read(self, size=-1):
+            raise IOError('Failing stream.')
+
+    with fastqandfurious.ReadAheadReader(FailingStream()) as fh:
+        with pytest.raises(IOError):
+            fh.read(10)
+
+
+@pytest.mark.parametrize('readahead', (0, 2))
+@pytest.mark.parametrize('reusebuffer', (False, True))
+def test_automagic_open(tmp_path, readahead, reusebuffer):
+    filename = 'data/test.fq'
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+        entries = list(fastqandfurious.readfastq_iter(io.BytesIO(data), 100))
+    gzfilename = str(tmp_path / 'test.fq.gz')
+    with gzip.open(gzfilename, 'wb') as fh:
+        fh.write(data)
+    with fastqandfurious.automagic_open(gzfilename,
+                                        readahead=readahead) as fh:
+        res = list(fastqandfurious.readfastq_iter(fh, 100,
+                                                  reusebuffer=reusebuffer))
+    assert res == entries
+
+
+def _bgzf_block(data):
+    compressor = zlib.compressobj(wbits=-15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4sIBBH2sHH', b'\x1f\x8b\x08\x04', 0, 0, 255,
+                         6, b'BC', 2, 12 + 6 + len(cdata) + 8 - 1)
+    return header + cdata + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+@pytest.mark.parametrize('blocksize', (50, 1000, 2**16))
+@pytest.mark.parametrize('threads', (1, 3))
+def test_bgzfreader(tmp_path, blocksize, threads):
+    with open('data/test.fq', 'rb') as fh:
+        data = fh.read() * 5
+    entries = list(fastqandfurious.readfastq_iter(io.BytesIO(data), 100))
+    filename = str(tmp_path / 'test.fq.gz')
+    with open(filename, 'wb') as fh:
+        for i in range(0, len(data), blocksize):
+            fh.write(_bgzf_block(data[i:(i+blocksize)]))
+        fh.write(_bgzf_block(b''))
+    with open(filename, 'rb') as fh:
+        assert fastqandfurious.isbgzf(fh)
+        assert fh.tell() == 0
+    # gzip can read BGZF files.
+    with gzip.open(filename, 'rb') as fh:
+        assert fh.read() == data
+    with fastqandfurious.gzip_open(filename, threads=threads) as fh:
+        assert isinstance(fh, fastqandfurious.BgzfReader)
+        res = list(fastqandfurious.readfastq_iter(fh, 100))
+    assert res == entries
+
+
+def test_bgzfreader_corrupted():
+    block = bytearray(_bgzf_block(b'@foo\nACGT\n+\nIIII\n'))
+    block[-5] ^= 0xff
+    with fastqandfurious.BgzfReader(io.BytesIO(bytes(block))) as fh:
+        with pytest.raises(ValueError):
+            fh.read()
+
+
+def test_gzip_open_notbgzf(tmp_path):
+    filename = str(tmp_path / 'test.fq.gz')
+    with gzip.open(filename, 'wb') as fh:
+        fh.write(b'@foo\nACGT\n+\nIIII\n')
+    with open(filename, 'rb') as fh:
+        assert not fastqandfurious.isbgzf(fh)
+    with fastqandfurious.gzip_open(filename) as fh:
+        assert not isinstance(fh, fastqandfurious.BgzfReader)
+        assert fh.read() == b'@foo\nACGT\n+\nIIII\n'
+
+
+@pytest.mark.parametrize(
+    'entrypos_batch',
+    (fastqandfurious.entrypos_batch, _fastqandfurious.entrypos_batch))
+@pytest.mark.parametrize(
+    'filename',
+    ('data/test.fq', 'data/test_longqualityheader.fq'))
+def test_indexedfastq(tmp_path, entrypos_batch, filename):
+    indexfilename = str(tmp_path / 'test.fq.idx')
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, 1000))
+    n = fastqandfurious.build_index(filename, indexfilename, 100,
+                                    entrypos_batch=entrypos_batch)
+    assert n == len(entries)
+    with fastqandfurious.IndexedFastq(filename, indexfilename,
+                                      verify=True) as idx:
+        assert len(idx) == len(entries)
+        assert len(idx.positions) == 6 * len(entries)
+        assert [tuple(bytes(x) for x in e) for e in idx[:]] == entries
+        assert tuple(bytes(x) for x in idx[-1]) == entries[-1]
+        assert [tuple(bytes(x) for x in e) for e in idx[1::2]] == \
+            entries[1::2]
+        assert [tuple(bytes(x) for x in e) for e in idx.take([3, 0])] == \
+            [entries[3], entries[0]]
+        with pytest.raises(IndexError):
+            idx[len(entries)]
+    with fastqandfurious.IndexedFastq(
+            filename, indexfilename,
+            entryfunc=fastqandfurious.entryfunc) as idx:
+        assert idx[2] == entries[2]
+
+
+def test_indexedfastq_invalid(tmp_path):
+    filename = str(tmp_path / 'test.fq')
+    indexfilename = str(tmp_path / 'test.fq.idx')
+    with open('data/test.fq', 'rb') as fh:
+        data = fh.read()
+    with open(filename, 'wb') as fh:
+        fh.write(data)
+    fastqandfurious.build_index(filename, indexfilename)
+    with open(filename, 'ab') as fh:
+        fh.write(b'@foo\nACGT\n+\nIIII\n')
+    with pytest.raises(ValueError):
+        fastqandfurious.IndexedFastq(filename, indexfilename)
+    with open(indexfilename, 'r+b') as fh:
+        fh.write(b'NOTINDEX')
+    with pytest.raises(ValueError):
+        fastqandfurious.IndexedFastq(filename, indexfilename, check=False)
+
+
+
+def test_indexedfastq_invalid_close(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'test.fq')
+    indexfilename = str(tmp_path / 'test.fq.idx')
+    with open('data/test.fq', 'rb') as fh:
+        data = fh.read()
+    with open(filename, 'wb') as fh:
+        fh.write(data)
+    fastqandfurious.build_index(filename, indexfilename)
+    mapped = list()
+
+    def mmap_file(filename):
+        mapped.append(mmap_file_orig(filename))
+        return mapped[-1]
+    mmap_file_orig = fastqandfurious._mmap_file
+    monkeypatch.setattr(fastqandfurious, '_mmap_file', mmap_file)
+    # Different checksum (both files are mapped), then not an index.
+    with open(filename, 'r+b') as fh:
+        fh.write(b'@X')
+    with pytest.raises(ValueError):
+        fastqandfurious.IndexedFastq(filename, indexfilename, check=False,
+                                     verify=True)
+    with open(indexfilename, 'r+b') as fh:
+        fh.write(b'NOTINDEX')
+    with pytest.raises(ValueError):
+        fastqandfurious.IndexedFastq(filename, indexfilename, check=False)
+    assert len(mapped) == 3
+    assert all(mm.closed for mm in mapped)
+
+
+@pytest.mark.parametrize(
+    'arrayadd_q',
+    (fastqandfurious.arrayadd_q, _fastqandfurious.arrayadd_q))
+def test_arrayadd_q(arrayadd_q):
+    a = array('q', [0, -3, 2**40])
+    arrayadd_q(a, 5)
+    assert a == array('q', [5, 2, 2**40 + 5])
+
+
+def test_namehash():
+    for name in (b'', b'DRR013190.3', b'DRR013190.3 G2R504O07INYBX/2'):
+        assert fastqandfurious.namehash(name) == \
+            _fastqandfurious.namehash(name)
+    assert fastqandfurious.namehash(b'a') == 0xaf63dc4c8601ec8c
+    assert fastqandfurious.namehash(b'a b') == fastqandfurious.namehash(b'a')
+
+
+@pytest.mark.parametrize(
+    'namehashes_chunk,sortnamehashes',
+    ((fastqandfurious.namehashes_chunk, fastqandfurious.sortnamehashes),
+     (_fastqandfurious.namehashes_chunk, _fastqandfurious.sortnamehashes)))
+def test_sortnamehashes(namehashes_chunk, sortnamehashes):
+    names = [b'r%i' % (i % 50) for i in range(200)]
+    data = b'\n' + b''.join(b'@%s x\nA\n+\nI\n' % name
+                            for name in names) + b'@x\n'
+    positions = array('q', [0] * 6 * len(names))
+    count, _, _ = _fastqandfurious.entrypos_batch(data, 0, positions)
+    assert count == len(names)
+    hashes = array('Q')
+    hashes.frombytes(namehashes_chunk(data, positions, count))
+    assert list(hashes) == [fastqandfurious.namehash(x) for x in names]
+    expected = sorted(range(count), key=hashes.__getitem__)
+    order = array('q', [0] * count)
+    sortnamehashes(hashes, order)
+    assert list(order) == expected
+    assert list(hashes) == sorted(hashes)
+    with pytest.raises(ValueError):
+        sortnamehashes(hashes, array('q'))
+
+
+@pytest.mark.parametrize(
+    'namehash',
+    (None, fastqandfurious.namehash, _fastqandfurious.namehash))
+def test_indexedfastq_fetch(tmp_path, namehash):
+    filename = 'data/test.fq'
+    indexfilename = str(tmp_path / 'test.fq.idx')
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, 1000))
+    names = [header.split(b' ')[0] for header, sequence, quality in entries]
+    fastqandfurious.build_index(filename, indexfilename, 100,
+                                names=True, namehash=namehash)
+    with fastqandfurious.IndexedFastq(filename, indexfilename,
+                                      namehash=namehash) as idx:
+        assert idx.flags & fastqandfurious.INDEX_FLAG_NAMES
+        for i, name in enumerate(names):
+            assert idx.lookup(name) == [i]
+        assert idx.lookup(b'foo') == []
+        res = idx.fetch([names[3], b'foo', names[1], names[3]])
+        assert [tuple(bytes(x) for x in e) for e in res] == \
+            [entries[1], entries[3]]
+        assert len(idx) == len(entries)
+    # All the names have the same hash.
+    fastqandfurious.build_index(filename, indexfilename, 100,
+                                names=True, namehash=lambda name: 0)
+    with fastqandfurious.IndexedFastq(filename, indexfilename,
+                                      namehash=lambda name: 0) as idx:
+        assert idx.lookup(names[2]) == [2]
+        res = idx.fetch([names[3], b'foo', names[1]])
+        assert [tuple(bytes(x) for x in e) for e in res] == \
+            [entries[1], entries[3]]
+    fastqandfurious.build_index(filename, indexfilename, 100)
+    with fastqandfurious.IndexedFastq(filename, indexfilename) as idx:
+        with pytest.raises(ValueError):
+            idx.lookup(names[0])
+
+
+@pytest.mark.parametrize(
+    'entrypos',
+    (fastqandfurious.entrypos, _fastqandfurious.entrypos))
+@pytest.mark.parametrize(
+    'filename',
+    ('data/test.fq', 'data/test_longqualityheader.fq'))
+def test_readfastq_mmap(entrypos, filename):
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+    entries = list(fastqandfurious.readfastq_iter(io.BytesIO(data), 1000))
+    res = list(fastqandfurious.readfastq_mmap(filename, entrypos=entrypos))
+    assert all(isinstance(x, memoryview) for e in res for x in e)
+    assert [tuple(bytes(x) for x in e) for e in res] == entries
+    res = fastqandfurious.readfastq_mmap(
+        filename,
+        entryfunc=fastqandfurious.entryfunc_abspos,
+        entrypos=entrypos)
+    assert [data[(pos[0]+1):pos[1]] for pos in res] == \
+        [header for header, sequence, quality in entries]
+
+
+@pytest.mark.parametrize(
+    'entrypos',
+    (fastqandfurious.entrypos, _fastqandfurious.entrypos))
+def test_readfastq_mmap_edgecases(tmp_path, entrypos):
+    filename = str(tmp_path / 'test.fq')
+    with open(filename, 'wb') as fh:
+        pass
+    assert list(fastqandfurious.readfastq_mmap(filename,
+                                               entrypos=entrypos)) == []
+    with open(filename, 'wb') as fh:
+        fh.write(b'@foo\nACGT\n+\nIIII\n@bar\nAC\n+\nII')
+    res = fastqandfurious.readfastq_mmap(filename, entrypos=entrypos)
+    assert [tuple(bytes(x) for x in e) for e in res] == \
+        [(b'foo', b'ACGT', b'IIII'), (b'bar', b'AC', b'II')]
+    with open(filename, 'wb') as fh:
+        fh.write(b'@foo\nACGT\n+\nIIII\n@bar\nAC\n+\nI')
+    with pytest.raises(ValueError):
+        list(fastqandfurious.readfastq_mmap(filename, entrypos=entrypos))
+
+
+@pytest.mark.parametrize(
+    'fill_batch',
+    (fastqandfurious.fill_batch, _fastqandfurious.fill_batch))
+def test_fill_batch(fill_batch):
+    buf = b'\n@foo\nACGT\n+\nIIII\n@ba\nAC\n+\n#I\n'
+    positions = array('q', [-1, ] * 12)
+    n, offset, status = fastqandfurious.entrypos_batch(buf, 0, positions)
+    assert n == 1
+    positions[6:] = array('q', [18, 21, 22, 24, 27, 29])
+    sequences = bytearray(b'x' * 6)
+    qualities = bytearray(b'x' * 6)
+    lengths = array('q', [-1, -1])
+    headers = bytearray(5)
+    headeroffsets = array('q', [-1, -1, -1])
+    fill_batch(buf, positions, 2, sequences, qualities, lengths,
+               headers, headeroffsets, 33)
+    assert sequences == b'ACGAC\x00'
+    assert qualities == bytes([40, 40, 40, 2, 40, 0])
+    assert lengths == array('q', [3, 2])
+    assert headers == b'fooba'
+    assert headeroffsets == array('q', [0, 3, 5])
+    with pytest.raises(ValueError):
+        fill_batch(buf, positions, 2, sequences, qualities, lengths,
+                   bytearray(4), headeroffsets, 33)
+
+
+@pytest.mark.parametrize(
+    'fill_batch',
+    (fastqandfurious.fill_batch, _fastqandfurious.fill_batch))
+@pytest.mark.parametrize('maxlen', (None, 0, 50))
+def test_readfastq_numpy(fill_batch, maxlen):
+    numpy = pytest.importorskip('numpy')
+    filename = 'data/test_longqualityheader.fq'
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, 1000))
+    with open(filename, 'rb') as fh:
+        batches = list(fastqandfurious.readfastq_numpy(
+            fh, 200, entrypos_batch=_fastqandfurious.entrypos_batch,
+            fill_batch=fill_batch, maxlen=maxlen))
+    res = list()
+    for batch in batches:
+        assert batch.sequences.dtype == numpy.uint8
+        assert batch.sequences.shape == batch.qualities.shape
+        if maxlen is not None:
+            assert batch.sequences.shape[1] == maxlen
+        for i, length in enumerate(batch.lengths):
+            offsets = batch.headeroffsets[i:(i+2)]
+            res.append((bytes(batch.headers[offsets[0]:offsets[1]]),
+                        bytes(batch.sequences[i, :length]),
+                        bytes(batch.qualities[i, :length] + 33)))
+            assert not batch.sequences[i, length:].any()
+    assert res == [(header, sequence[:maxlen], quality[:maxlen])
+                   for header, sequence, quality in entries]
+    # Batches with only empty sequences.
+    batches = list(fastqandfurious.readfastq_numpy(
+        io.BytesIO(b'@a\n\n+\n\n@b\n\n+\n\n'), 200,
+        fill_batch=fill_batch, maxlen=maxlen))
+    assert len(batches) == 1
+    assert batches[0].sequences.shape == (2, maxlen or 0)
+    assert not batches[0].sequences.any()
+    assert batches[0].lengths.tolist() == [0, 0]
+    assert bytes(batches[0].headers) == b'ab'
+
+
+PACK2BIT_IMPLEMENTATIONS = (
+    (fastqandfurious.pack2bit, fastqandfurious.unpack2bit,
+     fastqandfurious.kmers2bit),
+    (_fastqandfurious.pack2bit, _fastqandfurious.unpack2bit,
+     _fastqandfurious.kmers2bit))
+
+
+@pytest.mark.parametrize('pack2bit,unpack2bit,kmers2bit',
+                         PACK2BIT_IMPLEMENTATIONS)
+def test_pack2bit(pack2bit, unpack2bit, kmers2bit):
+    buf = b'xxACGTNACgTTx'
+    packed = bytearray(4)
+    assert pack2bit(buf, 2, 12, packed, 1) == [(4, ord('N')), (7, ord('g'))]
+    assert pack2bit(buf, 2, 4, packed, 11) is None
+    out = bytearray(10)
+    unpack2bit(packed, 1, 10, out, False)
+    assert out == b'ACGTAACATT'
+    unpack2bit(packed, 1, 10, out, True)
+    assert out == b'AATGTTACGT'
+    kmers = array('Q', [0] * 8)
+    kmers2bit(packed, 1, 10, 3, kmers)
+    assert kmers[0] == 0b000110
+    assert kmers[-1] == 0b001111
+    with pytest.raises(ValueError):
+        pack2bit(buf, 2, 12, packed, 8)
+    with pytest.raises(ValueError):
+        kmers2bit(packed, 1, 10, 33, kmers)
+
+
+@pytest.mark.parametrize(
+    'pack2bit_chunk,unpack2bit_chunk',
+    ((fastqandfurious.pack2bit_chunk, fastqandfurious.unpack2bit_chunk),
+     (_fastqandfurious.pack2bit_chunk, _fastqandfurious.unpack2bit_chunk)))
+def test_pack2bit_chunk(pack2bit_chunk, unpack2bit_chunk):
+    data = b'\n@a\nACGTA\n+\nIIIII\n@b\nCC\n+\nII\n@c\nNNGTRA\n+\nIIIIII\n@x\n'
+    positions = array('q', [0] * 6 * 3)
+    count, _, _ = _fastqandfurious.entrypos_batch(data, 0, positions)
+    assert count == 3
+    packed = bytearray(1)
+    offsets = array('q', [3, 0, 0, 0])
+    assert pack2bit_chunk(data, positions, count, packed, offsets) == \
+        [(10, ord('N')), (11, ord('N')), (14, ord('R'))]
+    assert offsets == array('q', [3, 8, 10, 16])
+    assert len(packed) == 4
+    exception_pos = array('q', [10, 11, 14])
+    assert unpack2bit_chunk(packed, offsets, None, exception_pos,
+                            b'NNR') == [b'ACGTA', b'CC', b'NNGTRA']
+    assert unpack2bit_chunk(packed, offsets, array('q', [-1, 0]),
+                            exception_pos, b'NNR') == [b'NNGTRA', b'ACGTA']
+    with pytest.raises(IndexError):
+        unpack2bit_chunk(packed, offsets, array('q', [3]), exception_pos,
+                         b'NNR')
+    with pytest.raises(ValueError):
+        pack2bit_chunk(data, positions, count, packed, array('q', [0]))
+
+
+@pytest.mark.parametrize('pack2bit,unpack2bit,kmers2bit',
+                         PACK2BIT_IMPLEMENTATIONS)
+@pytest.mark.parametrize(
+    'pack2bit_chunk,unpack2bit_chunk',
+    ((fastqandfurious.pack2bit_chunk, fastqandfurious.unpack2bit_chunk),
+     (_fastqandfurious.pack2bit_chunk, _fastqandfurious.unpack2bit_chunk)))
+def test_packedsequences(pack2bit, unpack2bit, kmers2bit, pack2bit_chunk,
+                         unpack2bit_chunk):
+    with open('data/test.fq', 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, 1000))
+    sequences = [sequence for header, sequence, quality in entries]
+    sequences.extend((b'NACGT', b'TTTT', b'ACNGTRAC'))
+    packedseqs = fastqandfurious.PackedSequences(
+        pack2bit, unpack2bit, kmers2bit, pack2bit_chunk=pack2bit_chunk,
+        unpack2bit_chunk=unpack2bit_chunk)
+    with open('data/test.fq', 'rb') as fh:
+        for chunk in fastqandfurious.readfastq_chunks(fh, 200):
+            packedseqs.extend(chunk)
+    data = b'\n@a\nNACGT\n+\nIIIII\n@b\nTTTT\n+\nIIII\n@x\n'
+    positions = array('q', [0] * 6 * 2)
+    _fastqandfurious.entrypos_batch(data, 0, positions)
+    packedseqs.extend(fastqandfurious.Chunk(data, positions, 2, 0))
+    packedseqs.append(b'@foo\nACNGTRAC\n+\nIIIIIIII\n',
+                      array('q', [0, 4, 5, 13, 16, 24]), 0)
+    assert len(packedseqs) == len(sequences)
+    assert packedseqs.decode() == sequences
+    assert packedseqs[-1] == b'ACNGTRAC'
+    assert packedseqs.decode([1, 0]) == [sequences[1], sequences[0]]
+    assert packedseqs.reverse_complement(-1) == b'GTYACNGT'
+    assert packedseqs.reverse_complement(0) == \
+        sequences[0][::-1].translate(bytes.maketrans(b'ACGTN', b'TGCAN'))
+    assert packedseqs.kmers(-1, 2) == array('Q', [0b0001, 0b1011, 0b0001])
+    assert len(packedseqs.kmers(0, 5)) == len(sequences[0]) - 5 + 1
+    assert packedseqs.nbytes < sum(len(s) for s in sequences)
+    with pytest.raises(IndexError):
+        packedseqs[len(sequences)]
+
+
+@pytest.mark.parametrize(
+    'pyfunc,cfunc',
+    ((fastqandfurious.entryfunc, _fastqandfurious.entryfunc),
+     (fastqandfurious.entryfunc_namedtuple,
+      _fastqandfurious.entryfunc_namedtuple),
+     (fastqandfurious.entryfunc_abspos, _fastqandfurious.entryfunc_abspos),
+     (fastqandfurious.entryfunc_sequence,
+      _fastqandfurious.entryfunc_sequence)))
+@pytest.mark.parametrize('bufsize', (100, 200, 700))
+@pytest.mark.parametrize('reusebuffer', (False, True))
+def test_readfastq_cbuilders(pyfunc, cfunc, bufsize, reusebuffer):
+    with open('data/test.fq', 'rb') as fh:
+        data = fh.read()
+    expected = list(fastqandfurious.readfastq_iter(
+        io.BytesIO(data), bufsize, entryfunc=pyfunc, globaloffset=3))
+    for entrypos in (fastqandfurious.entrypos, _fastqandfurious.entrypos):
+        res = list(fastqandfurious.readfastq_iter(
+            io.BytesIO(data), bufsize, entryfunc=cfunc, entrypos=entrypos,
+            globaloffset=3, reusebuffer=reusebuffer))
+        assert res == expected
+        if pyfunc is fastqandfurious.entryfunc_namedtuple:
+            assert [e.sequence for e in res] == \
+                [e.sequence for e in expected]
+
+
+def test_entrybuild_batch():
+    buf = b'\n@foo\nACGT\n+\nIIII\n@ba\nAC\n+\n#I\n@x'
+    posbuffer = array('q', [-1, ] * 6)
+    entries, offset, status = _fastqandfurious.entrybuild_batch(
+        buf, 0, posbuffer, _fastqandfurious.BUILD_TUPLE, 0)
+    assert entries == [(b'foo', b'ACGT', b'IIII'), (b'ba', b'AC', b'#I')]
+    assert offset == 28
+    assert status == fastqandfurious.MISSING_SEQHEADER_END
+    assert posbuffer[0] == 30
+    with pytest.raises(ValueError):
+        _fastqandfurious.entrybuild_batch(buf, 0, posbuffer, 100, 0)
+
+
+@pytest.mark.parametrize(
+    'func',
+    (fastqandfurious.entryfunc_view, _fastqandfurious.entryfunc_view))
+@pytest.mark.parametrize('bufsize', (100, 700))
+def test_readfastq_view(func, bufsize):
+    with open('data/test.fq', 'rb') as fh:
+        data = fh.read()
+    entries = list(fastqandfurious.readfastq_iter(io.BytesIO(data), bufsize))
+    positions = list(fastqandfurious.readfastq_iter(
+        io.BytesIO(data), bufsize,
+        entryfunc=fastqandfurious.entryfunc_abspos))
+    views = list(fastqandfurious.readfastq_iter(
+        io.BytesIO(data), bufsize, entryfunc=func,
+        entrypos=_fastqandfurious.entrypos))
+    assert len(views) == len(entries)
+    for view, entry in zip(views, entries):
+        header, sequence, quality = entry
+        assert view.header == header
+        assert view.sequence == sequence
+        assert view.quality == quality
+        assert len(view) == view.seq_len == len(sequence)
+        assert isinstance(view.sequence_view, memoryview)
+        assert view.sequence_view == sequence
+        assert view.header_view == header
+        assert view.quality_view == quality
+        assert repr(view).startswith('EntryView(')
+    # Positions are relative to the buffer.
+    view = func(data, positions[1], 0)
+    assert view.positions == tuple(positions[1])
+    assert view.sequence == entries[1][1]
+    # The buffer reused across refills would be overwritten.
+    with pytest.raises(ValueError):
+        list(fastqandfurious.readfastq_iter(io.BytesIO(data), bufsize,
+                                            entryfunc=func,
+                                            reusebuffer=True))
+
+
+FILTER_ENTRIES = (
+    (b'ACGTACGTAC', b'IIIIIIIIII', -1),
+    (b'ACG', b'III', fastqandfurious.FILTER_MINLEN),
+    (b'ACGTACGTACGTACGTACGT', b'I' * 20, fastqandfurious.FILTER_MAXLEN),
+    (b'ACGTACGTAC', b'##########', fastqandfurious.FILTER_MINMEANQUAL),
+    (b'ACGTACGTAC', b'IIIII###II', fastqandfurious.FILTER_MINWINDOWQUAL),
+    (b'ACGTNNNNAC', b'IIIIIIIIII', fastqandfurious.FILTER_MAXNFRAC),
+)
+
+
+@pytest.mark.parametrize(
+    'func',
+    (fastqandfurious.filterentry, _fastqandfurious.filterentry))
+@pytest.mark.parametrize('sequence,quality,rule', FILTER_ENTRIES)
+def test_filterentry(func, sequence, quality, rule):
+    buf = b'\n@foo\n' + sequence + b'\n+\n' + quality + b'\n@bar\n'
+    pos = array('q', [-1, ] * 6)
+    assert fastqandfurious.entrypos(buf, 0, pos) == \
+        fastqandfurious.COMPLETE
+    entryfilter = fastqandfurious.EntryFilter(
+        minlen=5, maxlen=15, minmeanqual=20, minwindowqual=20, window=3,
+        maxnfrac=0.2)
+    assert func(buf, pos, entryfilter.spec) == rule
+    entryfilter = fastqandfurious.EntryFilter()
+    assert func(buf, pos, entryfilter.spec) == -1
+
+
+ADAPTER = b'AGATCGGAAGAGC'
+TRIM_ENTRIES = (
+    # sequence, quality, trimmer parameters, trimmed length, step
+    (b'ACGTACGGGGGG', b'I' * 12, {'polyg': 5}, 6, 'polyg'),
+    (b'ACGTACGGG', b'I' * 9, {'polyg': 5}, 9, None),
+    (b'ACGTACGTAC', b'IIIIIII###', {'quality': 20}, 7, 'quality'),
+    (b'ACGTACGTAC', b'IIIIII##5#', {'quality': 20}, 6, 'quality'),
+    (b'ACGTACGTAC', b'IIIIII##I#', {'quality': 20}, 9, 'quality'),
+    (b'ACGTACGTAC', b'I' * 10, {'quality': 20}, 10, None),
+    (b'ACGTACGTAC', b'IIIIII####', {'quality': 20, 'window': 4}, 6,
+     'quality'),
+    (b'ACGTACGTAC', b'IIII######', {'quality': 20, 'window': 20}, 4,
+     'quality'),
+    (b'ACGTACGTAGATCGGAAGAGCTT', b'I' * 23, {'adapter': ADAPTER}, 8,
+     'adapter'),
+    (b'ACGTACGTAGATCGCAAGAGCTT', b'I' * 23, {'adapter': ADAPTER}, 8,
+     'adapter'),
+    (b'ACGTACGTAGATCGCAAGAGCTT', b'I' * 23,
+     {'adapter': ADAPTER, 'maxerrorrate': 0}, 23, None),
+    (b'ACGTACGTACGTAGAT', b'I' * 16, {'adapter': ADAPTER}, 12, 'adapter'),
+    (b'ACGTACGTACGTCCAG', b'I' * 16, {'adapter': ADAPTER}, 16, None),
+    (b'ACGTACGTACGTCCAG', b'I' * 16, {'adapter': ADAPTER, 'minoverlap': 2},
+     14, 'adapter'),
+    (b'GGGGGGGG', b'I' * 8, {'polyg': 5, 'quality': 20, 'window': 4}, 0,
+     'polyg'),
+    (b'', b'', {'polyg': 5, 'quality': 20, 'window': 4}, 0, None),
+    (b'ACGTAGATCGGAAGGGGGGG', b'I' * 14 + b'#' * 6,
+     {'polyg': 5, 'quality': 20, 'adapter': ADAPTER}, 4, 'adapter'),
+)
+
+
+@pytest.mark.parametrize(
+    'trimentries',
+    (fastqandfurious.trimentries, _fastqandfurious.trimentries))
+@pytest.mark.parametrize('sequence,quality,params,length,step',
+                         TRIM_ENTRIES)
+def test_trimentries(trimentries, sequence, quality, params, length, step):
+    buf = b'\n@foo\n' + sequence + b'\n+\n' + quality + b'\n@bar\n'
+    pos = array('q', [-1, ] * 6)
+    assert fastqandfurious.entrypos(buf, 0, pos) == \
+        fastqandfurious.COMPLETE
+    trimmer = fastqandfurious.EntryTrimmer(trimentries=trimentries,
+                                           **params)
+    chunk = fastqandfurious.Chunk(buf, pos, 1, 0)
+    assert trimmer.trim(chunk) == (0 if step is None else 1)
+    assert buf[pos[2]:pos[3]] == sequence[:length]
+    assert buf[pos[4]:pos[5]] == quality[:length]
+    assert trimmer.trimmed == {name: int(name == step)
+                               for name in fastqandfurious.TRIM_STEPS}
+    # Trimming again does nothing more.
+    assert trimmer.trim(chunk) == 0
+
+
+@pytest.mark.parametrize(
+    'trimentries,copyentries',
+    ((fastqandfurious.trimentries, fastqandfurious.copyentries),
+     (_fastqandfurious.trimentries, _fastqandfurious.copyentries)))
+def test_trimentries_chunk(trimentries, copyentries):
+    data = b''.join(b'@read%i\n%s\n+read%i\n%s\n' % (i, sequence, i, quality)
+                    for i, (sequence, quality, _, _, _)
+                    in enumerate(TRIM_ENTRIES)) + b'@x\n'
+    chunk = next(fastqandfurious.readfastq_chunks(io.BytesIO(data),
+                                                  len(data)))
+    assert chunk.count == len(TRIM_ENTRIES)
+    trimmer = fastqandfurious.EntryTrimmer(
+        polyg=5, quality=20, adapter=ADAPTER, trimentries=trimentries)
+    assert trimmer.trim(chunk) == 12
+    assert trimmer.trimmed == {'polyg': 2, 'quality': 5, 'adapter': 5}
+    out = bytearray()
+    copyentries(chunk.buffer, chunk.positions, chunk.count, None, out, False)
+    entries = list(fastqandfurious.readfastq_iter(io.BytesIO(bytes(out)),
+                                                  1000))
+    assert len(entries) == len(TRIM_ENTRIES)
+    for i, (header, sequence, quality) in enumerate(entries):
+        pos = chunk.positions[(6*i):(6*i+6)]
+        assert sequence == chunk.buffer[pos[2]:pos[3]]
+        assert quality == chunk.buffer[pos[4]:pos[5]]
+        assert len(sequence) <= len(TRIM_ENTRIES[i][0])
+    # Untrimmed entries are copied as they are.
+    assert b'@read1\nACGTACGGG\n+read1\n' in out
+    assert b'@read0\nACGTAC\n+\nIIIIII\n' in out
+    pos = array('q', chunk.positions[:6])
+    pos[5] -= 1
+    with pytest.raises(ValueError):
+        trimentries(chunk.buffer, pos, 1, trimmer.spec, ADAPTER,
+                    trimmer.counts)
+    with pytest.raises(ValueError):
+        trimentries(chunk.buffer, pos, 1, array('d'), ADAPTER,
+                    trimmer.counts)
+
+
+@pytest.mark.parametrize(
+    'entryfunc',
+    (fastqandfurious.entryfunc, _fastqandfurious.entryfunc))
+@pytest.mark.parametrize('bufsize', (30, 100, 1000))
+def test_readfastq_filter(entryfunc, bufsize):
+    data = b''.join(b'@read%i\n%s\n+\n%s\n' % (i, sequence, quality)
+                    for i, (sequence, quality, rule)
+                    in enumerate(FILTER_ENTRIES * 3))
+    entryfilter = fastqandfurious.EntryFilter(
+        minlen=5, maxlen=15, minmeanqual=20, minwindowqual=20, window=3,
+        maxnfrac=0.2)
+    res = list(fastqandfurious.readfastq_iter(
+        io.BytesIO(data), bufsize, entryfunc=entryfunc,
+        entrypos=_fastqandfurious.entrypos, entryfilter=entryfilter))
+    assert [header for header, sequence, quality in res] == \
+        [b'read0', b'read6', b'read12']
+    assert entryfilter.rejected == {'minlen': 3, 'maxlen': 3,
+                                    'minmeanqual': 3, 'minwindowqual': 3,
+                                    'maxnfrac': 3}
+
+
+def _paired_data(n, suffixes):
+    data = list()
+    for suffix in suffixes:
+        data.append(b''.join(b'@read%i%s\nACGT%s\n+\nIIII%s\n' %
+                             (i, suffix, b'A' * (i % 7), b'I' * (i % 7))
+                             for i in range(n)))
+    return data
+
+
+@pytest.mark.parametrize(
+    'func',
+    (fastqandfurious.checkpairs, _fastqandfurious.checkpairs))
+def test_checkpairs(func):
+    buf1 = b'\n@a/1\nA\n+\nI\n@b 1:N:0\nA\n+\nI\n@c\nA\n+\nI\n@x\n'
+    buf2 = b'\n@a/2\nA\n+\nI\n@b 2:N:0\nA\n+\nI\n@d\nA\n+\nI\n@x\n'
+    positions1 = array('q', [-1, ] * 18)
+    positions2 = array('q', [-1, ] * 18)
+    assert fastqandfurious.entrypos_batch(buf1, 0, positions1)[0] == 3
+    assert fastqandfurious.entrypos_batch(buf2, 0, positions2)[0] == 3
+    assert func(buf1, positions1, 0, buf2, positions2, 0, 2) == -1
+    assert func(buf1, positions1, 0, buf2, positions2, 0, 3) == 2
+    assert func(buf1, positions1, 1, buf2, positions2, 0, 1) == 0
+    with pytest.raises(ValueError):
+        func(buf1, positions1, 1, buf2, positions2, 0, 3)
+
+
+@pytest.mark.parametrize(
+    'checkpairs',
+    (fastqandfurious.checkpairs, _fastqandfurious.checkpairs))
+@pytest.mark.parametrize('suffixes', ((b'/1', b'/2'),
+                                      (b' 1:N:0:ACGT', b' 2:N:0:ACGT')))
+def test_readfastq_paired(checkpairs, suffixes):
+    data1, data2 = _paired_data(50, suffixes)
+    entries1 = list(fastqandfurious.readfastq_iter(io.BytesIO(data1), 1000))
+    entries2 = list(fastqandfurious.readfastq_iter(io.BytesIO(data2), 1000))
+    # Different buffer sizes give different chunks for each stream.
+    res = list(fastqandfurious.readfastq_paired(
+        io.BytesIO(data1), fastqandfurious.ReadAheadReader(
+            io.BytesIO(data2), blocksize=100),
+        100, entryfunc=_fastqandfurious.entryfunc, checkpairs=checkpairs))
+    assert res == list(zip(entries1, entries2))
+    batches = list(fastqandfurious.readfastq_paired(
+        io.BytesIO(data1), io.BytesIO(data2 + b'\n' * 150), 100,
+        checkpairs=checkpairs, batches=True))
+    assert sum(batch1.count for batch1, batch2 in batches) == 50
+    for batch1, batch2 in batches:
+        assert batch1.count == batch2.count
+        assert len(batch1.positions) == 6 * batch1.count
+
+
+def test_readfastq_paired_mismatch():
+    data1, data2 = _paired_data(50, (b'/1', b'/2'))
+    with pytest.raises(ValueError):
+        list(fastqandfurious.readfastq_paired(
+            io.BytesIO(data1), io.BytesIO(data2.replace(b'read30', b'x')),
+            100, checkpairs=_fastqandfurious.checkpairs))
+    with pytest.raises(ValueError):
+        list(fastqandfurious.readfastq_paired(
+            io.BytesIO(data1), io.BytesIO(data2[:len(data2)//2]), 100))
+    res = list(fastqandfurious.readfastq_paired(
+        io.BytesIO(data1), io.BytesIO(data2.replace(b'read30', b'x')),
+        100, checkpairs=None))
+    assert len(res) == 50
+
+
+class _AsyncPieces(object):
+    """Stream returning data in small pieces from a coroutine `read`."""
+
+    def __init__(self, data, piecesize):
+        self._data = data
+        self._piecesize = piecesize
+
+    async def read(self, n):
+        await asyncio.sleep(0)
+        blob = self._data[:min(n, self._piecesize)]
+        self._data = self._data[len(blob):]
+        return blob
+
+
+@pytest.mark.parametrize(
+    'entryfunc',
+    (fastqandfurious.entryfunc, _fastqandfurious.entryfunc))
+@pytest.mark.parametrize('bufsize,piecesize', ((100, 7), (100, 1000),
+                                               (700, 50)))
+def test_readfastq_aiter(entryfunc, bufsize, piecesize):
+    with open('data/test.fq', 'rb') as fh:
+        data = fh.read()
+    entries = list(fastqandfurious.readfastq_iter(io.BytesIO(data), 1000))
+
+    async def collect(fh, batches):
+        return [entry async for entry in fastqandfurious.readfastq_aiter(
+            fh, bufsize, entryfunc=entryfunc,
+            entrypos=_fastqandfurious.entrypos, batches=batches)]
+
+    res = asyncio.run(collect(_AsyncPieces(data, piecesize), False))
+    assert res == entries
+    res = asyncio.run(collect(_AsyncPieces(data, piecesize), True))
+    assert all(len(batch) > 0 for batch in res)
+    assert [entry for batch in res for entry in batch] == entries
+    # Pieces are gathered into full buffers before parsing.
+    assert [len(batch) for batch in res] == \
+        [len(batch) for batch in asyncio.run(
+            collect(_AsyncPieces(data, len(data)), True))]
+
+    async def collect_streamreader():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await collect(reader, False)
+
+    assert asyncio.run(collect_streamreader()) == entries
+
+
+def test_readfastq_aiter_incomplete():
+    async def collect(data):
+        return [entry async for entry in fastqandfurious.readfastq_aiter(
+            _AsyncPieces(data, 10), 100)]
+
+    assert asyncio.run(collect(b'')) == []
+    with pytest.raises(ValueError):
+        asyncio.run(collect(b'@foo\nACGT\n+\nIIII\n@bar\nAC'))
+
+
+@pytest.mark.parametrize(
+    'stats_chunk',
+    (fastqandfurious.stats_chunk, _fastqandfurious.stats_chunk))
+def test_fastq_stats(stats_chunk):
+    data = b'@a\nACGT\n+\nIIII\n@b\nGGNAAC\n+\n##II#I\n@c\nTT\n+\nII\n'
+    stats = fastqandfurious.fastq_stats(io.BytesIO(data), 20,
+                                        stats_chunk=stats_chunk, maxlen=5)
+    assert stats.count == 3
+    assert stats.lengths == array('q', [0, 0, 1, 0, 1, 1])
+    assert stats.coverage() == array('q', [3, 3, 2, 2, 1])
+    assert stats.qualsums == array('q', [40 + 2 + 40, 40 + 2 + 40,
+                                         40 + 40, 40 + 40, 2])
+    assert list(stats.meanquality()) == [82 / 3, 82 / 3, 40, 40, 2]
+    assert stats.basecounts[:5] == array('q', [1, 0, 1, 1, 0])
+    assert stats.basecounts[10:15] == array('q', [0, 0, 1, 0, 1])
+    assert sum(stats.basecounts) == 4 + 5 + 2
+    assert stats.gchist[50] == 2
+    assert stats.gchist[0] == 1
+    other = fastqandfurious.fastq_stats(io.BytesIO(data), 200,
+                                        stats_chunk=stats_chunk, maxlen=5)
+    stats.merge(other)
+    assert stats.count == 6
+    assert stats.lengths == array('q', [0, 0, 2, 0, 2, 2])
+    with pytest.raises(ValueError):
+        stats.merge(fastqandfurious.FastqStats(maxlen=6))
+
+
+def test_fastq_stats_file():
+    filename = 'data/test_longqualityheader.fq'
+    res = list()
+    for stats_chunk in (fastqandfurious.stats_chunk,
+                        _fastqandfurious.stats_chunk):
+        with open(filename, 'rb') as fh:
+            stats = fastqandfurious.fastq_stats(fh, 100,
+                                                stats_chunk=stats_chunk)
+        res.append((stats.lengths, stats.qualsums, stats.basecounts,
+                    stats.gchist))
+    assert res[0] == res[1]
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, 1000))
+    assert stats.count == len(entries)
+    assert sum(stats.qualsums) == sum(sum(quality) - 33 * len(quality)
+                                      for header, sequence, quality
+                                      in entries)
+    numpy = pytest.importorskip('numpy')
+    arrays = stats.tonumpy()
+    assert arrays['basecounts'].shape == (stats.maxlen, 5)
+    assert numpy.array_equal(arrays['basecounts'].sum(axis=1),
+                             arrays['coverage'])
+
+
+ILLUMINA_HEADERS = (
+    # header, fields (run, lane, tile, x, y, read, filtered, control),
+    # barcode, status
+    (b'M00123:12:000000000-A1B2C:1:1101:15589:1331 1:N:0:ACGTACGT',
+     (12, 1, 1101, 15589, 1331, 1, 0, 0), b'ACGTACGT',
+     fastqandfurious.ILLUMINA_OK),
+    (b'NB551:7:HXYZ:4:21612:2000:19 2:Y:18:ACGTAC+TTGACC',
+     (7, 4, 21612, 2000, 19, 2, 1, 18), b'ACGTAC+T',
+     fastqandfurious.ILLUMINA_BARCODE_TRUNCATED),
+    (b'A:1:FC:2:3:4:5:GATTACA 1:N:0:',
+     (1, 2, 3, 4, 5, 1, 0, 0), b'', fastqandfurious.ILLUMINA_OK),
+    (b'A:1:FC:2:3:4:5',
+     (1, 2, 3, 4, 5, -1, -1, -1), b'', fastqandfurious.ILLUMINA_OK),
+    (b'A:1:FC:2:3:4:5 1:N:0:1 extra',
+     (1, 2, 3, 4, 5, 1, 0, 0), b'1', fastqandfurious.ILLUMINA_OK),
+    (b'SRR001666.1 071112_SLXA:3:1:13:1', (-1, ) * 8, b'',
+     fastqandfurious.ILLUMINA_MALFORMED),
+    (b'A:1:FC:2:x:4:5 1:N:0:ACGT', (-1, ) * 8, b'',
+     fastqandfurious.ILLUMINA_MALFORMED),
+    (b'A:1:FC:2:3:4:5 1:U:0:ACGT', (-1, ) * 8, b'',
+     fastqandfurious.ILLUMINA_MALFORMED),
+    (b'A:1:FC:2:3:4:5:U:V 1:N:0:ACGT', (-1, ) * 8, b'',
+     fastqandfurious.ILLUMINA_MALFORMED),
+    (b'A:1:FC:2:3:4:5 1:N', (-1, ) * 8, b'',
+     fastqandfurious.ILLUMINA_MALFORMED),
+    (b'A:1:FC:2:3:4:1234567890123456789', (-1, ) * 8, b'',
+     fastqandfurious.ILLUMINA_MALFORMED),
+    (b'::FC:2:3:4:5', (-1, ) * 8, b'',
+     fastqandfurious.ILLUMINA_MALFORMED),
+)
+
+
+@pytest.mark.parametrize(
+    'illumina_headers',
+    (fastqandfurious.illumina_headers, _fastqandfurious.illumina_headers))
+def test_illumina_headers(illumina_headers):
+    data = b''.join(b'@%s\nACGT\n+\nIIII\n' % header
+                    for header, _, _, _ in ILLUMINA_HEADERS) + b'@x\n'
+    chunk = next(fastqandfurious.readfastq_chunks(io.BytesIO(data),
+                                                  len(data)))
+    assert chunk.count == len(ILLUMINA_HEADERS)
+    for name in fastqandfurious.ILLUMINA_FIELDS + ('nfields', 'ok',
+                                                   'malformed'):
+        name = 'ILLUMINA_%s' % name.upper()
+        assert getattr(fastqandfurious, name) == \
+            getattr(_fastqandfurious, name)
+    headers = fastqandfurious.IlluminaHeaders(
+        chunk, barcodelen=8, illumina_headers=illumina_headers)
+    assert len(headers) == len(ILLUMINA_HEADERS)
+    assert headers.nbad == 8
+    names = ('run', 'lane', 'tile', 'x', 'y', 'read', 'filtered', 'control')
+    columns = [headers.column(name) for name in names]
+    for i, (header, values, barcode, status) in enumerate(ILLUMINA_HEADERS):
+        assert tuple(column[i] for column in columns) == values
+        assert headers.barcode(i) == barcode
+        assert headers.status[i] == status
+        if status == fastqandfurious.ILLUMINA_MALFORMED:
+            assert headers.instrument(i) is None
+            assert headers.flowcell(i) is None
+        else:
+            instrument, _, flowcell = header.split(b':', 3)[:3]
+            assert headers.instrument(i) == instrument
+            assert headers.flowcell(i) == flowcell
+    with pytest.raises(ValueError):
+        illumina_headers(chunk.buffer, chunk.positions, chunk.count,
+                         array('q'), bytearray(), 8, bytearray())
+
+
+def test_illumina_headers_numpy():
+    numpy = pytest.importorskip('numpy')
+    data = b''.join(b'@%s\nACGT\n+\nIIII\n' % header
+                    for header, _, _, _ in ILLUMINA_HEADERS[:3]) + b'@x\n'
+    chunk = next(fastqandfurious.readfastq_chunks(io.BytesIO(data),
+                                                  len(data)))
+    res = fastqandfurious.IlluminaHeaders(chunk, barcodelen=8).tonumpy()
+    assert set(fastqandfurious.ILLUMINA_FIELDS) < set(res)
+    assert res['tile'].tolist() == [1101, 21612, 3]
+    assert res['barcode'].tolist() == [b'ACGTACGT', b'ACGTAC+T', b'']
+    assert numpy.count_nonzero(res['status']) == 1
+
+
+def test_kmerhash():
+    assert fastqandfurious.kmerhash(0, 42) != fastqandfurious.kmerhash(1, 42)
+    assert fastqandfurious.kmerhash(0, 42) != fastqandfurious.kmerhash(0, 43)
+    assert 0 <= fastqandfurious.kmerhash(2**64 - 1, 0) < 2**64
+
+
+@pytest.mark.parametrize(
+    'kmerhashes_chunk,sketch_chunk',
+    ((fastqandfurious.kmerhashes_chunk, fastqandfurious.sketch_chunk),
+     (_fastqandfurious.kmerhashes_chunk, _fastqandfurious.sketch_chunk)))
+def test_kmerhashes_chunk(kmerhashes_chunk, sketch_chunk):
+    data = (b'\n@a\nACGTTGCA\n+\nIIIIIIII\n@b\nTGCAACGT\n+\nIIIIIIII\n'
+            b'@c\nAACNAAAT\n+\nIIIIIIII\n@x\n')
+    positions = array('q', [0] * 6 * 4)
+    count, offset, status = _fastqandfurious.entrypos_batch(data, 0,
+                                                            positions)
+    assert count == 3
+    hashes = array('Q', kmerhashes_chunk(data, positions, count, 3, 42))
+    # 6 k-mers in each of the first 2 entries, and 3 in the third
+    # one (the k-mers with N are skipped).
+    assert len(hashes) == 6 + 6 + 3
+    # The second sequence is the reverse complement of the first one.
+    assert sorted(hashes[:6]) == sorted(hashes[6:12])
+    # AAC, AAA, and AAT are the canonical k-mers for AAC/GTT, AAA/TTT,
+    # and AAT/ATT.
+    assert hashes[12:] == array(
+        'Q', (fastqandfurious.kmerhash(x, 42) for x in (0b1, 0b0, 0b11)))
+    assert array('Q', kmerhashes_chunk(data, positions, count, 9, 42)) \
+        == array('Q')
+    sketch = array('Q', [0] * 4)
+    n = sketch_chunk(data, positions, count, 3, 42, sketch, 0)
+    assert n == 4
+    assert list(sketch) == sorted(set(hashes))[:4]
+    # Adding the same k-mers again does not change the sketch.
+    assert sketch_chunk(data, positions, count, 3, 42, sketch, n) == n
+    assert list(sketch) == sorted(set(hashes))[:4]
+    with pytest.raises(ValueError):
+        kmerhashes_chunk(data, positions, count, 33, 42)
+    with pytest.raises(ValueError):
+        kmerhashes_chunk(data, positions, 5, 3, 42)
+    with pytest.raises(ValueError):
+        sketch_chunk(data, positions, count, 3, 42, sketch, 5)
+
+
+def test_sketch_fastq():
+    filename = 'data/test_longqualityheader.fq'
+    sketches = list()
+    for sketch_chunk in (fastqandfurious.sketch_chunk,
+                         _fastqandfurious.sketch_chunk):
+        with open(filename, 'rb') as fh:
+            sketches.append(fastqandfurious.sketch_fastq(
+                fh, 100, 50, 21, sketch_chunk=sketch_chunk))
+    assert sketches[0].hashes == sketches[1].hashes
+    sketch = sketches[0]
+    assert len(sketch) == 50
+    assert list(sketch.hashes) == sorted(set(sketch.hashes))
+    assert sketch.jaccard(sketches[1]) == 1.0
+    empty = fastqandfurious.BottomSketch(50, 21)
+    assert empty.jaccard(sketch) == 0.0
+    empty.merge(sketch)
+    assert empty.hashes == sketch.hashes
+    with pytest.raises(ValueError):
+        sketch.merge(fastqandfurious.BottomSketch(50, 31))
+
+
+@pytest.mark.parametrize(
+    'formatentries',
+    (fastqandfurious.formatentries, _fastqandfurious.formatentries))
+def test_formatentries(formatentries):
+    out = bytearray(b'xx')
+    entries = [(b'a', b'ACGT', b'IIII'), (b'b c', bytearray(b'GG'), b'#I')]
+    n = formatentries(entries, out, False)
+    assert out == b'xx@a\nACGT\n+\nIIII\n@b c\nGG\n+\n#I\n'
+    assert n == len(out) - 2
+    out = bytearray()
+    assert formatentries(entries, out, True) == len(out)
+    assert out == b'>a\nACGT\n>b c\nGG\n'
+    assert formatentries([], out, False) == 0
+    with pytest.raises(ValueError):
+        formatentries([(b'a', b'ACGT', b'III')], bytearray(), False)
+    with pytest.raises(ValueError):
+        formatentries([(b'a', b'ACGT')], bytearray(), False)
+    with pytest.raises(TypeError):
+        formatentries([(b'a', 'ACGT', b'IIII')], bytearray(), False)
+
+
+@pytest.mark.parametrize(
+    'copyentries',
+    (fastqandfurious.copyentries, _fastqandfurious.copyentries))
+def test_copyentries(copyentries):
+    data = (b'\n@a\nACGT\n+a\nIIII\n@b\nGG\n+\n#I\n@c\nT\n+\nI\n@x\n')
+    positions = array('q', [0] * 6 * 4)
+    count, offset, status = _fastqandfurious.entrypos_batch(data, 0,
+                                                            positions)
+    assert count == 3
+    out = bytearray()
+    n = copyentries(data, positions, count, None, out, False)
+    assert out == data[1:-3]
+    assert n == len(out)
+    out = bytearray()
+    copyentries(data, positions, count, b'\x01\x00\x01', out, False)
+    assert out == b'@a\nACGT\n+a\nIIII\n@c\nT\n+\nI\n'
+    out = bytearray()
+    copyentries(data, positions, count, bytearray([0, 1, 1]), out, True)
+    assert out == b'>b\nGG\n>c\nT\n'
+    with pytest.raises(ValueError):
+        copyentries(data, positions, count, b'\x01', out, False)
+    with pytest.raises(ValueError):
+        copyentries(data[:10], positions, count, None, out, False)
+
+
+@pytest.mark.parametrize('extension', ('fq', 'fq.gz', 'fq.bz2'))
+@pytest.mark.parametrize('writebehind', (0, 2))
+@pytest.mark.parametrize(
+    'formatentries,copyentries',
+    ((fastqandfurious.formatentries, fastqandfurious.copyentries),
+     (_fastqandfurious.formatentries, _fastqandfurious.copyentries)))
+def test_fastqwriter(tmp_path, extension, writebehind, formatentries,
+                     copyentries):
+    filename = 'data/test_longqualityheader.fq'
+    with open(filename, 'rb') as fh:
+        entries = list(fastqandfurious.readfastq_iter(fh, 1000))
+    outfilename = str(tmp_path / ('out.' + extension))
+    fh = fastqandfurious.automagic_open(outfilename, mode='wb',
+                                        writebehind=writebehind)
+    with fastqandfurious.FastqWriter(fh, bufsize=100,
+                                     formatentries=formatentries,
+                                     copyentries=copyentries) as writer:
+        with open(filename, 'rb') as fhin:
+            for chunk in fastqandfurious.readfastq_chunks(fhin, 200):
+                writer.writechunk(chunk)
+        writer.writeentries(iter(entries))
+        writer.write(*entries[0])
+    assert fh.closed
+    with fastqandfurious.automagic_open(outfilename) as fh:
+        res = list(fastqandfurious.readfastq_iter(fh, 1000))
+    assert res == entries + entries + entries[:1]
+    with pytest.raises(ValueError):
+        writer.write(*entries[0])
+
+
+def test_writebehindwriter_error():
+
+    class FailingStream(io.BytesIO):
+        def write(self, b):
+            raise IOError('Failing stream.')
+
+    fh = fastqandfurious.WriteBehindWriter(FailingStream())
+    fh.write(b'foo')
+    with pytest.raises(IOError):
+        fh.close()
+
+
+def test_gzip_checkpoints():
+    rng = random.Random(123)
+    data = b''.join(b'@r%i\n%s\n+\n%s\n' % (i,
+                                               bytes(rng.choices(b'ACGT',
+                                                                 k=100)),
+                                               bytes(rng.choices(b'I#5',
+                                                                 k=100)))
+                    for i in range(3000))
+    cdata = (gzip.compress(data[:100000]) + b'\x00\x00' +
+             gzip.compress(data[100000:]))
+    checkpoints = _fastqandfurious.gzip_checkpoints(cdata, 2**15)
+    assert len(checkpoints) > 2
+    assert checkpoints[0][2] == 0
+    for cpos, bits, upos, window in checkpoints:
+        assert window == data[max(upos - 2**15, 0):upos]
+        assert _fastqandfurious.gzip_extract(
+            cdata, cpos, bits, window, 10, 1000) == \
+            data[(upos + 10):(upos + 1010)]
+        # Decompress across the end of the first gzip member.
+        assert _fastqandfurious.gzip_extract(
+            cdata, cpos, bits, window, 0, len(data)) == data[upos:]
+    assert _fastqandfurious.gzip_extract(cdata, 0, 0, None, 5, 10) == \
+        data[5:15]
+    pieces = list()
+    assert _fastqandfurious.gzip_scan(cdata, 2**15, pieces.append) == \
+        (checkpoints, zlib.crc32(cdata))
+    assert b''.join(pieces) == data
+
+    def stop(piece):
+        raise KeyError()
+    with pytest.raises(KeyError):
+        _fastqandfurious.gzip_scan(cdata, 2**15, stop)
+    with pytest.raises(ValueError):
+        _fastqandfurious.gzip_scan(cdata[:-100], 2**15, pieces.append)
+    with pytest.raises(ValueError):
+        _fastqandfurious.gzip_checkpoints(cdata[:-100], 2**15)
+    with pytest.raises(ValueError):
+        _fastqandfurious.gzip_checkpoints(b'not gzip-compressed', 2**15)
+
+
+@pytest.mark.parametrize('bgzf', (False, True))
+def test_indexedfastq_gzip(tmp_path, monkeypatch, bgzf):
+    filename = 'data/test_longqualityheader.fq'
+    with open(filename, 'rb') as fh:
+        data = fh.read()
+    entries = list(fastqandfurious.readfastq_iter(io.BytesIO(data), 1000))
+    gzfilename = str(tmp_path / 'test.fq.gz')
+    with open(gzfilename, 'wb') as fh:
+        if bgzf:
+            for i in range(0, len(data), 200):
+                fh.write(_bgzf_block(data[i:(i+200)]))
+            fh.write(_bgzf_block(b''))
+        else:
+            fh.write(gzip.compress(data))
+    indexfilename = str(tmp_path / 'test.fq.gz.idx')
+    n = fastqandfurious.build_index(gzfilename, indexfilename, 100,
+                                    names=True, span=100)
+    assert n == len(entries)
+    names = [header.split(b' ')[0] for header, sequence, quality in entries]
+    with fastqandfurious.IndexedFastq(gzfilename, indexfilename,
+                                      entryfunc=fastqandfurious.entryfunc,
+                                      verify=True) as idx:
+        assert idx.flags & fastqandfurious.INDEX_FLAG_GZIP
+        assert len(idx) == len(entries)
+        assert idx[:] == entries
+        assert idx[2:5] == entries[2:5]
+        assert idx[::3] == entries[::3]
+        assert [idx[i] for i in range(len(idx))] == entries
+        assert idx[::-2] == entries[::-2]
+        assert idx.take([3, -1, 2, 3]) == \
+            [entries[3], entries[-1], entries[2], entries[3]]
+        with pytest.raises(IndexError):
+            idx.take([0, len(entries)])
+        # One decompression for the entries after each checkpoint.
+        extracts = list()
+
+        def gzip_extract(*args):
+            extracts.append(args)
+            return gzip_extract_orig(*args)
+        gzip_extract_orig = _fastqandfurious.gzip_extract
+        monkeypatch.setattr(_fastqandfurious, 'gzip_extract', gzip_extract)
+        assert idx.take(range(len(entries) - 1, -1, -1)) == entries[::-1]
+        assert len(extracts) <= len(idx._upos) + 1
+        monkeypatch.undo()
+        assert idx.lookup(names[-1]) == [len(entries) - 1]
+        assert idx.fetch([names[3], names[1]]) == [entries[1], entries[3]]
+    with fastqandfurious.IndexedFastq(
+            gzfilename, indexfilename,
+            entryfunc=fastqandfurious.entryfunc_abspos) as idx:
+        assert idx[3].tolist() == idx.positions[18:24].tolist()
+    with open(gzfilename, 'r+b') as fh:
+        fh.truncate(fh.seek(0, io.SEEK_END) - 30)
+    with pytest.raises(ValueError):
+        fastqandfurious.build_index(gzfilename, indexfilename, 100, span=100)
+
+
+def _newline_scans():
+    current = _fastqandfurious.newline_scan()
+    res = list()
+    for name in ('scalar', 'sse2', 'avx2'):
+        try:
+            _fastqandfurious.newline_scan(name)
+        except ValueError:
+            continue
+        res.append(name)
+    _fastqandfurious.newline_scan(current)
+    return res
+
+
+def _check_entrypos_batch(blob, offset):
+    """Check that the batch scans (C and Python) find the same entries
+    as the C scan for one entry at a time."""
+    expected = array('q', [0] * 6 * 600)
+    count = 0
+    o = offset
+    while True:
+        row = expected[(6*count):(6*count+6)]
+        status = _fastqandfurious.entrypos(blob, o, row)
+        expected[(6*count):(6*count+6)] = row
+        if status != _fastqandfurious.COMPLETE:
+            break
+        o = row[5] - 1
+        count += 1
+    positions = array('q', [0] * 6 * 600)
+    assert _fastqandfurious.entrypos_batch(blob, offset, positions) == \
+        (count, o, status)
+    assert positions[:(6*count)] == expected[:(6*count)]
+    # The status for an incomplete entry can differ in Python.
+    positions = array('q', [0] * 6 * 600)
+    assert fastqandfurious.entrypos_batch(blob, offset, positions)[:2] == \
+        (count, o)
+    assert positions[:(6*count)] == expected[:(6*count)]
+    entries, o_build, status_build = _fastqandfurious.entrybuild_batch(
+        blob, offset, array('q', [0] * 6),
+        _fastqandfurious.BUILD_ABSPOS, 0)
+    assert (o_build, status_build) == (o, status)
+    assert [x for e in entries for x in e] == expected[:(6*count)].tolist()
+    return count
+
+
+@pytest.mark.parametrize('name', _newline_scans())
+def test_newline_scan(name):
+    rng = random.Random(42)
+    pieces = [b'\n']
+    for i in range(500):
+        n = rng.choice((1, 31, 32, 63, 64, 65, rng.randrange(1, 200)))
+        header = b'r%i%s' % (i, b' x' * rng.randrange(40))
+        # Quality strings can begin with @ or +.
+        pieces.append(b'@%s\n%s\n+%s\n%s\n' % (
+            header, bytes(rng.choices(b'ACGTN', k=n)),
+            rng.choice((b'', header)),
+            bytes(rng.choices(b'@+I#', weights=(1, 1, 20, 20), k=n))))
+    data = b''.join(pieces)
+    current = _fastqandfurious.newline_scan()
+    try:
+        assert _fastqandfurious.newline_scan(name) == name
+        for end in (len(data), len(data) - 1, len(data) // 2, 100, 3):
+            for offset in (0, 1, 65):
+                _check_entrypos_batch(data[:end], offset)
+    finally:
+        _fastqandfurious.newline_scan(current)
+    with pytest.raises(ValueError):
+        _fastqandfurious.newline_scan('foo')
+
+
+def test_entrypos_batch_fixedlength():
+    rng = random.Random(123)
+
+    def entries(n, length, qualheader=False):
+        res = list()
+        for i in range(n):
+            header = b'r%i:%i' % (i, rng.randrange(10**6))
+            res.append(b'@%s\n%s\n+%s\n%s\n' % (
+                header, bytes(rng.choices(b'ACGT', k=length)),
+                header if qualheader else b'',
+                bytes(rng.choices(b'@+I#', weights=(1, 1, 20, 20),
+                                  k=length))))
+        return res
+
+    pieces = ([b'\n'] + entries(50, 150) + entries(5, 100) +
+              entries(3, 100, qualheader=True) + entries(20, 100) +
+              # Multi-line sequence and quality.
+              [b'@m\nACGT\nAC\n+\nIIII\nII\n'] * 3 + entries(20, 150))
+    data = b''.join(pieces)
+    assert _check_entrypos_batch(data, 0) == len(pieces) - 2
+    for end in range(len(data) - 700, len(data)):
+        _check_entrypos_batch(data[:end], 0)
+    # The fast path checks the delimiters where the layout expects them.
+    broken = list(pieces)
+    broken[10] = broken[10].replace(b'\n+\n', b'\nA+\n')
+    broken[20] = broken[20][:-2] + b'\n'
+    broken[30] = broken[30].replace(b'\n@', b'\nX@', 1)
+    _check_entrypos_batch(b''.join(broken), 0)
+    # A shorter entry and the next one can put delimiters where the
+    # layout of the previous entry expects them (150 = 2 * 40 + 6 + 30 + 34).
+    pieces = [b'\n', b'@a\n%s\n+\n%s\n' % (b'A' * 150, b'I' * 150),
+              b'@b\n%s\n+\n%s\n' % (b'C' * 40, b'I' * 40),
+              b'@%s\n%s\n+\n%s\n' % (b'c' * 30, b'G' * 34, b'I' * 34),
+              b'@d\n%s\n+\n%s\n' % (b'T' * 150, b'I' * 150), b'@x\n']
+    data = b''.join(pieces)
+    assert _check_entrypos_batch(data, 0) == 4
+    with io.BytesIO(data[1:-3]) as fh:
+        assert [header for header, _, _ in fastqandfurious.readfastq_iter(
+            fh, 1000, entrypos=_fastqandfurious.entrypos)] == \
+            [b'a', b'b', b'c' * 30, b'd']